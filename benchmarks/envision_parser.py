@@ -0,0 +1,67 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Benchmark the Envision csv parser: `readout_io.read_envision_csv` against its fast mode.
+
+    Both parsers read synthetic Envision exports of 1536-well plates with several channels; the time includes the
+    float conversion in ``Readout.__init__``.
+
+    Usage: python benchmarks/envision_parser.py (with hts installed, or on the PYTHONPATH)
+"""
+
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from hts.plate_data import readout, readout_io
+
+HEIGHT = 32
+WIDTH = 48
+N_CHANNELS = 4
+N_FILES = 20
+REPEAT = 5
+
+
+def write_envision_csv(file, random):
+    lines = ["Plate information", "Plate,Repeat,Barcode,Measured height,Kinetics,Measurement date,",
+             "1,1,,14.76,0,5/23/2015 16:41:02,", ""]
+    for i_channel in range(N_CHANNELS):
+        lines += ["Background information", "Plate,Label,Result,Signal,Flashes/Time,Meastime,MeasInfo,",
+                  "1,US LUM 1536 (cps),0,{},0.1,00:00:00.000,De=USLum Ex=N/A Em=N/A Wdw=N/A,".format(i_channel), ""]
+        lines += [",".join(row) + "," for row in random.randint(1000, 9000000, size=(HEIGHT, WIDTH)).astype(str)]
+        lines += ["", ""]
+    lines += ["Basic assay information", "Assay ID: ,,,,13383", "", "Protocol information", "Protocol:"]
+    lines += ["Protocol setting {},,,,{}".format(i, i) for i in range(200)]
+    with open(file, "w") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+def parse(files, fast):
+    return [readout.Readout(data=readout_io.read_envision_csv(file, fast=fast)[1]) for file in files]
+
+
+def main():
+    random = np.random.RandomState(0)
+    with tempfile.TemporaryDirectory() as path:
+        files = [os.path.join(path, "envision_{}.csv".format(i)) for i in range(N_FILES)]
+        for file in files:
+            write_envision_csv(file, random)
+        megabytes = sum(os.path.getsize(file) for file in files) / 1e6
+
+        for classic, fast in zip(parse(files, fast=False), parse(files, fast=True)):
+            assert all(np.array_equal(classic.get_data(i), fast.get_data(i)) for i in classic.data)
+
+        print("{} files, {} x {} wells, {} channels, {:.1f} MB (best of {}):".format(N_FILES, HEIGHT, WIDTH,
+              N_CHANNELS, megabytes, REPEAT))
+        timings = {}
+        for fast in [False, True]:
+            timings[fast] = min(timeit.repeat(lambda: parse(files, fast), number=1, repeat=REPEAT))
+            print("{:<8} {:.1f} ms ({:.1f} MB/s)".format("fast:" if fast else "classic:", timings[fast] * 1000,
+                  megabytes / timings[fast]))
+        print("speedup: {:.1f}x".format(timings[False] / timings[True]))
+
+
+if __name__ == "__main__":
+    main()
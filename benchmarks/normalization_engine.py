@@ -0,0 +1,89 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Benchmark the batched preprocessing methods (`data_normalization.BATCHED_PREPROCESSING`) against the
+    plate wise ``Plate`` methods, for runs of 100, 1000 and 5000 plates.
+
+    The plates have 384 wells and share one plate layout.
+
+    Usage: python benchmarks/normalization_engine.py (with hts installed, or on the PYTHONPATH)
+"""
+
+import timeit
+
+import numpy as np
+
+from hts.data_tasks import data_normalization
+from hts.plate.plate import Plate
+from hts.plate_data.plate_layout import PlateLayout
+from hts.plate_data.readout import Readout
+from hts.run.run import Run
+
+HEIGHT = 16
+WIDTH = 24
+N_PLATES = [100, 1000, 5000]
+REPEAT = 3
+METHODS = {
+    "calculate_linearly_normalized_signal": {"unnormalized_key": "donor", "normalized_0": "buffer",
+                                             "normalized_1": "fluorophore_donor", "normalized_key": "normalized"},
+    "calculate_net_fret": {"donor_channel": "donor", "acceptor_channel": "acceptor", "net_fret_key": "normalized"},
+    "calculate_control_normalized_signal": {"data_tag_readout": "acceptor", "negative_control_key": "buffer",
+                                            "positive_control_key": "fluorophore_acceptor",
+                                            "data_tag_normalized_readout": "normalized", "local": "False"},
+    "calculate_significance_compared_to_null_distribution": {
+        "data_tag_readout": "acceptor", "sample_tag_null_distribution": "buffer", "data_tag_standard_score": "score",
+        "data_tag_p_value": "normalized", "is_higher_value_better": "True"},
+}
+
+
+def create_run(random, n_plates):
+    layout = np.array([["s_{}".format(i_row * WIDTH + i_column) for i_column in range(WIDTH)]
+                       for i_row in range(HEIGHT)], dtype=object)
+    layout[:, 0] = "buffer"
+    layout[:, 1] = "fluorophore_donor"
+    layout[:, WIDTH - 1] = "fluorophore_acceptor"
+    plate_layout = PlateLayout(layout=layout.tolist())
+    plates = [Plate(data={"readout": Readout(data={"donor": random.normal(size=(HEIGHT, WIDTH)),
+                                                   "acceptor": random.normal(size=(HEIGHT, WIDTH))}),
+                          "plate_layout": plate_layout}, name="p{}".format(i_plate), height=HEIGHT, width=WIDTH)
+              for i_plate in range(n_plates)]
+    return Run(plates=plates)
+
+
+def reset(run):
+    for i_plate in run.plates.values():
+        for data_tag in ["normalized", "score"]:
+            i_plate.readout.data.pop(data_tag, None)
+
+
+def preprocess_plate_wise(run, method, config):
+    for i_plate in run.plates.values():
+        i_plate.preprocess(method, **config)
+
+
+def main():
+    random = np.random.RandomState(0)
+    for n_plates in N_PLATES:
+        test_run = create_run(random, n_plates)
+        print("{} plates, {} x {} wells (best of {}):".format(n_plates, HEIGHT, WIDTH, REPEAT))
+        for method, config in METHODS.items():
+            reset(test_run)
+            preprocess_plate_wise(test_run, method, config)
+            expected = test_run.get_readout_stack("normalized")
+            reset(test_run)
+            data_normalization.BATCHED_PREPROCESSING[method](test_run, **config)
+            assert np.array_equal(test_run.get_readout_stack("normalized"), expected)
+
+            timings = {}
+            for name, preprocess in [("plate wise", preprocess_plate_wise),
+                                     ("batched", data_normalization.BATCHED_PREPROCESSING[method])]:
+                timings[name] = min(timeit.repeat(lambda: preprocess(test_run, method, config) if
+                                                  name == "plate wise" else preprocess(test_run, **config),
+                                                  setup=lambda: reset(test_run), number=1, repeat=REPEAT))
+            print("    {:<54} plate wise: {:8.1f} ms, batched: {:7.1f} ms ({:.1f}x)".format(
+                method, timings["plate wise"] * 1000, timings["batched"] * 1000,
+                timings["plate wise"] / timings["batched"]))
+
+
+if __name__ == "__main__":
+    main()
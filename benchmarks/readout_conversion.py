@@ -0,0 +1,63 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Benchmark the float conversion of readout data in ``Readout.__init__``.
+
+    Compares the former per-cell conversion with the vectorized `readout.to_float_array`, on string matrices as
+    returned by the Envision parser for 1536-well plates with several channels.
+
+    Usage: python benchmarks/readout_conversion.py (with hts installed, or on the PYTHONPATH)
+"""
+
+import timeit
+
+import numpy as np
+
+from hts.plate_data import readout
+
+HEIGHT = 32
+WIDTH = 48
+N_CHANNELS = 4
+REPEAT = 10
+
+
+def convert_per_cell(data):
+    """ The former conversion in ``Readout.__init__``, extended by the NA mapping (empty cells raised before).
+    """
+    return {i: np.array([np.array([np.nan if datum in readout.NA_VALUES else float(datum) for datum in row])
+                         for row in j]) for i, j in data.items()}
+
+
+def convert_vectorized(data):
+    return {i: readout.to_float_array(j) for i, j in data.items()}
+
+
+def create_channels(n_na=0):
+    random = np.random.RandomState(0)
+    channels = {}
+    for i_channel in range(N_CHANNELS):
+        values = random.randint(1000, 260000, size=(HEIGHT, WIDTH)).astype(str).tolist()
+        for i_na in range(n_na):
+            values[i_na % HEIGHT][i_na % WIDTH] = ""
+        channels["channel_{}".format(i_channel)] = values
+    return channels
+
+
+def main():
+    channels = create_channels()
+    channels_with_na = create_channels(n_na=10)
+
+    for test_channels in [channels, channels_with_na]:
+        assert all(np.array_equal(convert_per_cell(test_channels)[i], j, equal_nan=True)
+                   for i, j in convert_vectorized(test_channels).items())
+
+    print("{} x {} wells, {} channels (best of {}):".format(HEIGHT, WIDTH, N_CHANNELS, REPEAT))
+    for label, test_channels in [("all numeric", channels), ("with empty cells", channels_with_na)]:
+        per_cell = min(timeit.repeat(lambda: convert_per_cell(test_channels), number=1, repeat=REPEAT))
+        vectorized = min(timeit.repeat(lambda: convert_vectorized(test_channels), number=1, repeat=REPEAT))
+        print("{:<17} per cell: {:.2f} ms, vectorized: {:.2f} ms ({:.1f}x)"
+              "".format(label, per_cell * 1000, vectorized * 1000, per_cell / vectorized))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Benchmark the run container (`run_container`) against pickle: file size, and load time of the full
+    run, of a few plates, and of one readout data tag.
+
+    The run has 1536-well plates with several readout data tags, and one per-plate plate layout.
+
+    Usage: python benchmarks/run_container.py (with hts installed, or on the PYTHONPATH)
+"""
+
+import os
+import pickle
+import tempfile
+import timeit
+
+import numpy as np
+
+from hts.plate.plate import Plate
+from hts.plate_data.plate_layout import PlateLayout
+from hts.plate_data.readout import Readout
+from hts.run.run import Run
+
+HEIGHT = 32
+WIDTH = 48
+N_PLATES = 200
+N_DATA_TAGS = 4
+REPEAT = 3
+
+
+def create_run(random):
+    labels = np.array(["neg", "pos"] + ["s_{}".format(i) for i in range(HEIGHT * WIDTH)], dtype=object)
+    plates = []
+    for i_plate in range(N_PLATES):
+        layout = PlateLayout(layout=labels[random.randint(0, len(labels), size=(HEIGHT, WIDTH))].tolist())
+        data = {str(i): random.normal(size=(HEIGHT, WIDTH)) for i in range(N_DATA_TAGS)}
+        plates.append(Plate(data={"readout": Readout(data=data), "plate_layout": layout},
+                            name="p{}".format(i_plate), height=HEIGHT, width=WIDTH))
+    return Run(plates=plates)
+
+
+def load_pickle(path):
+    with open(path, "rb") as fh:
+        return pickle.load(fh)
+
+
+def main():
+    test_run = create_run(np.random.RandomState(0))
+    with tempfile.TemporaryDirectory() as path:
+        paths = {"pickle": os.path.join(path, "run.pickle"), "container": os.path.join(path, "run.zip"),
+                 "container (compressed)": os.path.join(path, "run_compressed.zip")}
+        test_run.write(format="pickle", path=paths["pickle"])
+        test_run.write(format="container", path=paths["container"])
+        test_run.write(format="container", path=paths["container (compressed)"], compress=True)
+
+        stored_run = Run.create(origin="container", path=paths["container"])
+        assert np.array_equal(stored_run.get_readout_stack("0"), test_run.get_readout_stack("0"))
+
+        loads = {"pickle": lambda: load_pickle(paths["pickle"])}
+        for name in ["container", "container (compressed)"]:
+            loads[name] = lambda name=name: Run.create(origin="container", path=paths[name])
+            loads[name + ", 5 plates"] = lambda name=name: Run.create(
+                origin="container", path=paths[name], plate_names=["p{}".format(i) for i in range(5)])
+            loads[name + ", 1 data tag"] = lambda name=name: Run.create(origin="container", path=paths[name],
+                                                                        readout_tags=["0"])
+
+        print("{} plates, {} x {} wells, {} readout data tags (best of {}):".format(N_PLATES, HEIGHT, WIDTH,
+              N_DATA_TAGS, REPEAT))
+        for name, file in paths.items():
+            print("{:<36} {:.1f} MB".format(name + " size:", os.path.getsize(file) / 1e6))
+        for name, load in loads.items():
+            timing = min(timeit.repeat(load, number=1, repeat=REPEAT))
+            print("{:<36} {:.1f} ms".format(name + " load:", timing * 1000))
+
+
+if __name__ == "__main__":
+    main()
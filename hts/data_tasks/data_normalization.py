@@ -7,12 +7,403 @@
     .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
 """
 
+import collections
+import logging
 
-def calculate_local_ssmd(run, **kwargs):
-    for plate_tag, plate in run.plates.items():
-        plate.calculate_local_ssmd(**kwargs)
+import numpy as np
+import scipy.stats
+
+from hts.data_tasks import spatial_normalization
+from hts.plate_data import readout
+
+LOG = logging.getLogger(__name__)
+
+# The maximum number of plates whose readouts are stacked at once by the batched preprocessing methods.
+BATCH_SIZE = 64
+
+
+def calculate_local_ssmd(run, data_tag_mean_pos, data_tag_mean_neg, data_tag_std_pos, data_tag_std_neg, data_tag_ssmd, **kwargs):
+    """ Calculate local SSMD values for all plates at once, on the stacked readouts. See `Plate.calculate_local_ssmd`.
+    """
+
+    mean_pos = run.get_readout_stack(data_tag_mean_pos)
+    mean_neg = run.get_readout_stack(data_tag_mean_neg)
+    std_pos = run.get_readout_stack(data_tag_std_pos)
+    std_neg = run.get_readout_stack(data_tag_std_neg)
+
+    ssmd = np.abs(mean_pos - mean_neg)/np.sqrt(std_pos**2 + std_neg**2)
+
+    run.add_readout_stack(data={data_tag_ssmd: ssmd}, tag=data_tag_ssmd)
 
 
 def classify_by_cutoff(run, **kwargs):
     for plate_tag, plate in run.plates.items():
-        plate.classify_by_cutoff(**kwargs)
\ No newline at end of file
+        plate.classify_by_cutoff(**kwargs)
+
+################################## BATCHED PREPROCESSING  #########################
+# The plate wise preprocessing methods of ``Plate``, for many plates at once: the readouts of a batch of plates are
+# stacked (n_plates x height x width), and the control statistics are reduced along the well axis of one
+# (n_plates x n_controls) array per plate layout. The control values of each plate are contiguous and in the same
+# order as for the plate wise methods, hence the results are numerically identical. The results are copied out of the
+# stacks, such that no plate holds a reference to the stack of its batch.
+
+
+def get_plates(run, plates=None):
+    """ Get `plates`, or all plates of `run` if None.
+    """
+
+    return list(run.plates.values()) if plates is None else list(plates)
+
+
+def get_plates_to_calculate(plates, data_tag):
+    """ Get the plates without readout `data_tag`. As for the plate wise methods, existing readouts are kept.
+    """
+
+    plates_to_calculate = [i_plate for i_plate in plates if data_tag not in i_plate.readout.data]
+    if len(plates_to_calculate) < len(plates):
+        LOG.warning("The data tag {} is already in the readouts of {} plates. Skipping recalculation"
+                    "".format(data_tag, len(plates) - len(plates_to_calculate)))
+    return plates_to_calculate
+
+
+def get_batches(plates, batch_size=None):
+    """ Split `plates` into batches of at most `batch_size` (default: `BATCH_SIZE`) consecutive plates with the same
+    shape.
+
+    For lazy readouts with a bounded cache, a batch holds at most as many plates as the cache, such that the readouts
+    of a batch are not evicted and reparsed while the batch is processed.
+
+    Returns:
+        list of list of Plate
+    """
+
+    batches = []
+    for i_plate in plates:
+        max_size = int(batch_size) if batch_size is not None else BATCH_SIZE
+        if isinstance(i_plate.readout, readout.LazyReadout) and i_plate.readout.cache.max_size is not None:
+            max_size = max(min(max_size, i_plate.readout.cache.max_size), 1)
+        if batches and len(batches[-1]) < max_size and \
+                (batches[-1][0].height, batches[-1][0].width) == (i_plate.height, i_plate.width):
+            batches[-1].append(i_plate)
+        else:
+            batches.append([i_plate])
+    return batches
+
+
+def stack_readouts(plates, data_tag):
+    """ Stack the readouts tagged with `data_tag` of `plates` into one array (n_plates x height x width).
+    """
+
+    shapes = sorted(set((i_plate.height, i_plate.width) for i_plate in plates))
+    if len(shapes) > 1:
+        raise ValueError("The readouts {} of plates with different shapes {} cannot be stacked.".format(data_tag,
+                                                                                                        shapes))
+    return np.stack([i_plate.readout.get_data(data_tag) for i_plate in plates])
+
+
+def add_readout_stacks(plates, data, tag=None):
+    """ Add stacked readouts (n_plates x height x width, per data tag) to `plates`, as copies of the plate slices.
+    """
+
+    for i_plate, plate in enumerate(plates):
+        plate.readout.add_data(data={data_tag: stack[i_plate].copy() for data_tag, stack in data.items()}, tag=tag)
+
+
+def reduce_by_label(plates, stack, labels, reducers=(np.mean,)):
+    """ Reduce the values of the wells with one of `labels` (in the plate layout), for each plate.
+
+    Plates with the same control wells are reduced in one pass, on a (n_plates x n_controls) array.
+
+    Args:
+        plates (list of Plate): The plates.
+        stack (np.ndarray): The readouts of `plates` (n_plates x height x width).
+        labels (str or list of str): The labels in the plate layout, e.g. "neg".
+        reducers (list of function): Reductions with an axis argument, e.g. np.mean or np.std.
+
+    Returns:
+        list of np.ndarray: Per reducer, the reduced values of all plates.
+    """
+
+    # Group the plates by their control wells (usually, all plates share one plate layout).
+    indices_per_layout = {}
+    plates_per_indices = collections.OrderedDict()
+    for i_plate, plate in enumerate(plates):
+        layout_id = id(plate.plate_layout)
+        if layout_id not in indices_per_layout:
+            indices_per_layout[layout_id] = plate.plate_layout.get_well_indices(labels=labels)
+        indices = indices_per_layout[layout_id]
+        plates_per_indices.setdefault(indices.tobytes(), (indices, []))[1].append(i_plate)
+
+    values_flat = stack.reshape(len(plates), -1)
+    results = [np.empty(len(plates)) for _ in reducers]
+    for indices, plate_indices in plates_per_indices.values():
+        values = values_flat[np.ix_(plate_indices, indices)]
+        for result, reducer in zip(results, reducers):
+            result[plate_indices] = reducer(values, axis=1)
+    return results
+
+
+def get_label_masks(plates, labels, label_data_tag="layout"):
+    """ Get the masks of all wells with one of `labels` in the plate layout, for each plate (n_plates x height x width).
+
+    The mask of each distinct plate layout is calculated once.
+    """
+
+    masks = {}
+    for plate in plates:
+        if id(plate.plate_layout) not in masks:
+            masks[id(plate.plate_layout)] = plate.get_label_mask(labels=labels, label_data_tag=label_data_tag)
+    return np.stack([masks[id(plate.plate_layout)] for plate in plates])
+
+
+def as_column(values):
+    """ Reshape per plate values (n_plates) to broadcast against readout stacks (n_plates x height x width).
+    """
+
+    return values[:, np.newaxis, np.newaxis]
+
+
+def calculate_linearly_normalized_signal(run, unnormalized_key, normalized_0, normalized_1, normalized_key,
+                                         plates=None, **kwargs):
+    """ Linearly normalize the readouts of all plates at once. See `Plate.calculate_linearly_normalized_signal`.
+
+    Args:
+        plates (list of Plate): The plates to normalize. If None, all plates of `run`.
+    """
+
+    plates = get_plates_to_calculate(get_plates(run, plates), normalized_key)
+
+    for batch in get_batches(plates):
+        stack = stack_readouts(batch, unnormalized_key)
+        mean_0, = reduce_by_label(batch, stack, normalized_0)
+        mean_1, = reduce_by_label(batch, stack, normalized_1)
+
+        normalized_data = (stack - as_column(mean_0)) / as_column(mean_1 - mean_0)
+
+        add_readout_stacks(batch, {normalized_key: normalized_data}, tag=normalized_key)
+
+
+def calculate_net_fret(run, donor_channel, acceptor_channel, fluorophore_donor="fluorophore_donor",
+                       fluorophore_acceptor="fluorophore_acceptor", buffer="buffer", net_fret_key="net_fret",
+                       plates=None, **kwargs):
+    """ Calculate the net FRET signal of all plates at once. See `Plate.calculate_net_fret`.
+
+    Args:
+        plates (list of Plate): The plates. If None, all plates of `run`.
+    """
+
+    plates = get_plates_to_calculate(get_plates(run, plates), net_fret_key)
+
+    for batch in get_batches(plates):
+        donor = stack_readouts(batch, donor_channel)
+        acceptor = stack_readouts(batch, acceptor_channel)
+        mean_donor_donor_channel, = reduce_by_label(batch, donor, fluorophore_donor)
+        mean_acceptor_donor_channel, = reduce_by_label(batch, donor, fluorophore_acceptor)
+        mean_buffer_donor_channel, = reduce_by_label(batch, donor, buffer)
+        mean_donor_acceptor_channel, = reduce_by_label(batch, acceptor, fluorophore_donor)
+        mean_acceptor_acceptor_channel, = reduce_by_label(batch, acceptor, fluorophore_acceptor)
+        mean_buffer_acceptor_channel, = reduce_by_label(batch, acceptor, buffer)
+
+        for i, value in enumerate([mean_donor_donor_channel, mean_acceptor_donor_channel, mean_buffer_donor_channel,
+                                   mean_donor_acceptor_channel, mean_acceptor_acceptor_channel,
+                                   mean_buffer_acceptor_channel]):
+            if np.isnan(value).any():
+                raise ValueError("Calculation of variable {} resulted in NaN for plates {}. Check whether the plate "
+                                 "layout is correctly assigned.".format(
+                                     i, [batch[j].name for j in np.flatnonzero(np.isnan(value))]))
+
+        p = (mean_donor_acceptor_channel - mean_buffer_acceptor_channel) / (
+            mean_donor_donor_channel - mean_buffer_donor_channel)
+
+        netfret = acceptor - as_column(mean_acceptor_acceptor_channel) - as_column(p) * (
+            donor - as_column(mean_buffer_donor_channel))
+
+        add_readout_stacks(batch, {net_fret_key: netfret}, tag=net_fret_key)
+
+
+def calculate_control_normalized_signal(run, data_tag_readout, negative_control_key, positive_control_key,
+                                        data_tag_normalized_readout=None, local=True, plates=None, **kwargs):
+    """ Normalize the readouts of all plates by their negative and positive controls at once.
+    See `Plate.calculate_control_normalized_signal`.
+
+    Only the normalization by plate wise control averages (local != True) is batched. For local == True, the
+    controls are predicted plate by plate with Gaussian processes, one plate after the other (`Run.preprocess`
+    performs these plates with its executor instead, see `is_batched`).
+
+    Args:
+        plates (list of Plate): The plates. If None, all plates of `run`.
+    """
+
+    plates = get_plates(run, plates)
+    if local == True:
+        for i_plate in plates:
+            i_plate.calculate_control_normalized_signal(data_tag_readout=data_tag_readout,
+                                                        negative_control_key=negative_control_key,
+                                                        positive_control_key=positive_control_key,
+                                                        data_tag_normalized_readout=data_tag_normalized_readout,
+                                                        local=local, **kwargs)
+        return
+
+    if data_tag_normalized_readout == None:
+        data_tag_normalized_readout = "{}__control_normalized".format(data_tag_readout)
+
+    for batch in get_batches(plates):
+        all_readouts = stack_readouts(batch, data_tag_readout)
+        data_nc_mean, = reduce_by_label(batch, all_readouts, negative_control_key)
+        data_pc_mean, = reduce_by_label(batch, all_readouts, positive_control_key)
+
+        normalized_data = (all_readouts - as_column(data_nc_mean)) / as_column(data_pc_mean - data_nc_mean)
+
+        add_readout_stacks(batch, {data_tag_normalized_readout: normalized_data}, tag=data_tag_normalized_readout)
+
+
+def calculate_significance_compared_to_null_distribution(run, data_tag_readout, sample_tag_null_distribution,
+                                                         data_tag_standard_score, data_tag_p_value,
+                                                         is_higher_value_better, plates=None, **kwargs):
+    """ Calculate the standard scores and p-values of the readouts of all plates at once.
+    See `Plate.calculate_significance_compared_to_null_distribution`.
+
+    Args:
+        plates (list of Plate): The plates. If None, all plates of `run`.
+    """
+
+    plates = get_plates(run, plates)
+
+    if data_tag_standard_score == None:
+        data_tag_standard_score = "{}__all__vs__{}__standard_score".format(data_tag_readout,
+                                                                           sample_tag_null_distribution)
+
+    if data_tag_p_value == None:
+        data_tag_p_value = "{}__all__vs__{}__pvalue".format(data_tag_readout, sample_tag_null_distribution)
+
+    if type(sample_tag_null_distribution) != list:
+        sample_tag_null_distribution = [sample_tag_null_distribution]
+
+    for batch in get_batches(plates):
+        all_readouts = stack_readouts(batch, data_tag_readout)
+        null_mean, null_std = reduce_by_label(batch, all_readouts, sample_tag_null_distribution,
+                                              reducers=[np.mean, np.std])
+
+        standard_score = (all_readouts - as_column(null_mean)) / as_column(null_std)
+        p_value = scipy.stats.norm(as_column(null_mean), as_column(null_std)).cdf(all_readouts)
+
+        if is_higher_value_better in [True, "true", "True", "TRUE"]:
+            standard_score = - standard_score
+            p_value = 1 - p_value
+
+        add_readout_stacks(batch, {data_tag_standard_score: standard_score, data_tag_p_value: p_value},
+                           tag=data_tag_readout)
+
+
+def calculate_b_score(run, data_tag_readout, data_tag_b_score=None, sample_tags="s",
+                      label_data_tag="layout_general_type", max_iterations=10, plates=None, **kwargs):
+    """ Calculate the B-scores of all plates at once. See `Plate.calculate_b_score`.
+
+    Args:
+        plates (list of Plate): The plates. If None, all plates of `run`.
+    """
+
+    if data_tag_b_score == None:
+        data_tag_b_score = "{}__b_score".format(data_tag_readout)
+
+    plates = get_plates_to_calculate(get_plates(run, plates), data_tag_b_score)
+
+    for batch in get_batches(plates):
+        b_score = spatial_normalization.calculate_b_score(stack_readouts(batch, data_tag_readout),
+                                                          mask=get_label_masks(batch, sample_tags, label_data_tag),
+                                                          max_iterations=int(max_iterations))
+
+        add_readout_stacks(batch, {data_tag_b_score: b_score}, tag=data_tag_b_score)
+
+
+def calculate_robust_z_score(run, data_tag_readout, data_tag_robust_z_score=None, sample_tags="s",
+                             label_data_tag="layout_general_type", group="plate", plates=None, **kwargs):
+    """ Calculate the robust z-scores of all plates at once. See `Plate.calculate_robust_z_score`.
+
+    Args:
+        plates (list of Plate): The plates. If None, all plates of `run`.
+    """
+
+    if data_tag_robust_z_score == None:
+        data_tag_robust_z_score = "{}__robust_z_score".format(data_tag_readout)
+
+    plates = get_plates_to_calculate(get_plates(run, plates), data_tag_robust_z_score)
+
+    for batch in get_batches(plates):
+        robust_z_score = spatial_normalization.calculate_robust_z_score(
+            stack_readouts(batch, data_tag_readout), mask=get_label_masks(batch, sample_tags, label_data_tag),
+            group=group)
+
+        add_readout_stacks(batch, {data_tag_robust_z_score: robust_z_score}, tag=data_tag_robust_z_score)
+
+
+def calculate_well_position_correction(run, data_tag_readout, data_tag_corrected_readout=None, sample_tags="s",
+                                       label_data_tag="layout_general_type", plates=None, **kwargs):
+    """ Correct well position effects, estimated across all plates of `run`.
+    See `spatial_normalization.calculate_well_position_correction`.
+
+    The effects are estimated from the readouts of all plates of `run`, also if only `plates` are corrected. Hence,
+    all plates require `data_tag_readout`, e.g. earlier plates of an append workflow need to be preprocessed up to
+    `data_tag_readout` before the appended plates are corrected.
+
+    Args:
+        data_tag_readout (str): The readout data tag, usually normalized per plate (e.g. B-scores).
+        data_tag_corrected_readout (str): The data tag of the corrected readouts.
+        sample_tags (str or list of str): The labels of the wells used to estimate the position effects.
+        label_data_tag (str): The plate layout data tag of `sample_tags`.
+        plates (list of Plate): The plates to correct (e.g. newly appended plates). If None, all plates of `run`.
+    """
+
+    if data_tag_corrected_readout == None:
+        data_tag_corrected_readout = "{}__well_position_corrected".format(data_tag_readout)
+
+    plates = get_plates_to_calculate(get_plates(run, plates), data_tag_corrected_readout)
+    if not plates:
+        return
+
+    all_plates = get_plates(run)
+    missing = [i_plate.name for i_plate in all_plates if data_tag_readout not in i_plate.readout.data]
+    if missing:
+        raise ValueError("Well position effects are estimated across all plates, but the plates {} lack the readout "
+                         "{}.".format(missing, data_tag_readout))
+    # The position effects are medians across all plates, which cannot be combined from batches: they are estimated
+    # from the stack of the whole run. Only `plates` are corrected, batch by batch.
+    position_effects = spatial_normalization.calculate_well_position_effects(
+        stack_readouts(all_plates, data_tag_readout), mask=get_label_masks(all_plates, sample_tags, label_data_tag))
+
+    for batch in get_batches(plates):
+        corrected = stack_readouts(batch, data_tag_readout) - position_effects[np.newaxis]
+        add_readout_stacks(batch, {data_tag_corrected_readout: corrected}, tag=data_tag_corrected_readout)
+
+
+# Plate wise preprocessing methods (see `Plate.preprocess`) with a batched run level implementation. The well position
+# correction is estimated across plates, and has no plate wise implementation.
+BATCHED_PREPROCESSING = {"calculate_linearly_normalized_signal": calculate_linearly_normalized_signal,
+                         "calculate_net_fret": calculate_net_fret,
+                         "calculate_control_normalized_signal": calculate_control_normalized_signal,
+                         "calculate_significance_compared_to_null_distribution":
+                             calculate_significance_compared_to_null_distribution,
+                         "calculate_b_score": calculate_b_score,
+                         "calculate_robust_z_score": calculate_robust_z_score,
+                         "calculate_well_position_correction": calculate_well_position_correction}
+
+
+def is_batched(methodname, config):
+    """ Check whether the preprocessing method `methodname` is performed on all plates at once with `config`.
+
+    The Gaussian process normalization (`calculate_control_normalized_signal` with local == True) is performed
+    plate by plate, and hence not batched.
+
+    Args:
+        methodname (str): The name of the preprocessing method.
+        config (dict): The keyword arguments of the method.
+
+    Returns:
+        bool
+    """
+
+    if methodname not in BATCHED_PREPROCESSING:
+        return False
+    if methodname == "calculate_control_normalized_signal":
+        return config.get("local", True) != True
+    return True
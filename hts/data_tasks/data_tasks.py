@@ -8,6 +8,7 @@ import logging
 import sys
 
 from hts.data_tasks import data_normalization, data_normalization, dpia_analysis, gaussian_processes, qc_detect_data_issues, qc_knitr, qc_matplotlib
+from hts.run import parallel
 
 LOG = logging.getLogger(__name__)
 
@@ -22,8 +23,10 @@ def perform_task(run, task_name, *args, **kwargs):
 
     except:
         LOG.warning("Could not find task data_tasks - trying plate wise tasks")
-        for i_plate in run.plates.values():
-            i_plate.preprocess(task_name,  *args, **kwargs)
+        executor = kwargs.pop("executor", "serial")
+        max_workers = kwargs.pop("max_workers", None)
+        parallel.preprocess_plates(list(run.plates.values()), task_name, kwargs, executor=executor,
+                                   max_workers=max_workers)
         return
 
     return task_method(run, *args, **kwargs)
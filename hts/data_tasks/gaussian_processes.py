@@ -197,7 +197,7 @@ def do_gaussian_process_prediction(run,
 
     for plate_tag, plate in run.plates.items():
 
-        y = plate.flatten_wells(wells=plate.plate_layout.get_wells(data_tag="layout", condition=lambda x: True))
+        y = plate.flatten_wells(wells=plate.plate_layout.get_wells(data_tag="layout", condition=None))
 
         # Select the model with the lowest bic
         selected_gp_models = list(
@@ -38,30 +38,29 @@ def detect_low_cell_viability(run, control_readout_tag, control_sample_type, con
         LOG.debug("Create dir: {}".format(path))
         os.makedirs(os.path.dirname(path))
 
+    ## Calculate condition for all plates at once. E.g. what is the distribution of the control?
+    control_readout = run.get_readout_stack(control_readout_tag)
+    control_mask = run.get_layout_mask(data_tag="layout_general_type", condition={"in": control_sample_type})
+    n_control = control_mask.sum(axis=(1, 2))
+    control_mean = np.where(control_mask, control_readout, 0).sum(axis=(1, 2)) / n_control
+    control_std = np.sqrt(np.where(control_mask, (control_readout - control_mean[:, None, None])**2, 0).sum(axis=(1, 2))
+                          / n_control)
+
+    # What are the critical values of the control distribution, assuming it follows a normal distribution?
+    critical_value_standard_normal = stats.norm.ppf(1-alpha)
+    critical_value_control_lower_limit = control_mean - critical_value_standard_normal * control_std
+    critical_value_control_upper_limit = control_mean + critical_value_standard_normal * control_std
+
+    ## Apply condition. E.g., which wells do diverge too much from the distribution of the control?
+    issue_mask = (control_readout < critical_value_control_lower_limit[:, None, None]) | \
+                 (control_readout > critical_value_control_upper_limit[:, None, None])
+
     results = {}
-    for plate_name, plate in run.plates.items():
-
-        ## Calculate condition. E.g. what is the distribution of the control?
-        filter_args = {"condition_data_type": "plate_layout",
-                       "condition_data_tag": "layout_general_type",
-                       "condition": lambda x: x in control_sample_type,
-                       "value_data_type": "readout",
-                       "value_data_tag": control_readout_tag}
-        control_data = plate.filter(**filter_args)
-
-        # What are the critical values of the control distribution, assuming it follows a normal distribution?
-        critical_value_standard_normal = stats.norm.ppf(1-alpha)
-        critical_value_control_lower_limit = np.mean(control_data) - critical_value_standard_normal * np.std(control_data)
-        critical_value_control_upper_limit = np.mean(control_data) + critical_value_standard_normal * np.std(control_data)
-
-        ## Apply condition. E.g., which wells do diverge too much from the distribution of the control?
-        wells = plate.readout.get_wells(data_tag=control_readout_tag, condition=lambda x: x < critical_value_control_lower_limit or x > critical_value_control_upper_limit)
+    for (plate_name, plate), plate_issue_mask in zip(run.plates.items(), issue_mask):
+        wells = [tuple(cc) for cc in np.argwhere(plate_issue_mask).tolist()]
         data_issue = DataIssue.create_well_list(well_list=wells, width=plate.width, height=plate.height, data_tag=data_issue_tag)
         plate.add_data(data_type="data_issues", data=data_issue)
 
-        # Which wells are sample wells?
-        sample_wells = plate.plate_layout.get_wells(data_tag="layout_general_type", condition=lambda x: x in controlled_sample_types)
-
         platewise_path = os.path.join(path, "{}.csv".format(plate_name))
         data_issue.write(format="csv", path=platewise_path, tag=data_issue_tag)
 
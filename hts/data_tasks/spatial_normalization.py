@@ -0,0 +1,195 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Vectorized spatial normalization of plate readouts: B-scores (by Tukey's median polish), robust
+    z-scores per plate, row or column, and the correction of well position effects across plates.
+
+    All methods operate on stacked readouts (n_plates x height x width), such that a whole run is normalized at once.
+    The row, column and position effects are estimated from the wells of a mask (e.g. the sample wells), and removed
+    from all wells. Plates are processed independently, hence the results for a plate do not depend on the other plates
+    in the stack (except for the well position correction, which is estimated across plates).
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import logging
+import warnings
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+# Scales the median absolute deviation to a consistent estimator of the standard deviation of normal distributions.
+MAD_SCALE = 1.4826
+ROBUST_Z_SCORE_GROUPS = ["plate", "row", "column"]
+
+
+def nanmedian(values, axis):
+    """ Get the median of the non-NaN values along `axis`. The median of slices without values is NaN.
+    """
+
+    with warnings.catch_warnings():
+        # All-NaN slices, e.g. rows without sample wells.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmedian(values, axis=axis)
+
+
+def get_masked(stack, mask):
+    """ Get a float copy of `stack`, with NaN for all wells not in `mask`.
+    """
+
+    stack = np.array(stack, dtype=float)
+    if mask is not None:
+        stack[~np.broadcast_to(mask, stack.shape)] = np.nan
+    return stack
+
+
+def median_polish(stack, mask=None, max_iterations=10, tolerance=1e-6):
+    """ Decompose each plate into overall, row and column effects with Tukey's median polish.
+
+    .. math::
+    x_{ij} = overall + row_i + column_j + residual_{ij}
+
+    Rows and columns are alternately centered by their medians, until no median exceeds `tolerance` (per plate), or
+    for at most `max_iterations` iterations. The effects are fitted on the wells in `mask`; rows and columns without
+    such wells have no effect.
+
+    Args:
+        stack (np.ndarray): The readouts (n_plates x height x width).
+        mask (np.ndarray of bool): The wells used to fit the effects (n_plates x height x width). If None, all wells.
+        max_iterations (int): The maximum number of iterations.
+        tolerance (float): The fit of a plate is converged if all row and column medians are below `tolerance`.
+
+    Returns:
+        overall (np.ndarray of float): The overall effects (n_plates).
+        row_effects (np.ndarray of float): The row effects (n_plates x height).
+        column_effects (np.ndarray of float): The column effects (n_plates x width).
+        residuals (np.ndarray of float): The residuals of all wells (n_plates x height x width).
+    """
+
+    residuals = get_masked(stack, mask)
+    n_plates, height, width = residuals.shape
+    overall = np.zeros(n_plates)
+    row_effects = np.zeros((n_plates, height))
+    column_effects = np.zeros((n_plates, width))
+    # Converged plates are not updated, such that the fit of a plate does not depend on the other plates.
+    is_active = np.ones(n_plates, dtype=bool)
+
+    for _ in range(int(max_iterations)):
+        row_medians = np.nan_to_num(nanmedian(residuals, axis=2))
+        row_medians[~is_active] = 0
+        row_effects += row_medians
+        residuals -= row_medians[:, :, np.newaxis]
+        delta = np.nan_to_num(np.median(column_effects, axis=1))
+        delta[~is_active] = 0
+        column_effects -= delta[:, np.newaxis]
+        overall += delta
+
+        column_medians = np.nan_to_num(nanmedian(residuals, axis=1))
+        column_medians[~is_active] = 0
+        column_effects += column_medians
+        residuals -= column_medians[:, np.newaxis, :]
+        delta = np.nan_to_num(np.median(row_effects, axis=1))
+        delta[~is_active] = 0
+        row_effects -= delta[:, np.newaxis]
+        overall += delta
+
+        is_active &= np.maximum(np.abs(row_medians).max(axis=1), np.abs(column_medians).max(axis=1)) >= tolerance
+        if not is_active.any():
+            break
+
+    # The residuals of all wells, including those not used in the fit.
+    residuals = stack - overall[:, np.newaxis, np.newaxis] - row_effects[:, :, np.newaxis] - \
+        column_effects[:, np.newaxis, :]
+    return overall, row_effects, column_effects, residuals
+
+
+def scaled_mad(stack, mask=None, axis=(1, 2)):
+    """ Get the median absolute deviation of the wells in `mask`, along `axis` (by default, per plate), scaled by
+    MAD_SCALE. For the unscaled MAD of a list of values, see `plate.median_absolute_deviation`.
+
+    Returns:
+        np.ndarray of float: The scaled MAD, with the dimensions of `axis` kept for broadcasting.
+    """
+
+    values = get_masked(stack, mask)
+    medians = nanmedian(values, axis=axis)
+    medians = np.expand_dims(medians, axis)
+    return MAD_SCALE * np.expand_dims(nanmedian(np.abs(values - medians), axis=axis), axis)
+
+
+def calculate_b_score(stack, mask=None, max_iterations=10, tolerance=1e-6):
+    """ Calculate the B-scores of all wells: the median polish residuals, divided by the scaled MAD of the residuals of
+    the wells in `mask` (per plate).
+
+    Args:
+        stack (np.ndarray): The readouts (n_plates x height x width).
+        mask (np.ndarray of bool): The wells used to fit the effects, e.g. the sample wells. If None, all wells.
+        max_iterations (int): See `median_polish`.
+        tolerance (float): See `median_polish`.
+
+    Returns:
+        np.ndarray of float: The B-scores (n_plates x height x width).
+    """
+
+    overall, row_effects, column_effects, residuals = median_polish(stack, mask=mask, max_iterations=max_iterations,
+                                                                    tolerance=tolerance)
+    return residuals / scaled_mad(residuals, mask=mask)
+
+
+def calculate_robust_z_score(stack, mask=None, group="plate"):
+    """ Calculate the robust z-scores of all wells: centered by the median, and scaled by the scaled MAD of the wells in
+    `mask` of the same plate, row or column.
+
+    Args:
+        stack (np.ndarray): The readouts (n_plates x height x width).
+        mask (np.ndarray of bool): The wells of the robust statistics, e.g. the sample wells. If None, all wells.
+        group (str): One of ROBUST_Z_SCORE_GROUPS.
+
+    Returns:
+        np.ndarray of float: The robust z-scores (n_plates x height x width).
+    """
+
+    axis = {"plate": (1, 2), "row": 2, "column": 1}.get(group)
+    if axis is None:
+        raise ValueError("group {} is not one of: {}".format(group, ROBUST_Z_SCORE_GROUPS))
+
+    values = get_masked(stack, mask)
+    medians = np.expand_dims(nanmedian(values, axis=axis), axis)
+    return (stack - medians) / scaled_mad(stack, mask=mask, axis=axis)
+
+
+def calculate_well_position_effects(stack, mask=None):
+    """ Estimate well position effects across plates: the median of each position across the plates (of the wells in
+    `mask`), relative to the median of all wells in `mask`.
+
+    Medians of subsets of the plates cannot be combined, hence the effects are estimated from the stack of all plates.
+
+    Args:
+        stack (np.ndarray): The readouts (n_plates x height x width).
+        mask (np.ndarray of bool): The wells used to estimate the position effects. If None, all wells.
+
+    Returns:
+        np.ndarray of float: The position effects (height x width), 0 for positions without wells in `mask`.
+    """
+
+    values = get_masked(stack, mask)
+    return np.nan_to_num(nanmedian(values, axis=0) - nanmedian(values, axis=None))
+
+
+def calculate_well_position_correction(stack, mask=None):
+    """ Correct well position effects across plates: subtract from each well the effect of its position (see
+    `calculate_well_position_effects`).
+
+    Positions without wells in `mask` are not corrected. Usually, the readouts are normalized per plate (e.g. with
+    B-scores or robust z-scores) before.
+
+    Args:
+        stack (np.ndarray): The readouts (n_plates x height x width).
+        mask (np.ndarray of bool): The wells used to estimate the position effects. If None, all wells.
+
+    Returns:
+        np.ndarray of float: The corrected readouts (n_plates x height x width).
+    """
+
+    return stack - calculate_well_position_effects(stack, mask=mask)[np.newaxis]
@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+from hts.data_tasks import data_normalization, spatial_normalization
+from hts.plate.plate import Plate
+from hts.plate_data.plate_layout import PlateLayout
+from hts.plate_data.readout import Readout
+from hts.protocol import protocol
+from hts.run.run import Run
+
+HEIGHT = 8
+WIDTH = 12
+
+
+def create_stack(random, n_plates):
+    """ Return readouts with row, column and well position effects, and noise.
+    """
+    rows = np.arange(HEIGHT)[np.newaxis, :, np.newaxis]
+    columns = np.arange(WIDTH)[np.newaxis, np.newaxis, :]
+    return 10 + random.normal(size=(n_plates, 1, 1)) + 0.5 * rows + 0.3 * (columns % 3) + \
+        random.normal(scale=0.1, size=(n_plates, HEIGHT, WIDTH))
+
+
+def create_run(random, n_plates):
+    layout = np.full((HEIGHT, WIDTH), "s_1", dtype=object)
+    layout[:, 0] = "neg"
+    layout[:, WIDTH - 1] = "pos"
+    plate_layout = PlateLayout(layout=layout.tolist())
+    stack = create_stack(random, n_plates)
+    # Controls deviate strongly from the samples; they are not used to fit the spatial effects.
+    stack[:, :, WIDTH - 1] += 100
+    plates = [Plate(data={"readout": Readout(data={"signal": stack[i]}), "plate_layout": plate_layout},
+                    name="p{}".format(i), height=HEIGHT, width=WIDTH) for i in range(n_plates)]
+    return Run(plates=plates)
+
+
+@pytest.mark.no_external_software_required
+def test_median_polish():
+    rows = np.array([0, 1, 5])[np.newaxis, :, np.newaxis]
+    columns = np.array([-1, 0, 2, 4])[np.newaxis, np.newaxis, :]
+    stack = np.concatenate([3 + rows + columns, -1 + 2 * rows + columns])
+    overall, row_effects, column_effects, residuals = spatial_normalization.median_polish(stack)
+
+    assert np.allclose(residuals, 0)
+    assert np.allclose(overall[:, np.newaxis, np.newaxis] + row_effects[:, :, np.newaxis] +
+                       column_effects[:, np.newaxis, :], stack)
+    assert np.allclose(np.median(row_effects, axis=1), 0) and np.allclose(np.median(column_effects, axis=1), 0)
+
+    # Wells outside of the mask do not change the effects.
+    outlier_stack = stack.copy()
+    outlier_stack[:, 1, 2] = 1000
+    mask = np.ones(stack.shape, dtype=bool)
+    mask[:, 1, 2] = False
+    overall_masked, row_effects_masked, column_effects_masked, residuals_masked = \
+        spatial_normalization.median_polish(outlier_stack, mask=mask)
+    assert np.allclose(row_effects_masked, row_effects) and np.allclose(column_effects_masked, column_effects)
+    assert np.allclose(residuals_masked[:, 1, 2], 1000 - stack[:, 1, 2])
+
+
+@pytest.mark.no_external_software_required
+def test_calculate_robust_z_score():
+    stack = np.array([[[1, 2, 3, 10], [4, 6, 8, 20]]], dtype=float)
+
+    z_plate = spatial_normalization.calculate_robust_z_score(stack, group="plate")
+    assert np.allclose(z_plate, (stack - 5) / (1.4826 * 3))
+    z_row = spatial_normalization.calculate_robust_z_score(stack, group="row")
+    assert np.allclose(z_row[0, 0], (stack[0, 0] - 2.5) / (1.4826 * 1))
+    mask = np.array([[[True, True, True, False], [True, True, True, False]]])
+    z_row_masked = spatial_normalization.calculate_robust_z_score(stack, mask=mask, group="row")
+    assert np.allclose(z_row_masked[0, 1], (stack[0, 1] - 6) / (1.4826 * 2))
+    with pytest.raises(ValueError):
+        spatial_normalization.calculate_robust_z_score(stack, group="well")
+
+
+@pytest.mark.no_external_software_required
+def test_calculate_b_score():
+    random = np.random.RandomState(0)
+    stack = create_stack(random, 20)
+    b_score = spatial_normalization.calculate_b_score(stack)
+
+    # The row and column effects are removed.
+    assert abs(np.corrcoef(b_score.ravel(), np.indices(stack.shape)[1].ravel())[0, 1]) < 0.05
+    assert np.allclose(np.median(b_score, axis=(1, 2)), 0, atol=0.1)
+    assert np.allclose(spatial_normalization.scaled_mad(b_score).ravel(), 1)
+
+
+@pytest.mark.no_external_software_required
+def test_calculate_well_position_correction():
+    random = np.random.RandomState(0)
+    stack = random.normal(size=(50, HEIGHT, WIDTH))
+    stack[:, 2, 3] += 5
+    corrected = spatial_normalization.calculate_well_position_correction(stack)
+    assert abs(np.median(corrected[:, 2, 3]) - np.median(corrected)) < 1e-12
+    assert np.allclose(corrected[:, 2, 3] - stack[:, 2, 3], corrected[0, 2, 3] - stack[0, 2, 3])
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("method, config", [
+    ("calculate_b_score", {"data_tag_readout": "signal", "max_iterations": "5"}),
+    ("calculate_robust_z_score", {"data_tag_readout": "signal", "group": "row"}),
+])
+def test_batched_spatial_normalization(method, config):
+    test_run = create_run(np.random.RandomState(0), 6)
+    expected_run = create_run(np.random.RandomState(0), 6)
+
+    data_normalization.BATCHED_PREPROCESSING[method](test_run, **config)
+    for i_plate in expected_run.plates.values():
+        i_plate.preprocess(method, **config)
+
+    data_tag = "signal__b_score" if method == "calculate_b_score" else "signal__robust_z_score"
+    for i_plate, expected_plate in zip(test_run.plates.values(), expected_run.plates.values()):
+        assert np.array_equal(i_plate.readout.get_data(data_tag), expected_plate.readout.get_data(data_tag))
+    # The positive controls keep their offset.
+    assert (test_run.get_readout_stack(data_tag)[:, :, WIDTH - 1] > 20).all()
+
+
+@pytest.mark.no_external_software_required
+def test_calculate_well_position_correction_run(monkeypatch):
+    monkeypatch.setattr(data_normalization, "BATCH_SIZE", 2)
+    test_run = create_run(np.random.RandomState(0), 6)
+    data_normalization.calculate_b_score(test_run, data_tag_readout="signal", data_tag_b_score="b_score")
+    expected = spatial_normalization.calculate_well_position_correction(
+        test_run.get_readout_stack("b_score"), mask=data_normalization.get_label_masks(
+            list(test_run.plates.values()), "s", "layout_general_type"))
+    data_normalization.calculate_well_position_correction(test_run, data_tag_readout="b_score",
+                                                          plates=list(test_run.plates.values())[3:])
+    assert [i_plate.readout.data.get("b_score__well_position_corrected") is not None
+            for i_plate in test_run.plates.values()] == [False] * 3 + [True] * 3
+    # The effects are estimated from all plates, also if only some plates are corrected.
+    for i_plate, expected_plate in zip(list(test_run.plates.values())[3:], expected[3:]):
+        assert np.array_equal(i_plate.readout.get_data("b_score__well_position_corrected"), expected_plate)
+    data_normalization.calculate_well_position_correction(test_run, data_tag_readout="b_score")
+    corrected = test_run.get_readout_stack("b_score__well_position_corrected")
+    assert np.array_equal(corrected, expected)
+
+    # All plates require the readout, also if only some plates are corrected.
+    test_run.plates["p0"].readout.remove_data(["b_score"])
+    with pytest.raises(ValueError) as e:
+        data_normalization.calculate_well_position_correction(test_run, data_tag_readout="b_score",
+                                                              data_tag_corrected_readout="corrected",
+                                                              plates=list(test_run.plates.values())[3:])
+    assert "['p0']" in str(e.value)
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("batched", [True, False])
+def test_preprocess_spatial_normalization(batched):
+    test_run = create_run(np.random.RandomState(0), 6)
+    test_run._protocol = protocol.Protocol(file=None, name="spatial", config={}, tasks=[
+        protocol.ProtocolTask(name="b_score", tags=["preprocessing"], type="preprocessing",
+                              method="calculate_b_score", config={"data_tag_readout": "signal"}),
+        protocol.ProtocolTask(name="well_position", tags=["preprocessing"], type="preprocessing",
+                              method="calculate_well_position_correction",
+                              config={"data_tag_readout": "signal__b_score", "data_tag_corrected_readout": "corrected"})])
+    test_run.preprocess(batched=batched)
+    assert test_run.get_readout_stack("corrected").shape == (6, HEIGHT, WIDTH)
@@ -10,8 +10,8 @@ import itertools
 import logging
 import pickle
 import random
-import re
 import string
+import weakref
 
 import GPy
 import numpy as np
@@ -19,39 +19,65 @@ import pylab
 import scipy.stats
 
 import hts.data_tasks.gaussian_processes
-from hts.data_tasks import prediction
-from hts.plate_data import plate_data, data_issue, meta_data, plate_layout, readout
+from hts.data_tasks import prediction, spatial_normalization
+from hts.plate import well_name_codec
+from hts.plate_data import plate_data, data_issue, meta_data, plate_layout, readout, readout_store
 
 KNOWN_DATA_TYPES = ["plate_layout", "readout", "data_issue", "config_data"]
 LETTERS = list(string.ascii_uppercase) + ["".join(i) for i in
                                           itertools.product(string.ascii_uppercase, string.ascii_uppercase)]
-MAX_WIDTH = 48
-MAX_HEIGHT = 32
-TRANSLATE_HUMANREADABLE_COORDINATE = {(LETTERS[cc[0]], str(cc[1] + 1)): cc for cc in
-                                      itertools.product(range(MAX_HEIGHT), range(MAX_WIDTH))}
-TRANSLATE_COORDINATE_HUMANREADABLE = {cc: (LETTERS[cc[0]], str(cc[0] + 1), str(cc[1] + 1)) for cc in
-                                      itertools.product(range(MAX_HEIGHT), range(MAX_WIDTH))}
 LOG = logging.getLogger(__name__)
 
 
-## TODO: Instead of creating a matrix for both coordinates, simply create a list each to safe memory.
+def median_absolute_deviation(values):
+    """ Get the (unscaled) median absolute deviation of `values` from their median.
+    """
+
+    return np.median(np.abs(values - np.median(values)))
+
+
+# The statistics of the values of labelled wells that are cached per plate (see `Plate.get_statistic`).
+STATISTICS = {"mean": np.mean, "std": np.std, "median": np.median, "mad": median_absolute_deviation}
+
 
 def translate_coordinate_humanreadable(coordinate, pattern=None):
-    coordinate_human = TRANSLATE_COORDINATE_HUMANREADABLE[coordinate]
+    """ Translate a 0-based coordinate (row, column) to a human readable well name, e.g. (1, 2) to "B3".
+
+    Args:
+        coordinate (tuple of int): The coordinate.
+        pattern (str): The pattern of the well name, formatted with the row name and the column number. If None, the
+                       tuple (row name, row number, column number), e.g. ("B", "2", "3").
+    """
+
+    row_name = str(well_name_codec.encode_row_names(coordinate[0]))
     if pattern:
-        return pattern.format(coordinate_human[0], int(coordinate_human[2]))
+        return pattern.format(row_name, coordinate[1] + 1)
     else:
-        return coordinate_human
+        return row_name, str(coordinate[0] + 1), str(coordinate[1] + 1)
 
 
 def translate_humanreadable_coordinate(humanreadable):
-    pattern = re.compile('([a-zA-Z]+)0*(\d+)')
-    match = re.match(pattern, humanreadable)
-    if not match:
-        LOG.error("pattern: {} did not match {}".format(pattern, humanreadable))
-    humanreadable = (match.group(1), match.group(2))
+    """ Translate a human readable well name (e.g. "B3" or "B003") to a 0-based coordinate (row, column).
+    """
 
-    return TRANSLATE_HUMANREADABLE_COORDINATE[humanreadable]
+    rows, columns = well_name_codec.decode([humanreadable])
+    return int(rows[0]), int(columns[0])
+
+
+def translate_humanreadable_coordinates(humanreadables):
+    """ Translate many human readable well names (e.g. "A1", "B012", "AA3") to coordinates.
+
+    See `well_name_codec.decode`.
+
+    Args:
+        humanreadables (list or np.ndarray of str): Well names.
+
+    Returns:
+        rows (np.ndarray of int), columns (np.ndarray of int): The 0-based coordinates of each well name.
+    """
+
+    rows, columns = well_name_codec.decode(humanreadables)
+    return rows.ravel(), columns.ravel()
 
 
 class Plate:
@@ -125,7 +151,7 @@ class Plate:
 
         """
 
-    def create(format, name=None, **kwargs):
+    def create(format, name=None, readout_cache=None, **kwargs):
         """ Create ``Plate`` instance.
 
         Create ``Plate`` instance.
@@ -133,6 +159,9 @@ class Plate:
         Args:
             path (str): Path to input file or directory
             format (str):  Format of the input file, at current not specified
+            readout_cache (readout.ReadoutCache): If set, the readout is created as ``LazyReadout`` held in
+                                                  `readout_cache`, and only parsed on first access. Give height and
+                                                  width as keyword arguments to avoid parsing for the plate dimensions.
 
         """
 
@@ -145,15 +174,27 @@ class Plate:
             if "data_issue" in kwargs:
                 data["data_issue"] = data_issue.DataIssue.create(**kwargs["data_issue"])
             if "readout" in kwargs:
-                data["readout"] = readout.Readout.create(**kwargs["readout"])
-            height = len(next(iter(next(iter(data.values())).data.values())))
-            width = len(next(iter(next(iter(data.values())).data.values()))[0])
+                if readout_cache is not None:
+                    data["readout"] = readout.LazyReadout(cache=readout_cache, **kwargs["readout"])
+                else:
+                    data["readout"] = readout.Readout.create(**kwargs["readout"])
+            if "height" in kwargs and "width" in kwargs:
+                height = int(kwargs["height"])
+                width = int(kwargs["width"])
+            else:
+                height = next(iter(data.values())).height
+                width = next(iter(data.values())).width
             if not name:
                 name = next(iter(data.values())).name
             return Plate(data=data, height=height, width=width, name=name)
         elif format == 'pickle':
             with open(kwargs["path"], 'rb') as fh:
                 return pickle.load(fh)
+        elif format == 'readout_store':
+            # Only the readout is restored, as views into the memory-mapped store.
+            store = readout_store.ReadoutStore(kwargs["path"], mmap_mode=kwargs.get("mmap_mode", "r"))
+            data = {"readout": readout.Readout(data=store.get_data(name), name=name)}
+            return Plate(data=data, height=store.height, width=store.width, name=name)
         else:
             raise Exception("Format: {} is not implemented in "
                             "Plate.create()".format(format))
@@ -202,6 +243,93 @@ class Plate:
         if return_string:
             return output
 
+    def get_mask(self, condition_data_type, condition_data_tag, condition=None):
+        """ Get a boolean mask (height x width) of all wells that fulfill `condition`.
+
+        Args:
+            condition_data_type (str): Reference to PlateData instance on which wells are filtered for the condition.
+            condition_data_tag (str): Data tag for condition_data_type
+            condition (dict or method): Declarative predicates (e.g. {"in": ["neg", "pos"]}) or a method.
+                                        See `plate_data.evaluate_condition`.
+
+        Returns:
+            np.ndarray of bool (height x width)
+        """
+
+        return getattr(self, condition_data_type).get_mask(data_tag=condition_data_tag, condition=condition)
+
+    def __getstate__(self):
+        # Cached statistics are not serialized; they are recalculated on demand.
+        state = dict(self.__dict__)
+        state.pop("statistics_cache", None)
+        return state
+
+    def get_statistic(self, value_data_tag, labels, statistic, label_data_tag="layout"):
+        """ Get a statistic of the readout values of all wells with one of `labels` in the plate layout.
+
+        Statistics are cached per (readout data tag, label set, label data tag, statistic). A cached statistic is
+        recalculated once the readout data tag is overwritten (with `Readout.add_data`, or by replacing
+        `readout.data`), or the plate layout is replaced or changed (see `PlateLayout.get_version`).
+
+        Args:
+            value_data_tag (str): The readout data tag.
+            labels (str or list of str): Label(s) in the plate layout, e.g. "neg" or ["neg_1", "neg_2"].
+            statistic (str): One of STATISTICS, e.g. "mean" or "mad".
+            label_data_tag (str): The plate layout data tag, e.g. "layout" or "layout_general_type".
+
+        Returns:
+            float
+        """
+
+        if statistic not in STATISTICS:
+            raise ValueError("Statistic {} is not known. Use one of: {}".format(statistic, sorted(STATISTICS)))
+
+        data = self.readout.get_data(value_data_tag)
+        version = self.readout.get_data_version(value_data_tag)
+        layout_version = self.plate_layout.get_version()
+        key = (value_data_tag, frozenset(plate_data.as_list(labels)), label_data_tag, statistic)
+        if not hasattr(self, "statistics_cache"):
+            self.statistics_cache = {}
+        cached = self.statistics_cache.get(key)
+        # The data is referenced weakly, such that overwritten data is not kept alive by the cache.
+        if cached is not None and cached[0]() is data and cached[1] == version and cached[2]() is self.plate_layout \
+                and cached[3] == layout_version:
+            return cached[4]
+
+        values = data.ravel()[self.plate_layout.get_well_indices(labels=labels, data_tag=label_data_tag)]
+        value = STATISTICS[statistic](values)
+        self.statistics_cache[key] = (weakref.ref(data), version, weakref.ref(self.plate_layout), layout_version,
+                                      value)
+        return value
+
+    def get_label_mask(self, labels, label_data_tag="layout"):
+        """ Get a boolean mask (height x width) of all wells with one of `labels` in the plate layout.
+
+        Args:
+            labels (str or list of str): Label(s) in the plate layout, e.g. "s" or ["neg", "pos"].
+            label_data_tag (str): The plate layout data tag, e.g. "layout" or "layout_general_type".
+        """
+
+        mask = np.zeros(self.height * self.width, dtype=bool)
+        mask[self.plate_layout.get_well_indices(labels=labels, data_tag=label_data_tag)] = True
+        return mask.reshape(self.height, self.width)
+
+    def get_values_by_label(self, value_data_tag, labels, label_data_tag="layout", value_data_type="readout"):
+        """ Get the values of all wells with one of `labels` in the plate layout, using the plate layout index.
+
+        Args:
+            value_data_tag (str): Data tag for value_data_type.
+            labels (str or list of str): Label(s) in the plate layout, e.g. "neg" or ["neg_1", "neg_2"].
+            label_data_tag (str): The plate layout data tag, e.g. "layout" or "layout_general_type".
+            value_data_type (str): Reference to PlateData instance from which the values are retrieved.
+
+        Returns:
+            np.ndarray: The values in row-major well order.
+        """
+
+        indices = self.plate_layout.get_well_indices(labels=labels, data_tag=label_data_tag)
+        return getattr(self, value_data_type).get_data(value_data_tag).ravel()[indices]
+
     def filter(self, value_data_type, value_data_tag, value_type=None,
                condition_data_type=None, condition_data_tag=None, condition=None,
                return_list=True):
@@ -213,11 +341,13 @@ class Plate:
         Args:
             condition_data_type (str): Reference to PlateData instance on which wells are filtered for the condition.
             condition_data_tag (str): Data tag for condition_data_type
-            condition (method): The condition expressed as a method.
+            condition (dict or method): The condition expressed as declarative predicates (e.g. {"eq": "neg"},
+                                        {"in": ["neg", "pos"]} or {"range": (0, 1)}), or as a method.
             value_data_type (str): Reference to PlateData instance from which (for filtered wells) the values are retrieved.
             value_data_tag (str): Data tag for value_data_type.
             value_type (str): The type of the return values.
-            return_list (bool): Returns a flattened list of all values
+            return_list (bool): Returns a flattened list of all values. Else, return a matrix of values, with NaN for
+                                wells that do not fulfill the condition.
 
         Returns:
             (list of x), where x are of type `value_type`, if `value_type` is set.
@@ -228,29 +358,20 @@ class Plate:
         value_plate_data = getattr(self, value_data_type)
 
         if condition_data_type:
-            condition_plate_data = getattr(self, condition_data_type)
-            wells = condition_plate_data.get_wells(data_tag=condition_data_tag, condition=condition)
+            mask = self.get_mask(condition_data_type=condition_data_type, condition_data_tag=condition_data_tag,
+                                 condition=condition)
             if return_list:
-                return value_plate_data.get_values(wells=wells, data_tag=value_data_tag, value_type=value_type)
+                return value_plate_data.get_values(mask=mask, data_tag=value_data_tag, value_type=value_type)
             else:
-                data = np.empty([self.height, self.width])
-                data[:] = np.NAN
-                for well in wells:
-                    value = value_plate_data.get_values(wells=[well], data_tag=value_data_tag, value_type=value_type)
-                    data[well[0], well[1]] = value[0]
-                return data
-                # ToDo: Return matrix of values, with None for wells that do not fulfill the condition, and
-                # the value otherwise.
+                return np.where(mask, value_plate_data.get_data(value_data_tag), np.nan)
 
         else:
-            data = value_plate_data.data[value_data_tag]
+            data = value_plate_data.get_data(value_data_tag)
             if return_list:
-                return [item for sublist in data for item in sublist]
+                return data.ravel().tolist()
             else:
                 return data
 
-        return values
-
     #### Preprocessing functions
 
     def preprocess(self, methodname, **kwargs):
@@ -279,18 +400,12 @@ class Plate:
                         "Skipping recalculation".format(normalized_key))
             return
 
-        data_normalized_0 = self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                                        condition=lambda x: x in normalized_0,
-                                        value_data_type="readout",
-                                        value_data_tag=unnormalized_key)
+        mean_normalized_0 = self.get_statistic(value_data_tag=unnormalized_key, labels=normalized_0, statistic="mean")
 
-        data_normalized_1 = self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                                        condition=lambda x: x in normalized_1,
-                                        value_data_type="readout",
-                                        value_data_tag=unnormalized_key)
+        mean_normalized_1 = self.get_statistic(value_data_tag=unnormalized_key, labels=normalized_1, statistic="mean")
 
-        normalized_data = (self.readout.get_data(unnormalized_key) - np.mean(data_normalized_0)) / (
-            np.mean(data_normalized_1) - np.mean(data_normalized_0))
+        normalized_data = (self.readout.get_data(unnormalized_key) - mean_normalized_0) / (
+            mean_normalized_1 - mean_normalized_0)
 
         self.readout.add_data(data={normalized_key: normalized_data}, tag=normalized_key)
 
@@ -366,28 +481,17 @@ class Plate:
                         "Skipping recalculation".format(net_fret_key))
             return
 
-        mean_donor_donor_channel = np.mean(self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                                                       condition=lambda x: x == fluorophore_donor,
-                                                       value_data_type="readout", value_data_tag=donor_channel))
-        mean_acceptor_donor_channel = np.mean(
-            self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                        condition=lambda x: x == fluorophore_acceptor,
-                        value_data_type="readout", value_data_tag=donor_channel))
-        mean_buffer_donor_channel = np.mean(self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                                                        condition=lambda x: x == buffer,
-                                                        value_data_type="readout", value_data_tag=donor_channel))
-        mean_donor_acceptor_channel = np.mean(
-            self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                        condition=lambda x: x == fluorophore_donor,
-                        value_data_type="readout", value_data_tag=acceptor_channel))
-        mean_acceptor_acceptor_channel = np.mean(
-            self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                        condition=lambda x: x == fluorophore_acceptor,
-                        value_data_type="readout", value_data_tag=acceptor_channel))
-        mean_buffer_acceptor_channel = np.mean(
-            self.filter(condition_data_type="plate_layout", condition_data_tag="layout",
-                        condition=lambda x: x == buffer,
-                        value_data_type="readout", value_data_tag=acceptor_channel))
+        mean_donor_donor_channel = self.get_statistic(value_data_tag=donor_channel, labels=fluorophore_donor,
+                                                      statistic="mean")
+        mean_acceptor_donor_channel = self.get_statistic(value_data_tag=donor_channel, labels=fluorophore_acceptor,
+                                                         statistic="mean")
+        mean_buffer_donor_channel = self.get_statistic(value_data_tag=donor_channel, labels=buffer, statistic="mean")
+        mean_donor_acceptor_channel = self.get_statistic(value_data_tag=acceptor_channel, labels=fluorophore_donor,
+                                                         statistic="mean")
+        mean_acceptor_acceptor_channel = self.get_statistic(value_data_tag=acceptor_channel,
+                                                            labels=fluorophore_acceptor, statistic="mean")
+        mean_buffer_acceptor_channel = self.get_statistic(value_data_tag=acceptor_channel, labels=buffer,
+                                                          statistic="mean")
 
         for i, value in enumerate([mean_donor_donor_channel, mean_acceptor_donor_channel, mean_buffer_donor_channel,
                                    mean_donor_acceptor_channel, mean_acceptor_acceptor_channel,
@@ -449,15 +553,15 @@ class Plate:
 
         if local != True:
             # Normalize by "global" plate averages of negative and positive controls.
-            nc_wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: x == negative_control_key)
-            nc_values = self.readout.get_values(wells=nc_wells, data_tag=data_tag_readout)
-            data_nc_mean = np.mean(nc_values)
-            data_nc_std = np.std(nc_values)
+            data_nc_mean = self.get_statistic(value_data_tag=data_tag_readout, labels=negative_control_key,
+                                              statistic="mean")
+            data_nc_std = self.get_statistic(value_data_tag=data_tag_readout, labels=negative_control_key,
+                                             statistic="std")
 
-            pc_wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: x == positive_control_key)
-            pc_values = self.readout.get_values(wells=pc_wells, data_tag=data_tag_readout)
-            data_pc_mean = np.mean(pc_values)
-            data_pc_std = np.std(pc_values)
+            data_pc_mean = self.get_statistic(value_data_tag=data_tag_readout, labels=positive_control_key,
+                                              statistic="mean")
+            data_pc_std = self.get_statistic(value_data_tag=data_tag_readout, labels=positive_control_key,
+                                             statistic="std")
 
             LOG.debug("Normalize globally with mean negative control: {} "
                       "and mean negative control: {}.".format(data_nc_mean, data_pc_mean))
@@ -529,11 +633,10 @@ class Plate:
             sample_tag_null_distribution = [sample_tag_null_distribution]
 
         # Extract null distribution.
-        null_distribution_wells = self.plate_layout.get_wells(data_tag="layout",
-                                                              condition=lambda x: x in sample_tag_null_distribution)
-        null_distribution_values = self.readout.get_values(wells=null_distribution_wells, data_tag=data_tag_readout)
-        null_mean = np.mean(null_distribution_values)
-        null_std = np.std(null_distribution_values)
+        null_mean = self.get_statistic(value_data_tag=data_tag_readout, labels=sample_tag_null_distribution,
+                                       statistic="mean")
+        null_std = self.get_statistic(value_data_tag=data_tag_readout, labels=sample_tag_null_distribution,
+                                      statistic="std")
 
         LOG.debug("Null distribution of sample {} has mean {} and std: {}.".format(sample_tag_null_distribution,
                                                                                    null_mean, null_std))
@@ -588,6 +691,63 @@ class Plate:
                               tag=data_tag_ssmd)
 
 
+    def calculate_b_score(self, data_tag_readout, data_tag_b_score=None, sample_tags="s",
+                          label_data_tag="layout_general_type", max_iterations=10, **kwargs):
+        """ Calculate B-scores: remove row and column effects by median polish, and scale by the MAD of the residuals.
+        See `spatial_normalization.calculate_b_score`.
+
+        Args:
+            data_tag_readout (str): The key for self.readout.data where the readouts are stored.
+            data_tag_b_score (str): The key for self.readout.data where the B-scores will be stored.
+            sample_tags (str or list of str): The labels of the wells used to fit the row and column effects.
+            label_data_tag (str): The plate layout data tag of `sample_tags`.
+            max_iterations (int): The maximum number of median polish iterations.
+        """
+
+        if data_tag_b_score == None:
+            data_tag_b_score = "{}__b_score".format(data_tag_readout)
+
+        if data_tag_b_score in self.readout.data:
+            LOG.warning("The data_tag_b_score {} is already in self.readout.data. "
+                        "Skipping recalculation".format(data_tag_b_score))
+            return
+
+        b_score = spatial_normalization.calculate_b_score(
+            self.readout.get_data(data_tag_readout)[np.newaxis],
+            mask=self.get_label_mask(labels=sample_tags, label_data_tag=label_data_tag)[np.newaxis],
+            max_iterations=int(max_iterations))[0]
+
+        self.readout.add_data(data={data_tag_b_score: b_score}, tag=data_tag_b_score)
+
+
+    def calculate_robust_z_score(self, data_tag_readout, data_tag_robust_z_score=None, sample_tags="s",
+                                 label_data_tag="layout_general_type", group="plate", **kwargs):
+        """ Calculate robust z-scores, by the median and MAD of the sample wells of the plate, row or column.
+        See `spatial_normalization.calculate_robust_z_score`.
+
+        Args:
+            data_tag_readout (str): The key for self.readout.data where the readouts are stored.
+            data_tag_robust_z_score (str): The key for self.readout.data where the robust z-scores will be stored.
+            sample_tags (str or list of str): The labels of the wells of the median and MAD.
+            label_data_tag (str): The plate layout data tag of `sample_tags`.
+            group (str): "plate", "row" or "column".
+        """
+
+        if data_tag_robust_z_score == None:
+            data_tag_robust_z_score = "{}__robust_z_score".format(data_tag_readout)
+
+        if data_tag_robust_z_score in self.readout.data:
+            LOG.warning("The data_tag_robust_z_score {} is already in self.readout.data. "
+                        "Skipping recalculation".format(data_tag_robust_z_score))
+            return
+
+        robust_z_score = spatial_normalization.calculate_robust_z_score(
+            self.readout.get_data(data_tag_readout)[np.newaxis],
+            mask=self.get_label_mask(labels=sample_tags, label_data_tag=label_data_tag)[np.newaxis], group=group)[0]
+
+        self.readout.add_data(data={data_tag_robust_z_score: robust_z_score}, tag=data_tag_robust_z_score)
+
+
     def classify_by_cutoff(self, data_tag_readout, data_tag_classified_readout, threshold, is_higher_value_better=True, is_twosided=False, **kwargs):
         """
         Map a dataset of float values to either binary (`is_twosided==False`) or [-1,0,1] (`is_twosided==True`), depending
@@ -644,13 +804,12 @@ class Plate:
         all_readouts = self.readout.get_data(data_tag_readout)
 
         # Extract wells
-        randomizable_wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: x == randomized_samples)
-        randomizable_values = self.readout.get_values(wells=randomizable_wells, data_tag=data_tag_readout)
+        randomizable_mask = self.plate_layout.get_mask(data_tag="layout", condition={"eq": randomized_samples})
+        randomizable_values = all_readouts[randomizable_mask]
         random.shuffle(randomizable_values)
 
         randomized_readouts = all_readouts.copy()
-        for well, value in zip(randomizable_wells, randomizable_values):
-            randomized_readouts[well] = value
+        randomized_readouts[randomizable_mask] = randomizable_values
 
         self.readout.add_data(data={data_tag_randomized_readout: randomized_readouts,}, tag=data_tag_readout)
 
@@ -668,7 +827,7 @@ class Plate:
                                 position in self.plate_layout.data. E.g. for positive controls "pos"
             method_name (str): The prediction method. E.g. gp for Gaussian processes.
         """
-        sampled_wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: x == sample_tag)
+        sampled_wells = self.plate_layout.get_wells(data_tag="layout", condition={"eq": sample_tag})
         values = self.readout.get_values(wells=sampled_wells, data_tag=data_tag_readout)  # value_type=float
 
         if method_name == "gp":
@@ -694,7 +853,7 @@ class Plate:
         # y_error_abs = y - y_predicted_abs
 
 
-        wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: True)
+        wells = self.plate_layout.get_wells(data_tag="layout", condition=None)
         values = self.readout.get_values(wells=wells, data_tag=data_tag_readout)  # value_type=float
 
         #### This needs to be debugged, as data_predictions now come in a different format.
@@ -703,7 +862,7 @@ class Plate:
         diff = data_predictions - values
 
         if sample_key:
-            specific_wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: x == sample_key)
+            specific_wells = self.plate_layout.get_wells(data_tag="layout", condition={"eq": sample_key})
             if len(specific_wells) == 0:
                 raise Exception("sample_key: {} does not define any wells.".format(sample_key))
             diff = np.array([diff[wells.index(well)] for well in specific_wells])
@@ -742,8 +901,9 @@ class Plate:
         if type(sample_tags) != list:
             sample_tags = [sample_tags]
 
-        sampled_wells = self.plate_layout.get_wells(data_tag="layout", condition=lambda x: x in sample_tags)
-        values = self.readout.get_values(wells=sampled_wells, data_tag=data_tag_readout)  # value_type=float
+        sampled_indices = self.plate_layout.get_well_indices(labels=sample_tags, data_tag="layout")
+        sampled_wells = list(zip(*np.divmod(sampled_indices, self.width)))
+        values = self.readout.get_data(data_tag_readout).ravel()[sampled_indices]
 
         x, y = self.flatten_data(wells=sampled_wells, values=values)
         return x, y
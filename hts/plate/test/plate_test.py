@@ -6,7 +6,7 @@ import numpy as np
 import pytest
 
 from hts.plate import plate
-from hts.plate_data import readout, data_issue
+from hts.plate_data import readout, data_issue, plate_layout
 
 logging.basicConfig(level=logging.INFO)
 
@@ -52,6 +52,68 @@ def test_create_from_readout(path):
     assert test_plate.width == test_readout.width
 
 
+@pytest.mark.no_external_software_required
+def test_filter_by_predicates():
+
+    test_readout = readout.Readout(data={"1": [[1, 2, 3], [4, 5, 6]]})
+    test_layout = plate_layout.PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    test_plate = plate.Plate(data={"readout": test_readout, "plate_layout": test_layout}, height=2, width=3,
+                             name=TEST_PLATE_NAME)
+
+    test_neg = test_plate.filter(condition_data_type="plate_layout", condition_data_tag="layout",
+                                 condition={"eq": "neg"}, value_data_type="readout", value_data_tag="1")
+    assert test_neg == [1.0, 4.0]
+    test_s = test_plate.filter(condition_data_type="plate_layout", condition_data_tag="layout_general_type",
+                               condition={"in": ["s", "pos"]}, value_data_type="readout", value_data_tag="1")
+    assert test_s == [2.0, 3.0, 5.0, 6.0]
+    test_matrix = test_plate.filter(condition_data_type="plate_layout", condition_data_tag="layout",
+                                    condition={"eq": "neg"}, value_data_type="readout", value_data_tag="1",
+                                    return_list=False)
+    assert np.array_equal(test_matrix, np.array([[1, np.nan, np.nan], [4, np.nan, np.nan]]), equal_nan=True)
+    test_mask = test_plate.get_mask(condition_data_type="readout", condition_data_tag="1", condition={"ge": 5})
+    assert test_mask.tolist() == [[False, False, False], [False, True, True]]
+    assert test_plate.get_values_by_label(value_data_tag="1", labels="neg").tolist() == test_neg
+    assert test_plate.get_values_by_label(value_data_tag="1", labels=["s", "pos"],
+                                          label_data_tag="layout_general_type").tolist() == test_s
+
+
+@pytest.mark.no_external_software_required
+def test_get_statistic():
+
+    test_readout = readout.Readout(data={"1": [[1, 2, 3], [4, 5, 6]]})
+    test_layout = plate_layout.PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    test_plate = plate.Plate(data={"readout": test_readout, "plate_layout": test_layout}, height=2, width=3,
+                             name=TEST_PLATE_NAME)
+
+    assert test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mean") == 2.5
+    assert test_plate.get_statistic(value_data_tag="1", labels=["pos", "neg"], statistic="median") == 3.5
+    assert test_plate.get_statistic(value_data_tag="1", labels=["s"], statistic="mad",
+                                    label_data_tag="layout_general_type") == 1.5
+    assert len(test_plate.statistics_cache) == 3
+    # Label sets are unordered.
+    assert test_plate.get_statistic(value_data_tag="1", labels=["neg", "pos"], statistic="median") == 3.5
+    assert len(test_plate.statistics_cache) == 3
+
+    # Overwritten data is not taken from the cache, also if it is modified in place.
+    data = test_plate.readout.get_data("1")
+    data *= 2
+    test_plate.readout.add_data(data={"1": data}, tag="1")
+    assert test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mean") == 5
+    test_plate.readout.data = {"1": np.zeros((2, 3))}
+    assert test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mean") == 0
+
+    # Statistics of a changed layout are not taken from the cache.
+    test_plate.readout.data = {"1": np.array([[1, 2, 3], [4, 5, 6]])}
+    assert test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mean") == 2.5
+    test_plate.plate_layout.add_data(data={"layout": [["pos", "s_1", "neg"], ["pos", "s_2", "neg"]]}, tag="layout")
+    assert test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mean") == 4.5
+    test_plate.plate_layout.data["layout"] = [["neg", "neg", "pos"], ["pos", "s_2", "pos"]]
+    assert test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mean") == 1.5
+
+    with pytest.raises(ValueError):
+        test_plate.get_statistic(value_data_tag="1", labels="neg", statistic="mode")
+
+
 @pytest.mark.no_external_software_required
 def test_create_from_insulin_csv(path_raw):
 
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from hts.plate import plate, well_name_codec
+
+
+@pytest.mark.no_external_software_required
+def test_encode_row_names():
+    assert well_name_codec.encode_row_names(np.arange(702)).tolist() == plate.LETTERS
+    assert well_name_codec.encode_row_names([702, 703, 18277, 18278]).tolist() == ["AAA", "AAB", "ZZZ", "AAAA"]
+
+
+@pytest.mark.no_external_software_required
+def test_decode():
+    rows, columns = well_name_codec.decode([" a1", "B012", "AF48", "AF48", "ZZ1000", "AAA7"])
+    assert rows.tolist() == [0, 1, 31, 31, 701, 702]
+    assert columns.tolist() == [0, 11, 47, 47, 999, 6]
+
+    rows, columns = well_name_codec.decode(np.array([["A1", "A2"], ["B1", "B2"]], dtype=object))
+    assert rows.tolist() == [[0, 0], [1, 1]]
+    assert columns.tolist() == [[0, 1], [0, 1]]
+
+    for well_name in ["A0", "1A", "A", "A1B", "A-1", ""]:
+        with pytest.raises(ValueError):
+            well_name_codec.decode([well_name])
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("padding", [0, 2, 3])
+def test_encode(padding):
+    rows, columns = np.indices((40, 60))
+    well_names = well_name_codec.encode(rows, columns, padding=padding)
+    pattern = "{}{:0" + str(padding) + "d}" if padding else "{}{}"
+    assert well_names[1, 2] == pattern.format("B", 3)
+    assert well_names[33, 59] == pattern.format("AH", 60)
+    assert all(well_name == plate.translate_coordinate_humanreadable((i_row, i_column), pattern=pattern)
+               for (i_row, i_column), well_name in np.ndenumerate(well_names))
+    decoded_rows, decoded_columns = well_name_codec.decode(well_names)
+    assert np.array_equal(decoded_rows, rows) and np.array_equal(decoded_columns, columns)
+
+
+@pytest.mark.no_external_software_required
+def test_get_padding():
+    assert well_name_codec.get_padding("{}{}") == 0
+    assert well_name_codec.get_padding("{}{:03d}") == 3
+    assert well_name_codec.get_padding("{}{:3d}") is None
+    assert well_name_codec.get_padding("{}_{}") is None
+    assert well_name_codec.get_padding(None) is None
@@ -0,0 +1,142 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Vectorized conversion between human readable well names (e.g. "A1", "B012", "AF48") and 0-based
+    (row, column) coordinates.
+
+    Rows are named A-Z, AA-AZ, BA-BZ, ..., ZZ, AAA, ... (bijective base 26), and columns are numbered from 1, with
+    optional zero padding. There is no limit on the plate dimensions.
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import logging
+import re
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+N_LETTERS = 26
+# Well name patterns (as in `run_io.get_well_names`) that are fully described by a zero padding of the column number.
+PADDED_PATTERN = re.compile(r"^\{\}\{(?::0(\d+)d)?\}$")
+
+
+def get_padding(pattern):
+    """ Get the zero padding of the column number of a well name pattern, e.g. 3 for "{}{:03d}", or 0 for "{}{}".
+
+    Returns:
+        int: The padding, or None if `pattern` is not a row name followed by a (zero padded) column number.
+    """
+
+    match = PADDED_PATTERN.match(pattern) if isinstance(pattern, str) else None
+    if not match:
+        return None
+    return int(match.group(1)) if match.group(1) else 0
+
+
+def encode_row_names(rows):
+    """ Get the row names of 0-based row indices, e.g. "A" for 0, "Z" for 25, "AA" for 26.
+
+    Args:
+        rows (np.ndarray of int): The row indices.
+
+    Returns:
+        np.ndarray of str: The row names, in the shape of `rows`.
+    """
+
+    rows = np.asarray(rows, dtype=np.int64)
+    if (rows < 0).any():
+        raise ValueError("Row indices must not be negative: {}".format(rows[rows < 0][:5].tolist()))
+    if rows.size == 0:
+        return np.empty(rows.shape, dtype="U1")
+
+    # Bijective base 26: the number of letters is the smallest n with 26 + 26^2 + ... + 26^n > row.
+    n_letters = np.ones(rows.shape, dtype=np.int64)
+    offset = rows.copy()
+    while True:
+        is_longer = offset >= N_LETTERS ** n_letters
+        if not is_longer.any():
+            break
+        offset[is_longer] -= N_LETTERS ** n_letters[is_longer]
+        n_letters[is_longer] += 1
+
+    # The row name is the offset in base 26, with n_letters digits A-Z, right aligned in a fixed width code array.
+    max_letters = int(n_letters.max())
+    powers = N_LETTERS ** np.arange(max_letters - 1, -1, -1, dtype=np.int64)
+    codes = (offset[..., np.newaxis] // powers) % N_LETTERS + ord("A")
+    codes[np.arange(max_letters) < (max_letters - n_letters)[..., np.newaxis]] = 0
+    # Move the padding to the end, as numpy strings are null terminated.
+    codes = np.take_along_axis(codes, (np.arange(max_letters) + (max_letters - n_letters)[..., np.newaxis]) %
+                               max_letters, axis=-1)
+    return codes.astype(np.uint32).view("U{}".format(max_letters))[..., 0]
+
+
+def decode(well_names):
+    """ Convert human readable well names (e.g. "A1", "b012", "AF48") to 0-based coordinates.
+
+    Leading and trailing whitespace is ignored, letters may be lower case, and column numbers may be zero padded.
+    Each distinct well name is decoded once.
+
+    Args:
+        well_names (list or np.ndarray of str): The well names.
+
+    Returns:
+        rows (np.ndarray of int), columns (np.ndarray of int): The coordinates, in the shape of `well_names`.
+    """
+
+    well_names = np.asarray(well_names)
+    shape = well_names.shape
+    distinct_well_names, inverse = np.unique(well_names.astype(str).ravel(), return_inverse=True)
+    names = np.ascontiguousarray(np.char.upper(np.char.strip(distinct_well_names)))
+    if names.size == 0:
+        return np.empty(shape, dtype=int), np.empty(shape, dtype=int)
+
+    length = max(names.dtype.itemsize // 4, 1)
+    codes = names.astype("U{}".format(length)).view(np.uint32).reshape(len(names), length).astype(np.int64)
+    position = np.arange(length)
+    is_letter = (codes >= ord("A")) & (codes <= ord("Z"))
+    is_digit = (codes >= ord("0")) & (codes <= ord("9"))
+    n_letters = is_letter.sum(axis=1)[:, np.newaxis]
+    n_characters = n_letters + is_digit.sum(axis=1)[:, np.newaxis]
+
+    # Valid names are letters, followed by digits, followed by the padding of the fixed width array.
+    is_valid = ((is_letter == (position < n_letters)).all(axis=1) &
+                (is_digit == ((position >= n_letters) & (position < n_characters))).all(axis=1) &
+                ((codes == 0) == (position >= n_characters)).all(axis=1) &
+                (n_letters[:, 0] > 0) & (n_characters[:, 0] > n_letters[:, 0]))
+
+    # Rows: bijective base 26, e.g. "AB" = 1 * 26 + 2.
+    letter_powers = np.where(is_letter, N_LETTERS ** np.clip(n_letters - 1 - position, 0, None), 0)
+    rows = (np.where(is_letter, codes - ord("A") + 1, 0) * letter_powers).sum(axis=1) - 1
+    # Columns: decimal.
+    digit_powers = np.where(is_digit, 10 ** np.clip(n_characters - 1 - position, 0, None), 0)
+    columns = (np.where(is_digit, codes - ord("0"), 0) * digit_powers).sum(axis=1) - 1
+
+    is_valid &= columns >= 0
+    if not is_valid.all():
+        raise ValueError("Well names do not match the pattern [A-Za-z]+[0-9]+ (with a column number > 0): {}"
+                         "".format(distinct_well_names[~is_valid][:5].tolist()))
+
+    return rows[inverse].reshape(shape), columns[inverse].reshape(shape)
+
+
+def encode(rows, columns, padding=0):
+    """ Convert 0-based coordinates to human readable well names, e.g. (0, 0) to "A1", or to "A001" for padding 3.
+
+    Args:
+        rows (np.ndarray of int): The row indices.
+        columns (np.ndarray of int): The column indices, in the shape of `rows`.
+        padding (int): The minimal number of digits of the column number, padded with zeros.
+
+    Returns:
+        np.ndarray of str: The well names, in the shape of `rows`.
+    """
+
+    rows, columns = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64))
+    if (columns < 0).any():
+        raise ValueError("Column indices must not be negative: {}".format(columns[columns < 0][:5].tolist()))
+    column_names = (columns + 1).astype(str)
+    if padding:
+        column_names = np.char.zfill(column_names, int(padding))
+    return np.char.add(encode_row_names(rows), column_names)
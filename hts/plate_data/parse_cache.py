@@ -0,0 +1,286 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: An on-disk cache of parsed raw data files, keyed by file content.
+
+    The cache is a directory with one entry file per parsed file. An entry is keyed by the sha256 hash of the file
+    content, the parser name and the parser keyword arguments, such that changed files (or changed parser settings)
+    are reparsed, and renamed or copied files are not. Matrices in the parse results are stored as numpy arrays
+    (numbers and strings in fixed size dtypes). An entry is a .npz file of these arrays, plus the JSON structure of
+    the parse result (dicts, lists, tuples and scalars), and is read without unpickling. Parse results that cannot be
+    stored this way are not cached, unless pickling is explicitly allowed. If the cache is size-bounded, the least
+    recently used entries are evicted.
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import pickle
+import tempfile
+import zipfile
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+ENTRY_EXTENSION = ".npz"
+PICKLE_ENTRY_EXTENSION = ".pickle"
+STRUCTURE_MEMBER = "structure"
+JSON_SCALARS = (str, int, float, bool, type(None))
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+def hash_file(file):
+    """ Compute the sha256 hex digest of the content of `file`.
+    """
+
+    sha = hashlib.sha256()
+    with open(file, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def compact(value):
+    """ Convert all matrices (lists of lists of equal length) in a parse result to numpy arrays.
+
+    Matrices of only numbers keep a numeric dtype, matrices of only strings get a fixed size string dtype, all other
+    matrices (e.g. strings mixed with numbers or None) dtype object. Dicts, lists and tuples are converted
+    recursively.
+
+    Args:
+        value: A parse result, e.g. (plate_info, channel_wise_reads, channel_wise_info).
+
+    Returns:
+        The parse result, with numpy arrays instead of matrices.
+    """
+
+    if isinstance(value, dict):
+        return {i: compact(j) for i, j in value.items()}
+    elif isinstance(value, tuple):
+        return tuple(compact(i) for i in value)
+    elif isinstance(value, list):
+        if len(value) > 0 and all(isinstance(i, list) for i in value) and len(set(len(i) for i in value)) == 1:
+            array = np.asarray(value)
+            if array.dtype.kind in "biuf" and array.ndim == 2:
+                return array
+            elif array.dtype.kind == "U" and all(isinstance(j, str) for i in value for j in i):
+                return array
+            array = np.empty((len(value), len(value[0])), dtype=object)
+            array[:] = value
+            return array
+        return [compact(i) for i in value]
+    return value
+
+
+def encode(value, arrays):
+    """ Encode a compacted parse result as JSON structure. Numeric and string arrays are appended to `arrays`, and
+    referenced by their position.
+
+    Raises:
+        TypeError: If `value` contains values other than dicts, lists, tuples, numpy arrays and JSON scalars.
+    """
+
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, JSON_SCALARS):
+        return {"value": value}
+    elif isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        arrays.append(value)
+        return {"array": len(arrays) - 1}
+    elif isinstance(value, np.ndarray):
+        values = [i.item() if isinstance(i, np.generic) else i for i in value.ravel().tolist()]
+        if not all(isinstance(i, JSON_SCALARS) for i in values):
+            raise TypeError("The object array contains values that are not JSON scalars.")
+        return {"object_array": {"shape": list(value.shape), "values": values}}
+    elif isinstance(value, dict):
+        return {"dict": [[encode(i, arrays), encode(j, arrays)] for i, j in value.items()]}
+    elif isinstance(value, (list, tuple)):
+        return {type(value).__name__: [encode(i, arrays) for i in value]}
+    raise TypeError("Values of type {} cannot be stored without pickling.".format(type(value).__name__))
+
+
+def decode(node, arrays):
+    """ Decode the JSON structure `node` of a parse result (see `encode`), with its `arrays`.
+    """
+
+    if "value" in node:
+        return node["value"]
+    elif "array" in node:
+        return arrays[node["array"]]
+    elif "object_array" in node:
+        array = np.empty(len(node["object_array"]["values"]), dtype=object)
+        array[:] = node["object_array"]["values"]
+        return array.reshape(node["object_array"]["shape"])
+    elif "dict" in node:
+        return {decode(i, arrays): decode(j, arrays) for i, j in node["dict"]}
+    elif "tuple" in node:
+        return tuple(decode(i, arrays) for i in node["tuple"])
+    return [decode(i, arrays) for i in node["list"]]
+
+
+class ParseCache:
+
+    """ ``ParseCache`` holds the results of file parsers on disk, keyed by file content, parser and parser kwargs.
+
+    Attributes:
+        path (str): Path to the cache directory.
+        max_size (int): The maximum total size of all entries in bytes. If None, entries are never evicted.
+        allow_pickle (bool): If True, parse results that cannot be stored as arrays and JSON are pickled, and pickled
+                             entries are read. Only use for cache directories that no one else can write to.
+        n_hits (int): The number of parse results retrieved from the cache.
+        n_misses (int): The number of files parsed.
+    """
+
+    def __init__(self, path, max_size=None, allow_pickle=False):
+
+        if not os.path.exists(path):
+            LOG.debug("Create dir: {}".format(path))
+            os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.max_size = int(max_size) if max_size is not None else None
+        self.allow_pickle = allow_pickle
+        self.n_hits = 0
+        self.n_misses = 0
+
+
+    def get_key(self, parser, file, **kwargs):
+        """ Get the cache key of the results of `parser` for `file` and `kwargs`.
+        """
+
+        description = repr((FORMAT_VERSION, parser.__module__, parser.__name__, sorted(kwargs.items())))
+        return hashlib.sha256((hash_file(file) + description).encode()).hexdigest()
+
+
+    def parse(self, parser, file, **kwargs):
+        """ Return the result of ``parser(file, **kwargs)``, from the cache if possible.
+
+        On a cache miss, the file is parsed, and the compacted result (see `compact`) is stored as arrays and JSON
+        structure (see `encode`). Results that cannot be stored this way are only pickled if `allow_pickle`.
+
+        Args:
+            parser (function): The file parser, e.g. ``readout_io.read_envision_csv``.
+            file (str): Path to the file.
+            **kwargs: Keyword arguments of `parser`.
+
+        Returns:
+            The compacted parse result.
+        """
+
+        key = self.get_key(parser, file, **kwargs)
+        entry = os.path.join(self.path, key + ENTRY_EXTENSION)
+        pickle_entry = os.path.join(self.path, key + PICKLE_ENTRY_EXTENSION)
+        for i_entry, read_entry in [(entry, self.read_entry)] + \
+                ([(pickle_entry, self.read_pickle_entry)] if self.allow_pickle else []):
+            try:
+                result = read_entry(i_entry)
+            except FileNotFoundError:
+                continue
+            except (ValueError, KeyError, EOFError, zipfile.BadZipFile, pickle.UnpicklingError) as e:
+                LOG.warning("Ignore corrupt parse cache entry {}: {}".format(i_entry, e))
+                continue
+            self.n_hits += 1
+            LOG.debug("Parse cache hit for file: {}".format(file))
+            # Mark the entry as recently used.
+            try:
+                os.utime(i_entry)
+            except FileNotFoundError:
+                pass
+            return result
+
+        self.n_misses += 1
+        result = compact(parser(file, **kwargs))
+
+        arrays = []
+        try:
+            structure = encode(result, arrays)
+        except TypeError as e:
+            if not self.allow_pickle:
+                LOG.debug("Parse result of file {} is not cached: {}".format(file, e))
+                return result
+            self.write_entry(pickle_entry, lambda fh: pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL))
+        else:
+            members = {str(i): array for i, array in enumerate(arrays)}
+            members[STRUCTURE_MEMBER] = np.array(json.dumps(structure))
+            self.write_entry(entry, lambda fh: np.savez(fh, **members))
+
+        if self.max_size is not None:
+            self.evict()
+
+        return result
+
+
+    def read_entry(self, entry):
+        """ Read the parse result of the .npz `entry`, without unpickling.
+        """
+
+        with np.load(entry, allow_pickle=False) as members:
+            structure = json.loads(str(members[STRUCTURE_MEMBER]))
+            arrays = [members[str(i)] for i in range(len(members.files) - 1)]
+        return decode(structure, arrays)
+
+
+    def read_pickle_entry(self, entry):
+        """ Read the parse result of the pickled `entry`. Only used if `allow_pickle`.
+        """
+
+        with open(entry, "rb") as fh:
+            return pickle.load(fh)
+
+
+    def write_entry(self, entry, write):
+        """ Write an entry with `write` (a function of an open binary file).
+        """
+
+        # Write to a temporary file first, such that concurrent readers never see partial entries.
+        fd, tmp_entry = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp_entry, entry)
+
+
+    def evict(self):
+        """ Remove the least recently used entries until the total size is at most `max_size`.
+        """
+
+        entries = []
+        for file in os.listdir(self.path):
+            if file.endswith((ENTRY_EXTENSION, PICKLE_ENTRY_EXTENSION)):
+                try:
+                    stat = os.stat(os.path.join(self.path, file))
+                except FileNotFoundError:
+                    # Evicted concurrently.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file))
+
+        size = sum(i[1] for i in entries)
+        for _, entry_size, file in sorted(entries):
+            if size <= self.max_size:
+                break
+            LOG.debug("Evict parse cache entry: {}".format(file))
+            try:
+                os.remove(os.path.join(self.path, file))
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+def cached_parse(parser, file, parse_cache=None, **kwargs):
+    """ Return the result of ``parser(file, **kwargs)``, from `parse_cache` if given.
+
+    Args:
+        parser (function): The file parser.
+        file (str): Path to the file.
+        parse_cache (ParseCache or str): The cache, or the path to the cache directory. If None, `file` is parsed.
+        **kwargs: Keyword arguments of `parser`.
+    """
+
+    if parse_cache is None:
+        return parser(file, **kwargs)
+    if isinstance(parse_cache, str):
+        parse_cache = ParseCache(parse_cache)
+    return parse_cache.parse(parser, file, **kwargs)
@@ -12,14 +12,98 @@ import os
 import logging
 import pickle
 import string
+import threading
+
+import numpy as np
 
 from hts.plate_data import plate_data_io
+from hts.plate_data.parse_cache import cached_parse
 
 LOG = logging.getLogger(__name__)
 
+# Serializes the addition and removal of data, e.g. by independent protocol tasks performed in threads.
+DATA_LOCK = threading.RLock()
 PLATE_LETTERS = list(string.ascii_uppercase) + ["".join(i) for i in itertools.product(string.ascii_uppercase, string.ascii_uppercase)]
 
 
+def to_array(data):
+    """ Convert the data of a single data tag to a contiguous 2-D numpy array.
+
+    The dtype is chosen per data tag: bool, int and float data keep their numeric dtype, all other data (e.g. strings
+    or data including None) falls back to dtype object.
+
+    Args:
+        data (list of lists or np.ndarray): A matrix (height x width) of data.
+
+    Returns:
+        np.ndarray: A 2-D array (height x width).
+    """
+
+    array = np.asarray(data)
+    if array.dtype.kind not in "biuf":
+        if isinstance(data, np.ndarray):
+            array = data.astype(object, copy=False)
+        else:
+            # Do not convert from the coerced array: numpy would e.g. cast numbers mixed with strings to strings.
+            array = np.array(data, dtype=object)
+    if array.ndim != 2:
+        raise ValueError("Plate data must be a matrix (height x width), not of shape {}.".format(array.shape))
+    return array
+
+
+def as_list(value):
+    """ Wrap single values (e.g. a single sample name from a config file) in a list.
+    """
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        return list(value)
+    return [value]
+
+
+# Declarative predicates, each evaluated as a vectorized mask on a data array.
+PREDICATES = {"eq": lambda data, value: data == value,
+              "ne": lambda data, value: data != value,
+              "in": lambda data, value: np.isin(data, as_list(value)),
+              "not_in": lambda data, value: ~np.isin(data, as_list(value)),
+              "lt": lambda data, value: data < value,
+              "le": lambda data, value: data <= value,
+              "gt": lambda data, value: data > value,
+              "ge": lambda data, value: data >= value,
+              "range": lambda data, value: (data >= value[0]) & (data <= value[1]),
+              }
+
+
+def evaluate_condition(data, condition=None):
+    """ Evaluate `condition` on all wells of `data` and return the result as boolean mask.
+
+    `condition` is either
+    * None: All wells are selected.
+    * A dict of declarative predicates, e.g. {"in": ["neg", "pos"]} or {"range": (0, 1)}. All predicates need to be
+      fulfilled. See PREDICATES for all known predicates. Predicates are evaluated as vectorized masks.
+    * A method, e.g. lambda x: x == "neg". The method is applied to every well separately.
+
+    Args:
+        data (np.ndarray): The data array (height x width).
+        condition (dict or method): The condition.
+
+    Returns:
+        np.ndarray of bool (height x width)
+    """
+
+    if condition is None:
+        return np.ones(data.shape, dtype=bool)
+    elif isinstance(condition, dict):
+        mask = np.ones(data.shape, dtype=bool)
+        for predicate, value in condition.items():
+            if predicate not in PREDICATES:
+                raise ValueError("Predicate {} is not known. Use one of: {}".format(predicate, sorted(PREDICATES)))
+            mask &= PREDICATES[predicate](data, value)
+        return mask
+    elif callable(condition):
+        return np.frompyfunc(condition, 1, 1)(data).astype(bool)
+    else:
+        raise ValueError("condition must be None, a dict of predicates or a method, not {}".format(type(condition)))
+
+
 class PlateData:
 
     """ ``PlateData`` describes arbitrary data for all wells in a plate.
@@ -29,7 +113,8 @@ class PlateData:
     Attributes:
         width (int): Width of the plate
         height (int): Height of the plate
-        data (dict of lists of lists): A dict of same-sized matrices with arbitrary data
+        data (dict of np.ndarray): A dict of same-sized matrices (height x width) with arbitrary data. Each data tag is
+                                   stored as one contiguous array; the dtype is chosen per data tag (see `to_array`).
         tags (list of str): List of tags for each PlateData instance.
 
     """
@@ -39,7 +124,7 @@ class PlateData:
             Create string for Readout instance.
         """
         try:
-            data = ("{}\nContains a list of lists.\nwidth: {}\nheight: {}".format(type(self).__name__,
+            data = ("{}\nContains a numpy array per data tag.\nwidth: {}\nheight: {}".format(type(self).__name__,
                                                                                   self.width, self.height))
         except:
             data = "<PlateData instance>"
@@ -51,11 +136,9 @@ class PlateData:
     def __init__(self, data, type=None, **kwargs):
 
         if type:
-            self.data = {"{}_{}".format(type, i) :j for i,j in data.items()}
-        else:
-            self.data = data
-        self.height = len(next(iter(self.data.values())))
-        self.width = len(next(iter(self.data.values()))[0])
+            data = {"{}_{}".format(type, i) :j for i,j in data.items()}
+        self.data = {i: to_array(j) for i,j in data.items()}
+        self.height, self.width = next(iter(self.data.values())).shape
 
         if "name" in kwargs:
             self.name = kwargs.pop("name")
@@ -122,13 +205,14 @@ class PlateData:
 
 
     @classmethod
-    def create_csv(cls, path, name, tag=None, type=None, **kwargs):
-        data = plate_data_io.read_csv(path, **kwargs)
+    def create_csv(cls, path, name, tag=None, type=None, parse_cache=None, **kwargs):
+        data = cached_parse(plate_data_io.read_csv, path, parse_cache=parse_cache, **kwargs)
         return cls(name=name, data={type: data}, tag=tag)
 
 
     @classmethod
-    def create_excel_multiple_plates_per_file(cls, path, name, tag=None, type=None, **kwargs):
+    def create_excel_multiple_plates_per_file(cls, path, name, tag=None, type=None, parse_cache=None,
+                                              workbook_cache=None, **kwargs):
         """
         This is a hack, such that information for multiple plates can be retrieved from a single plate (see run.py)
 
@@ -137,6 +221,9 @@ class PlateData:
             name:
             tag:
             type:
+            parse_cache (ParseCache): If not None, the parse cache.
+            workbook_cache (plate_data_io.WorkbookCache): If not None, the excel workbook is opened only once for all
+                                                          plates.
             **kwargs: Kwargs contains "file", which is the path to the the excel file.
 
         Returns:
@@ -144,11 +231,12 @@ class PlateData:
         """
         tags = [path]
         path = kwargs.pop("file")
-        data = plate_data_io.read_excel(path=path, tags=tags, **kwargs)
+        parser = workbook_cache.read_excel if workbook_cache is not None else plate_data_io.read_excel
+        data = cached_parse(parser, path, parse_cache=parse_cache, tags=tags, **kwargs)
         return cls(name=name, data=data, tag=tag, type=type)
 
     @classmethod
-    def create_excel(cls, path, name, tag=None, type=None, **kwargs):
+    def create_excel(cls, path, name, tag=None, type=None, parse_cache=None, **kwargs):
         """
         In one excel file, the data for one plate is covered.
         Currently, all sheets in the excel file are used.
@@ -163,7 +251,7 @@ class PlateData:
         Returns:
             PlateData instance
         """
-        data = plate_data_io.read_excel(path=path, **kwargs)
+        data = cached_parse(plate_data_io.read_excel, path, parse_cache=parse_cache, **kwargs)
         return cls(name=name, data=data, tag=tag) # , type=type
 
 
@@ -189,7 +277,10 @@ class PlateData:
         """
         plate_data = {}
         for tag, tag_data in data.items():
-            plate_data[tag] = [[tag_data[(i_row, i_col)] if (i_row, i_col) in tag_data else None for i_col in range(width)] for i_row in range(height)]
+            tag_array = np.empty((height, width), dtype=object)
+            for (i_row, i_col), datum in tag_data.items():
+                tag_array[i_row, i_col] = datum
+            plate_data[tag] = tag_array
         return cls(data=plate_data, **kwargs)
 
 
@@ -210,8 +301,7 @@ class PlateData:
                 pickle.dump(self, fh)
         elif format == "csv":
             with open(path, 'w') as fh:
-                for row in self.data[tag]:
-                    fh.write(",".join([str(datum) for datum in row]) + "\n")
+                np.savetxt(fh, self.get_data(tag), fmt="%s", delimiter=",")
         else:
             raise NotImplementedError('Format is unknown: {}'.format(format))
 
@@ -226,20 +316,40 @@ class PlateData:
         if any([i in data for i in self.data.keys()]):
             LOG.warning("Overwriting data keys from {} to {}.".format(self.data.keys(), data.keys()))
 
-        self.data.update(data)
-
-        if tag:
-            self.tags += [tag]*len(data)
-        else:
+        data = {i: to_array(j) for i,j in data.items()}
+        for data_tag, tag_data in data.items():
+            if tag_data.shape != (self.height, self.width):
+                raise ValueError("Shape of data_tag {}: {} differs from the plate shape: {}"
+                                 "".format(data_tag, tag_data.shape, (self.height, self.width)))
+        # Assign (rather than update in place), such that subclasses may store data differently via a property.
+        with DATA_LOCK:
+            merged_data = dict(self.data)
+            merged_data.update(data)
+            self.data = merged_data
+            if tag:
+                self.tags += [tag]*len(data)
+
+        if not tag:
             LOG.warning("No tags were supplied.")
 
 
+    def remove_data(self, data_tags):
+        """ Remove the data tagged with any of `data_tags`. Missing data tags are ignored.
+
+        Args:
+            data_tags (list of str): The data tags to remove.
+        """
+
+        with DATA_LOCK:
+            self.data = {data_tag: data for data_tag, data in self.data.items() if data_tag not in data_tags}
+
+
     def get_data(self, data_tag):
         """
         Args:
             data_tag (str): The data_tag for which to retrieve a the data.
 
-        Returns: A matrix or lists of list (width x height) of data.
+        Returns: A np.ndarray (height x width) of data.
 
         """
         if data_tag not in self.data:
@@ -248,32 +358,47 @@ class PlateData:
         return self.data[data_tag]
 
 
-    def get_wells(self, data_tag, condition):
+    def get_mask(self, data_tag, condition=None):
+        """ Get a boolean mask of all wells for which the data tagged with `data_tag` conforms to `condition`.
+
+        Args:
+            data_tag (str): Data tag.
+            condition (dict or method): Declarative predicates (e.g. condition={"in": ["neg", "pos"]}), or a method
+                                        (e.g., condition=lambda x: x==True). See `evaluate_condition`.
+
+        Returns:
+            np.ndarray of bool (height x width)
+        """
+
+        return evaluate_condition(self.get_data(data_tag), condition)
+
+
+    def get_wells(self, data_tag, condition, as_array=False):
         """ Get list of well coordinates for which the data tagged with `data_tag` conforms to `condition`.
 
         Get list of well coordinates for which the data tagged with `data_tag` conforms to `condition`.
 
         Args:
             data_tag (str): Data tag.
-            condition (method): The condition expressed as a method. E.g., condition=lambda x: x==True
+            condition (dict or method): Declarative predicates (e.g. condition={"eq": True}), or a method
+                                        (e.g., condition=lambda x: x==True). See `evaluate_condition`.
+            as_array (bool): If True, return the coordinates as np.ndarray of shape (n_wells, 2).
 
         Returns:
-            (list of (int, int)).
+            (list of (int, int)), in row-major order.
         """
 
-        if data_tag in self.data:
-            data = self.data[data_tag]
-        else:
-            raise Exception("data_tag {} not in self.data {}".format(data_tag, self.data.keys()))
-
-        well_coordinates = [cc for cc in itertools.product(range(self.height), range(self.width)) if condition(data[cc[0]][cc[1]])]
+        mask = self.get_mask(data_tag=data_tag, condition=condition)
+        well_coordinates = np.argwhere(mask)
         if len(well_coordinates) == 0:
             LOG.warning("Under the applied condition (e.g. names for the plate layout), no wells are chosen")
 
-        return well_coordinates
+        if as_array:
+            return well_coordinates
+        return [tuple(cc) for cc in well_coordinates.tolist()]
 
 
-    def get_values(self, wells, data_tag, value_type=None):
+    def get_values(self, wells=None, data_tag=None, value_type=None, mask=None):
         """ Get list of values for defined `wells` of the data tagged with `data_tag`.
 
         Get list of values for defined `wells` of the data tagged with `data_tag`.
@@ -283,20 +408,23 @@ class PlateData:
             wells (lists of tuple):  List of well coordinates.
             data_tag (str): Data tag.
             value_type (str): The type of the return values.
+            mask (np.ndarray of bool): Alternatively to `wells`, the wells given as boolean mask (height x width).
 
         Returns:
             (list of x), where x are of type `value_type`, if `value_type` is set.
         """
 
-        if data_tag in self.data:
-            data = self.data[data_tag]
-        else:
-            raise Exception("data_tag {} not in self.data {}".format(data_tag, self.data.keys()))
+        data = self.get_data(data_tag)
 
-        values = [data[cc[0]][cc[1]] for cc in wells]
+        if mask is not None:
+            values = data[mask].tolist()
+        elif len(wells) == 0:
+            values = []
+        else:
+            rows, columns = zip(*wells)
+            values = data[list(rows), list(columns)].tolist()
 
         if value_type and not all([type(i) == value_type for i in values]):
             raise Exception("Not all values conform with value_type{}:\n{}".format(value_type, values))
 
         return values
-
@@ -6,12 +6,18 @@
     .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
 """
 
+import collections
 import csv
 import logging
+import os
+import threading
 import xlrd
 
 LOG = logging.getLogger(__name__)
 
+# The number of opened excel workbooks held by a ``WorkbookCache``.
+WORKBOOK_CACHE_SIZE = 4
+
 ################################## READ SCREEN DATA  #########################
 
 
@@ -48,7 +54,7 @@ def read_csv(file, delimiter=",", remove_empty_row=True):
 
 
 
-def read_excel(path, tags=None, **kwargs):
+def read_excel(path, tags=None, workbook=None, sheets=None, **kwargs):
     """Read plate data path in excel format.
 
     Read plate data path in excel format.
@@ -59,6 +65,9 @@ def read_excel(path, tags=None, **kwargs):
     Args:
         path (str): Path to the path with  data in the excel path format.
         tag (list of str): Names of all spreadsheets for which the data shall be returned.
+        workbook (xlrd.book.Book): The workbook at `path`, if opened before (see ``WorkbookCache``).
+        sheets (dict of list of lists): The rows per sheet name of the workbook at `path`, if read before (see
+                                        `WorkbookCache.read_sheets`).
 
 
     Returns:
@@ -66,26 +75,166 @@ def read_excel(path, tags=None, **kwargs):
 
     """
 
-    excel_workbook = xlrd.open_workbook(path)
+    if sheets is None:
+        excel_workbook = workbook if workbook is not None else xlrd.open_workbook(path)
 
-    if tags:
-        try:
-            excel_sheets = [excel_workbook.sheet_by_name(i) for i in tags]
-        except:
+        if tags:
+            try:
+                excel_sheets = [excel_workbook.sheet_by_name(i) for i in tags]
+            except:
+                raise ValueError('Retrieving the excel sheets by name failed.'
+                    'Probably, the tags {} were not included in the excel path {},'
+                    '{}'.format(tags, path, excel_workbook.sheet_names()))
+        else:
+            excel_sheets = excel_workbook.sheets()
+        sheets = {i_sheet.name: [i_sheet.row_values(i) for i in range(i_sheet.nrows)] for i_sheet in excel_sheets}
+    elif tags:
+        if any(i not in sheets for i in tags):
             raise ValueError('Retrieving the excel sheets by name failed.'
                 'Probably, the tags {} were not included in the excel path {},'
-                '{}'.format(tags, path, excel_workbook.sheet_names()))
-    else:
-        excel_sheets = excel_workbook.sheets()
+                '{}'.format(tags, path, list(sheets)))
+        sheets = {i: sheets[i] for i in tags}
 
-    data = {}
-    for i_sheet in excel_sheets:
-        # Only add sheets that contain data:
-        if i_sheet.nrows > 0:
-            tmp_data = [i_sheet.row_values(i) for i in range(i_sheet.nrows)]
-            data[i_sheet.name] = tmp_data
+    # Only add sheets that contain data:
+    data = {name: rows for name, rows in sheets.items() if len(rows) > 0}
 
     if data == {}:
         raise ValueError('One of the requested excel sheets in {} with defined tags {} is empty.'.format(path, tags))
 
-    return data
\ No newline at end of file
+    return data
+
+
+class WorkbookCache:
+
+    """ ``WorkbookCache`` holds the excel workbooks opened while a run is created.
+
+    Multi-plate workbooks (one sheet per plate) are read once per plate. With this cache, each workbook is only
+    opened and parsed once, also if plates are read in parallel threads: these wait for the first thread to open the
+    same workbook, while other workbooks are opened concurrently. The `max_size` most recently used workbooks are
+    held; a changed file (size or modification time) is opened again. Once closed, workbooks are no longer held, e.g.
+    for the readouts of lazy runs parsed later on.
+
+    The cache is shared by all copies of a run config (deep copies return the cache itself). Pickled copies, e.g. for
+    worker processes, hold no workbooks, but the sheets read before. Hence, for worker processes, all sheets of a
+    workbook are read once with `read_sheets`, and each worker is sent only the sheets it needs (see `get_subset`).
+
+    Attributes:
+        max_size (int): The maximum number of held workbooks.
+        workbooks (collections.OrderedDict): The workbooks, per (path, modification time, size).
+        sheets (dict of dict): The rows per sheet name of the workbooks read with `read_sheets`, per (path,
+                               modification time, size).
+        is_closed (bool): If True, workbooks are opened, but not held.
+    """
+
+    def __init__(self, max_size=WORKBOOK_CACHE_SIZE):
+
+        self.max_size = max_size
+        self.workbooks = collections.OrderedDict()
+        self.sheets = {}
+        self.is_closed = False
+        self.lock = threading.Lock()
+        self.path_locks = {}
+
+
+    def __getstate__(self):
+
+        return {"max_size": self.max_size, "is_closed": self.is_closed, "sheets": self.sheets}
+
+
+    def __setstate__(self, state):
+
+        self.__init__(max_size=state["max_size"])
+        self.is_closed = state["is_closed"]
+        self.sheets = state["sheets"]
+
+
+    def __deepcopy__(self, memo):
+
+        return self
+
+
+    def get_key(self, path):
+        """ Get the cache key of the excel file at `path`: (absolute path, modification time, size).
+        """
+
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+    def open(self, path):
+        """ Open the excel workbook at `path`, or return the workbook opened before if `path` is unchanged.
+
+        Args:
+            path (str): Path to the excel file.
+
+        Returns:
+            xlrd.book.Book
+        """
+
+        key = self.get_key(path)
+        with self.lock:
+            if self.is_closed:
+                path_lock = None
+            else:
+                path_lock = self.path_locks.setdefault(key[0], threading.Lock())
+        if path_lock is None:
+            return xlrd.open_workbook(path)
+
+        with path_lock:
+            with self.lock:
+                if key in self.workbooks:
+                    self.workbooks.move_to_end(key)
+                    return self.workbooks[key]
+            excel_workbook = xlrd.open_workbook(path)
+            with self.lock:
+                if not self.is_closed:
+                    self.workbooks[key] = excel_workbook
+                    while len(self.workbooks) > self.max_size:
+                        self.workbooks.popitem(last=False)
+        return excel_workbook
+
+
+    def read_excel(self, path, tags=None, **kwargs):
+        """ `read_excel`, with the workbook from this cache.
+
+        As this method has the module and name of `read_excel`, parse cache entries are shared with `read_excel`.
+        """
+
+        sheets = self.sheets.get(self.get_key(path))
+        if sheets is not None:
+            return read_excel(path, tags=tags, sheets=sheets, **kwargs)
+        return read_excel(path, tags=tags, workbook=self.open(path), **kwargs)
+
+
+    def read_sheets(self, path):
+        """ Read the rows of all sheets of the excel workbook at `path` once, for `read_excel` and `get_subset`.
+        """
+
+        key = self.get_key(path)
+        if key not in self.sheets:
+            excel_workbook = self.open(path)
+            self.sheets[key] = {i_sheet.name: [i_sheet.row_values(i) for i in range(i_sheet.nrows)]
+                                for i_sheet in excel_workbook.sheets()}
+        return self.sheets[key]
+
+
+    def get_subset(self, path, tags):
+        """ Get a closed ``WorkbookCache`` with only the sheets `tags` of the workbook at `path`, read before with
+        `read_sheets`, e.g. to be sent to a worker process.
+        """
+
+        key = self.get_key(path)
+        subset = WorkbookCache(max_size=self.max_size)
+        subset.is_closed = True
+        subset.sheets[key] = {i: self.sheets[key][i] for i in tags if i in self.sheets[key]}
+        return subset
+
+
+    def close(self):
+        """ Release all workbooks and sheets, and stop holding newly opened workbooks.
+        """
+
+        with self.lock:
+            self.is_closed = True
+            self.workbooks.clear()
+            self.sheets.clear()
@@ -7,15 +7,120 @@
 """
 
 
+import collections.abc
 import itertools
 import logging
 import numpy as np
 
 from hts.plate_data import plate_data_io
 from hts.plate_data import plate_data
+from hts.plate_data.parse_cache import cached_parse
 
 LOG = logging.getLogger(__name__)
 
+# Data tags which are stored as an integer code matrix plus a vocabulary.
+CODED_DATA_TAGS = ["layout", "layout_general_type"]
+# Data tags for which an inverted index (label -> wells) is built.
+INDEXED_DATA_TAGS = CODED_DATA_TAGS
+# Data tags that are derived from the layout whenever it is set.
+DERIVED_DATA_TAGS = ["layout_general_type", "sample_replicate_count"]
+# Versions of set layouts, such that statistics cached for a changed layout are recalculated.
+LAYOUT_VERSIONS = itertools.count()
+
+
+def encode_labels(labels):
+    """ Encode a label matrix as a vocabulary and an integer code matrix, such that vocabulary[codes] == labels.
+
+    Args:
+        labels (list of lists or np.ndarray): A label matrix (height x width).
+
+    Returns:
+        vocabulary (np.ndarray of object): The sorted distinct labels.
+        codes (np.ndarray of unsigned int): The code matrix (height x width), in the smallest sufficient dtype.
+    """
+
+    labels = plate_data.to_array(labels)
+    vocabulary, codes = np.unique(labels.ravel(), return_inverse=True)
+    return vocabulary.astype(object), compact_codes(codes.ravel(), len(vocabulary)).reshape(labels.shape)
+
+
+def compact_codes(codes, n_codes):
+    """ Cast `codes` to the smallest unsigned integer dtype that holds `n_codes` distinct codes.
+    """
+
+    return codes.astype(np.min_scalar_type(max(n_codes - 1, 0)))
+
+
+def cumulative_count(codes, n_codes):
+    """ Count the occurrences of each code, traversing `codes` row-wise.
+
+    The first occurrence of a code is counted as 1, the second as 2, and so on.
+
+    Args:
+        codes (np.ndarray of int): A code matrix.
+        n_codes (int): The number of distinct codes.
+
+    Returns:
+        np.ndarray of int: The occurrence count of each well, in the shape of `codes`.
+    """
+
+    flat_codes = codes.ravel()
+    # A stable sort groups the wells by code and keeps the wells of each code in row-major order.
+    order = np.argsort(flat_codes, kind="stable")
+    counts = np.bincount(flat_codes, minlength=n_codes)
+    group_starts = np.cumsum(counts) - counts
+    count = np.empty(len(flat_codes), dtype=int)
+    count[order] = np.arange(len(flat_codes)) - np.repeat(group_starts, counts) + 1
+    return count.reshape(codes.shape)
+
+
+class LayoutData(collections.abc.MutableMapping):
+
+    """ ``LayoutData`` is the mutable dict view of the data of a ``PlateLayout``.
+
+    Coded data tags are decoded on access, and setting or deleting a data tag sets the data of the layout, such that
+    e.g. `layout.data["layout"] = labels` re-derives the DERIVED_DATA_TAGS.
+    """
+
+    def __init__(self, layout):
+
+        self.layout = layout
+
+
+    def __getitem__(self, data_tag):
+
+        if data_tag in self.layout.codes:
+            return self.layout.get_data(data_tag)
+        return self.layout._data[data_tag]
+
+
+    def __setitem__(self, data_tag, tag_data):
+
+        if data_tag in DERIVED_DATA_TAGS:
+            raise ValueError("Data tag {} is derived from the layout and cannot be set.".format(data_tag))
+        data = dict(self.layout._data)
+        data["layout"] = self.layout.get_data("layout")
+        data[data_tag] = tag_data
+        self.layout.data = data
+
+
+    def __delitem__(self, data_tag):
+
+        if data_tag in CODED_DATA_TAGS + DERIVED_DATA_TAGS:
+            raise ValueError("Data tag {} cannot be removed from a PlateLayout.".format(data_tag))
+        del self.layout._data[data_tag]
+
+
+    def __iter__(self):
+
+        yield from self.layout.codes
+        yield from self.layout._data
+
+
+    def __len__(self):
+
+        return len(self.layout.codes) + len(self.layout._data)
+
 
 class PlateLayout(plate_data.PlateData):
 
@@ -28,40 +133,178 @@ class PlateLayout(plate_data.PlateData):
     s_k: sample k
     All other names may be used, but are not interpreted at current.
 
+    The CODED_DATA_TAGS are stored as integer code matrices plus a vocabulary, and are decoded to label matrices
+    on access via `data` or `get_data`. Conditions on CODED_DATA_TAGS are evaluated once per vocabulary entry.
+    Whenever the layout is set (on construction, via `add_data` or via `data`), the labels are lower-cased, and the
+    DERIVED_DATA_TAGS and the index are derived from it.
+
     Attributes:
-        sample_replicate_count (str): (Explain!)
-        layout_general_type (list of lists): The plate layout
+        sample_replicate_count (np.ndarray of int): The replicate number of each well. Traversing row-wise, the
+                                                    first occurence of a layout label is counted as replicate 1,
+                                                    and so on.
+        layout_general_type (np.ndarray): The plate layout in short form, e.g. s_1 -> s
+        codes (dict of np.ndarray of unsigned int): The code matrix for each of CODED_DATA_TAGS.
+        vocabulary (dict of np.ndarray): The sorted distinct labels for each of CODED_DATA_TAGS, such that
+                                         vocabulary[data_tag][codes[data_tag]] is the label matrix.
+        index (dict of dict of np.ndarray): For all INDEXED_DATA_TAGS, the flat (row-major) indices of all wells per
+                                            label. E.g. index["layout_general_type"]["neg"]. Built once on
+                                            construction, and hence shared by all plates with the same layout.
+        version (int): Changes whenever the layout data is set, see `get_version`.
 
     """
 
     def __init__(self, layout, **kwargs):
 
-        # Perform PlateLayout specific __init__
+        super().__init__(data={"layout": layout}, **kwargs)
 
-        # Get short forms of well content. E.g. s_1 -> s
-        # Assuming that the short forms are marked by the underscore character "_"
 
-        layout = [[datum.lower() for datum in row] for row in layout]
+    def __setstate__(self, state):
+
+        if "codes" not in state:
+            # Pickled before the labels were stored as codes: the label matrices are in state["data"].
+            data = state.pop("data")
+            self.__dict__.update(state)
+            self.data = data
+        else:
+            self.__dict__.update(state)
+            # Versions are only unique within one process.
+            self.version = next(LAYOUT_VERSIONS)
 
+
+    @property
+    def data(self):
+        return LayoutData(self)
+
+
+    @data.setter
+    def data(self, data):
+        # DERIVED_DATA_TAGS in `data` are ignored: they are always derived from the layout.
+        if "layout" not in data:
+            raise ValueError("The data of a PlateLayout requires the data tag layout, got: {}".format(sorted(data)))
+        self._data = {data_tag: plate_data.to_array(tag_data) for data_tag, tag_data in data.items()
+                      if data_tag not in CODED_DATA_TAGS + DERIVED_DATA_TAGS}
+        self.set_layout(data["layout"])
+
+
+    def set_layout(self, layout):
+        """ Set the layout, and derive the DERIVED_DATA_TAGS and the index from it. Labels are lower-cased.
+
+        The label operations are performed once per distinct label, not once per well.
+
+        Args:
+            layout (list of lists or np.ndarray): The label matrix (height x width).
+        """
+
+        vocabulary, codes = encode_labels(layout)
+        vocabulary, code_map = np.unique([label.lower() for label in vocabulary], return_inverse=True)
+        codes = compact_codes(code_map.ravel()[codes], len(vocabulary))
+
+        # Get short forms of well content. E.g. s_1 -> s
+        # Assuming that the short forms are marked by the underscore character "_"
         deliminator = "_"
-        layout_general_type = [[j.split(deliminator)[0] for j in i] for i in layout]
+        general_vocabulary, general_code_map = np.unique([label.split(deliminator)[0] for label in vocabulary],
+                                                         return_inverse=True)
+        general_codes = compact_codes(general_code_map.ravel()[codes], len(general_vocabulary))
+
+        self.vocabulary = {"layout": vocabulary.astype(object), "layout_general_type": general_vocabulary.astype(object)}
+        self.codes = {"layout": codes, "layout_general_type": general_codes}
 
         # Define sample replicates. Traverse row-wise, the first occurence is counted as replicate 1, and so on.
-        counter = {i:1 for i in set([item for sublist in layout for item in sublist])}
-        sample_replicate_count = np.zeros_like(layout)
-        for iRow, iColumn in itertools.product(range(len(layout)), range(len(layout[0]))):
-            type = layout[iRow][iColumn]
-            sample_replicate_count[iRow][iColumn] = counter[type]
-            counter[type] += 1
+        self._data["sample_replicate_count"] = cumulative_count(codes, len(vocabulary))
+
+        self.build_index()
+        self.version = next(LAYOUT_VERSIONS)
+
+
+    def get_version(self):
+        """ Get the version of the layout data, which changes whenever the data is set (on construction, via
+        `add_data` or via `data`).
+        """
+
+        if not hasattr(self, "version"):
+            # E.g. layouts read from a run container.
+            self.version = next(LAYOUT_VERSIONS)
+        return self.version
+
+
+    def get_data(self, data_tag):
+
+        if data_tag in self.codes:
+            return self.vocabulary[data_tag][self.codes[data_tag]]
+
+        return super().get_data(data_tag)
 
-        data = {"layout": layout, "layout_general_type": layout_general_type, "sample_replicate_count": sample_replicate_count}
 
-        super().__init__(data=data, **kwargs)
+    def build_index(self):
+        """ Build the inverted index from each label to the flat indices of its wells, for all INDEXED_DATA_TAGS.
+
+        The flat indices of a label are sorted, that is, in row-major order (as for `get_wells`).
+        """
+
+        self.index = {}
+        for data_tag in INDEXED_DATA_TAGS:
+            codes = self.codes[data_tag].ravel()
+            # A stable sort groups the wells by label and keeps the wells of each label in row-major order.
+            wells_sorted_by_label = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes, minlength=len(self.vocabulary[data_tag]))
+            wells_per_label = np.split(wells_sorted_by_label, np.cumsum(counts)[:-1])
+            self.index[data_tag] = dict(zip(self.vocabulary[data_tag].tolist(), wells_per_label))
+
+
+    def get_well_indices(self, labels, data_tag="layout"):
+        """ Get the flat (row-major) indices of all wells with one of `labels` in the data tagged with `data_tag`.
+
+        For a single label, this is a dict lookup in the precomputed index.
+
+        Args:
+            labels (str or list of str): A label or a list of labels, e.g. "neg" or ["neg_1", "neg_2"]
+            data_tag (str): One of INDEXED_DATA_TAGS.
+
+        Returns:
+            np.ndarray of int: The sorted flat indices. Use e.g. readout.ravel()[indices] to get the values.
+        """
+
+        if not hasattr(self, "index"):
+            # E.g. layouts read from a run container are indexed on first use.
+            self.build_index()
+        if data_tag not in self.index:
+            raise ValueError("data_tag {} is not indexed. Use one of: {}".format(data_tag, INDEXED_DATA_TAGS))
+
+        index = self.index[data_tag]
+        labels = plate_data.as_list(labels)
+        if len(labels) == 1:
+            return index.get(labels[0], np.array([], dtype=np.intp))
+        indices = [index[label] for label in set(labels) if label in index]
+        if len(indices) == 0:
+            return np.array([], dtype=np.intp)
+        return np.sort(np.concatenate(indices))
+
+
+    def get_mask(self, data_tag, condition=None):
+        """ Get a boolean mask of all wells for which the data tagged with `data_tag` conforms to `condition`.
+
+        For CODED_DATA_TAGS, `condition` is evaluated on the vocabulary, and mapped to the wells via the codes.
+        See `PlateData.get_mask`.
+        """
+
+        if data_tag in self.codes:
+            return plate_data.evaluate_condition(self.vocabulary[data_tag], condition)[self.codes[data_tag]]
+
+        return super().get_mask(data_tag=data_tag, condition=condition)
+
+
+    def add_data(self, data, tag=None):
+
+        derived_data_tags = [data_tag for data_tag in data if data_tag in DERIVED_DATA_TAGS]
+        if derived_data_tags:
+            raise ValueError("Data tags {} are derived from the layout and cannot be added.".format(derived_data_tags))
+
+        super().add_data(data=data, tag=tag)
 
 
     @classmethod
-    def create_csv(cls, path, name, tag=None, **kwargs):
-        data = plate_data_io.read_csv(path)
+    def create_csv(cls, path, name, tag=None, parse_cache=None, **kwargs):
+        data = cached_parse(plate_data_io.read_csv, path, parse_cache=parse_cache)
         return cls(name=name, layout=data, tag=tag)
 
 
@@ -73,6 +316,5 @@ class PlateLayout(plate_data.PlateData):
         to be adjusted.
         """
 
-        inverted_layout = [[j for j in i[::-1]] for i in self.data["layout"][::-1]]
-        return PlateLayout(name="{}_inverted".format(self.name), data={"layout": inverted_layout})
-
+        inverted_layout = self.get_data("layout")[::-1, ::-1]
+        return PlateLayout(name="{}_inverted".format(self.name), layout=inverted_layout)
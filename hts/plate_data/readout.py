@@ -6,14 +6,69 @@
     .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
 """
 
+import collections
+import itertools
 import logging
 import numpy as np
+import os
+import tempfile
+import threading
 
 from hts.plate_data import plate_data, readout_io
+from hts.plate_data.parse_cache import cached_parse
 
 
 LOG = logging.getLogger(__name__)
 
+# Cell values that are read as NaN.
+NA_VALUES = ["", "N/A", "NA", "NaN", "nan", "None", "-"]
+# Versions of added readout data, such that statistics cached for overwritten data are recalculated.
+DATA_VERSIONS = itertools.count()
+
+
+def to_float_array(data, na_values=NA_VALUES, sentinel_values=None):
+    """ Convert a readout matrix to a float np.ndarray in one vectorized operation.
+
+    Args:
+        data (list of lists or np.ndarray): A matrix of numbers or strings (height x width).
+        na_values (list of str): Strings that are read as NaN. None values are always read as NaN.
+        sentinel_values (dict): Values that are mapped to replacements after conversion, e.g. saturated reads
+                                {260000: np.nan} or {260000: np.inf}.
+
+    Returns:
+        np.ndarray of float (height x width)
+    """
+
+    original_data = data
+    try:
+        data = np.asarray(data, dtype=float)
+    except ValueError:
+        # Only in case of unparseable cells: map NA values, then convert.
+        data = np.array(data, dtype=object)
+        data[np.isin(data, na_values) | (data == None)] = np.nan
+        try:
+            data = data.astype(float)
+        except ValueError:
+            # NA values surrounded by whitespace.
+            data = np.char.strip(data.astype(str))
+            data[np.isin(data, na_values)] = "nan"
+            try:
+                data = data.astype(float)
+            except ValueError as e:
+                raise ValueError("Cannot convert readout data to float, and the value is not in na_values {}: {}"
+                                 "".format(na_values, e))
+
+    if sentinel_values:
+        # Compare all sentinels to the original values, such that replacements are not mapped again.
+        # Values and replacements may be given as strings, e.g. in config files: {"260000": "nan"}.
+        replacements = [(data == float(value), float(replacement)) for value, replacement in sentinel_values.items()]
+        if np.may_share_memory(data, original_data):
+            # Do not replace the sentinels in the caller's array.
+            data = data.copy()
+        for mask, replacement in replacements:
+            data[mask] = replacement
+
+    return data
 
 
 class Readout(plate_data.PlateData):
@@ -40,10 +95,10 @@ class Readout(plate_data.PlateData):
         return data
 
 
-    def __init__(self, data, **kwargs):
+    def __init__(self, data, na_values=NA_VALUES, sentinel_values=None, **kwargs):
 
-        # All readout data is transformed to numpy array data
-        data = {i: np.array([np.array([float(datum) for datum in row]) for row in j]) for i,j in data.items()}
+        # All readout data is transformed to float numpy array data, with NaN for na_values.
+        data = {i: to_float_array(j, na_values=na_values, sentinel_values=sentinel_values) for i,j in data.items()}
 
         # Run super __init__
         super().__init__(data=data, **kwargs)
@@ -55,18 +110,329 @@ class Readout(plate_data.PlateData):
         #self.data = np.array([np.array([float(read) if read else np.nan for read in column]) for column in data])
 
 
+    def add_data(self, data, tag=None):
+
+        with plate_data.DATA_LOCK:
+            super().add_data(data=data, tag=tag)
+            # Statistics cached for the overwritten data tags are recalculated, see `Plate.get_statistic`.
+            data_versions = dict(getattr(self, "data_versions", {}))
+            data_versions.update((data_tag, next(DATA_VERSIONS)) for data_tag in data)
+            self.data_versions = data_versions
+
+
+    def get_data_version(self, data_tag):
+        """ Get the version of the data tagged with `data_tag`, which changes whenever it is added with `add_data`.
+        """
+
+        return getattr(self, "data_versions", {}).get(data_tag)
+
+
 
-    def create_envision_csv(path, name, tag=None, type=None, **kwargs):
-        readout_dict_info, channel_wise_reads, channel_wise_info = readout_io.read_envision_csv(path, **kwargs)
+    def create_envision_csv(path, name, tag=None, type=None, na_values=NA_VALUES, sentinel_values=None, parse_cache=None,
+                        **kwargs):
+        readout_dict_info, channel_wise_reads, channel_wise_info = cached_parse(readout_io.read_envision_csv, path,
+                                                                                parse_cache=parse_cache, **kwargs)
         if len(channel_wise_reads) == 0:
             raise Exception("No signal data determined in file {path} with method read_envision_csv. Please check file."
                             " In case file is correct, the current parsing does not work and either `read_envision_csv`"
                             " needs generalization, or a new parser needs to be written.".format(path=path))
-        return Readout(name=name, data=channel_wise_reads, readout_dict_info=readout_dict_info, channel_wise_info=channel_wise_info, tag=tag, type=type)
+        return Readout(name=name, data=channel_wise_reads, readout_dict_info=readout_dict_info, channel_wise_info=channel_wise_info, tag=tag, type=type,
+                       na_values=na_values, sentinel_values=sentinel_values)
+
+    def create_insulin_csv(path, name, tag=None, type=None, na_values=NA_VALUES, sentinel_values=None, parse_cache=None,
+                       **kwargs):
+        readout_dict_info, channel_wise_reads, channel_wise_info = cached_parse(readout_io.read_insulin_csv, path,
+                                                                                parse_cache=parse_cache, **kwargs)
+        return Readout(name=name, data=channel_wise_reads, readout_dict_info=readout_dict_info, channel_wise_info=channel_wise_info, tag=tag, type=type,
+                       na_values=na_values, sentinel_values=sentinel_values)
+
+    def create_insulin_kinetic_csv(path, name, tag=None, type=None, na_values=NA_VALUES, sentinel_values=None,
+                                   parse_cache=None, **kwargs):
+        readout_dict_info, times, reads = cached_parse(readout_io.read_insulin_csv_kinetic, path,
+                                                       parse_cache=parse_cache, **kwargs)
+        return KineticReadout(name=name, times=times, kinetic_data=reads, readout_dict_info=readout_dict_info, tag=tag,
+                              type=type, na_values=na_values, sentinel_values=sentinel_values)
+
+
+
+
+
+class KineticReadout(Readout):
+
+    """ ``KineticReadout`` describes a time series of plate matrices, e.g. of a 24 h insulin assay.
+
+    The time series is stored as a single array. The readout of each time point is also available as data tag (the
+    time point), as a view into this array.
+
+    Attributes:
+        times (np.ndarray): The sorted time points (e.g. in minutes)
+        kinetic_data (np.ndarray of float): The readouts (n_times x height x width), in the order of `times`.
+    """
+
+    def __init__(self, times, kinetic_data, na_values=NA_VALUES, sentinel_values=None, **kwargs):
+
+        times = np.asarray(times)
+        order = np.argsort(times, kind="stable")
+        self.times = times[order]
+        self.kinetic_data = to_float_array(kinetic_data, na_values=na_values, sentinel_values=sentinel_values)[order]
+        if self.kinetic_data.ndim != 3 or len(self.kinetic_data) != len(self.times):
+            raise ValueError("Kinetic data of shape {} does not match {} time points."
+                             "".format(self.kinetic_data.shape, len(self.times)))
+
+        super().__init__(data={time: self.kinetic_data[i_time] for i_time, time in enumerate(self.times.tolist())},
+                         **kwargs)
+
+
+    def get_slope(self):
+        """ Get the least squares slope of the readout over time for all wells, ignoring NaN reads.
+
+        Returns:
+            np.ndarray of float (height x width)
+        """
+
+        is_read = ~np.isnan(self.kinetic_data)
+        times = np.where(is_read, self.times[:, None, None], np.nan)
+        times_centered = times - np.nanmean(times, axis=0)
+        reads_centered = self.kinetic_data - np.nanmean(self.kinetic_data, axis=0)
+        return np.nansum(times_centered * reads_centered, axis=0) / np.nansum(times_centered ** 2, axis=0)
+
+
+    def get_auc(self):
+        """ Get the area under the readout curve (trapezoidal rule) for all wells. Wells with NaN reads have NaN area.
+
+        Returns:
+            np.ndarray of float (height x width)
+        """
+
+        intervals = np.diff(self.times)[:, None, None]
+        return np.sum(intervals * (self.kinetic_data[1:] + self.kinetic_data[:-1]) / 2, axis=0)
+
+
+    def get_time_to_threshold(self, threshold):
+        """ Get the first time point at which the readout reaches `threshold`, for all wells.
+
+        Returns:
+            np.ndarray of float (height x width): NaN for wells that do not reach `threshold`.
+        """
+
+        is_reached = self.kinetic_data >= float(threshold)
+        return np.where(is_reached.any(axis=0), self.times[np.argmax(is_reached, axis=0)], np.nan)
+
+
+    def get_max_signal(self):
+        """ Get the maximum readout over time for all wells, ignoring NaN reads.
+
+        Returns:
+            np.ndarray of float (height x width)
+        """
+
+        return np.fmax.reduce(self.kinetic_data, axis=0)
+
+
+    def add_kinetic_features(self, threshold=None):
+        """ Add the kinetic features of all wells as data tags "slope", "auc", "max_signal" and, if `threshold` is
+        given, "time_to_threshold".
+        """
+
+        features = {"slope": self.get_slope(), "auc": self.get_auc(), "max_signal": self.get_max_signal()}
+        if threshold is not None:
+            features["time_to_threshold"] = self.get_time_to_threshold(threshold)
+        self.add_data(data=features, tag="kinetic_features")
+
+
+class ReadoutCache:
+
+    """ ``ReadoutCache`` holds the parsed ``Readout`` instances of ``LazyReadout`` instances.
+
+    If `max_size` is set, the least recently used readouts are evicted, and reparsed on next access. Data added to an
+    evicted readout (e.g. by preprocessing) is written to one .npy file per data tag in the cache directory, and
+    restored once the readout is reparsed. Hence, at most `max_size` readouts are held in memory, also after data was
+    added to all of them.
+
+    Attributes:
+        max_size (int): The maximum number of parsed readouts held. If None, parsed readouts are never evicted.
+        path (str): The directory for the added data of evicted readouts. If None, a temporary directory is created
+                    on first eviction, and removed with the cache.
+        readouts (collections.OrderedDict): The parsed ``Readout`` per ``LazyReadout``, least recently used first.
+        n_parsed (int): The number of parses performed (including reparses after eviction).
+    """
+
+    def __init__(self, max_size=None, path=None):
+        self.max_size = int(max_size) if max_size is not None else None
+        self.path = path
+        self.readouts = collections.OrderedDict()
+        self.n_parsed = 0
+        self.n_files = 0
+        self.temporary_directory = None
+        self.lock = threading.RLock()
+
+
+    def __getstate__(self):
+        # Parsed readouts are not serialized; they are reparsed on demand.
+        return {"max_size": self.max_size, "path": self.path}
+
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+    def get(self, lazy_readout):
+        """ Get the parsed ``Readout`` of `lazy_readout`, and parse it if it is not cached.
+        """
+
+        with self.lock:
+            if lazy_readout in self.readouts:
+                self.readouts.move_to_end(lazy_readout)
+                return self.readouts[lazy_readout]
+
+            LOG.debug("Parse readout {}.".format(lazy_readout.name))
+            parsed_readout = Readout.create(**lazy_readout.create_kwargs)
+            self.n_parsed += 1
+            lazy_readout.restore(parsed_readout)
+            self.readouts[lazy_readout] = parsed_readout
+            if self.max_size is not None:
+                while len(self.readouts) > self.max_size:
+                    evicted_lazy_readout, evicted_readout = self.readouts.popitem(last=False)
+                    evicted_lazy_readout.write_added_data(evicted_readout)
+            return parsed_readout
+
+
+    def get_file(self):
+        """ Get a new file path in the cache directory, for one added readout data tag.
+        """
+
+        with self.lock:
+            if self.path is None and self.temporary_directory is None:
+                self.temporary_directory = tempfile.TemporaryDirectory(prefix="hts_readout_cache_")
+            path = self.path if self.path is not None else self.temporary_directory.name
+            if not os.path.exists(path):
+                LOG.debug("Create dir: {}".format(path))
+                os.makedirs(path, exist_ok=True)
+            self.n_files += 1
+            return os.path.join(path, "added_{}_{}.npy".format(os.getpid(), self.n_files))
+
+
+class LazyReadout(Readout):
+
+    """ ``LazyReadout`` is a ``Readout`` that parses its files on first access of its data.
+
+    The parsed ``Readout`` is held in a (possibly bounded) ``ReadoutCache``, that may be shared by many plates.
+    All attributes that are not set on the ``LazyReadout`` itself (e.g. data, height, width) are retrieved from the
+    parsed ``Readout``. Data added to (or removed from) the ``LazyReadout`` is recorded, such that it is restored
+    whenever the readout is reparsed after eviction.
+
+    Attributes:
+        name (str): Name of the readout.
+        create_kwargs (dict): The keyword arguments for `Readout.create`, e.g. formats, paths, configs, tags.
+        cache (ReadoutCache): The cache for the parsed ``Readout``.
+        added_data_tags (dict): The tag of each added data tag, in order of addition.
+        removed_data_tags (set of str): The parsed data tags that were removed.
+        added_data (dict): For each added data tag of an evicted readout, the path to its .npy file in the cache
+                           directory, or the array itself (e.g. for object arrays, or after unpickling).
+    """
+
+    def __init__(self, cache=None, **kwargs):
+
+        # No data is parsed: super().__init__ is not called.
+        names = kwargs.get("names")
+        self.name = names[0] if names and names[0] else os.path.basename(kwargs["paths"][0])
+        self.create_kwargs = kwargs
+        self.cache = cache if cache is not None else ReadoutCache()
+        self.added_data_tags = {}
+        self.removed_data_tags = set()
+        self.added_data = {}
+
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set on the LazyReadout itself.
+        if name.startswith("__") or name in ["create_kwargs", "cache", "added_data_tags", "removed_data_tags",
+                                             "added_data"]:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+    def __getstate__(self):
+        # The added data is serialized with the LazyReadout, as the files in the cache directory are not.
+        state = dict(self.__dict__)
+        state["added_data"] = {data_tag: self.get_data(data_tag) for data_tag in self.added_data_tags}
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+    @property
+    def is_loaded(self):
+        return self in self.cache.readouts
+
+
+    def load(self):
+        """ Get the parsed ``Readout``, and parse it if needed.
+        """
+
+        return self.cache.get(self)
+
+
+    def restore(self, parsed_readout):
+        """ Remove the removed data tags from, and add the added data to `parsed_readout`, on (re)parsing.
+        """
+
+        if self.removed_data_tags:
+            parsed_readout.remove_data(sorted(self.removed_data_tags))
+        for data_tag, tag in self.added_data_tags.items():
+            added_data = self.added_data[data_tag]
+            if isinstance(added_data, str):
+                added_data = np.load(added_data, allow_pickle=False)
+            parsed_readout.add_data(data={data_tag: added_data}, tag=tag)
+
+
+    def write_added_data(self, parsed_readout):
+        """ Write the added data of `parsed_readout` to the cache directory, on eviction.
+
+        Data written on an earlier eviction is not written again. Arrays that cannot be stored without pickling (e.g.
+        object arrays) are kept in memory.
+        """
+
+        for data_tag in self.added_data_tags:
+            if isinstance(self.added_data.get(data_tag), str):
+                continue
+            data = parsed_readout.get_data(data_tag)
+            if data.dtype.hasobject:
+                self.added_data[data_tag] = data
+                continue
+            file = self.cache.get_file()
+            np.save(file, data, allow_pickle=False)
+            self.added_data[data_tag] = file
+
+
+    def discard_added_data(self, data_tags):
+        """ Forget the stored added data of `data_tags`, e.g. as it is overwritten.
+        """
+
+        for data_tag in data_tags:
+            added_data = self.added_data.pop(data_tag, None)
+            if isinstance(added_data, str) and os.path.exists(added_data):
+                os.remove(added_data)
+
+
+    def add_data(self, data, tag=None):
 
-    def create_insulin_csv(path, name, tag=None, type=None, **kwargs):
-        readout_dict_info, channel_wise_reads, channel_wise_info = readout_io.read_insulin_csv(path, **kwargs)
-        return Readout(name=name, data=channel_wise_reads, readout_dict_info=readout_dict_info, channel_wise_info=channel_wise_info, tag=tag, type=type)
+        with self.cache.lock:
+            self.load().add_data(data=data, tag=tag)
+            self.discard_added_data(data)
+            for data_tag in data:
+                self.added_data_tags.pop(data_tag, None)
+                self.added_data_tags[data_tag] = tag
 
 
+    def remove_data(self, data_tags):
 
+        with self.cache.lock:
+            self.load().remove_data(data_tags)
+            self.discard_added_data(data_tags)
+            for data_tag in data_tags:
+                if data_tag in self.added_data_tags:
+                    del self.added_data_tags[data_tag]
+                else:
+                    self.removed_data_tags.add(data_tag)
@@ -8,6 +8,7 @@
 
 import csv
 import logging
+import numpy as np
 import re
 
 LOG = logging.getLogger(__name__)
@@ -15,7 +16,7 @@ LOG = logging.getLogger(__name__)
 ################################## READ SCREEN DATA  #########################
 
 
-def read_envision_csv(file, delimiter=","):
+def read_envision_csv(file, delimiter=",", fast=False):
     """Read screen data file in [] format.
 
     The envision .csv file structure is not described publicly.
@@ -205,6 +206,7 @@ def read_envision_csv(file, delimiter=","):
     Args:
         filename (str): Path to the file with  data in the envision
             file format.
+        fast (bool): If True, use `read_envision_csv_fast`.
 
 
     Returns:
@@ -214,6 +216,9 @@ def read_envision_csv(file, delimiter=","):
 
     """
 
+    if fast in [True, "true", "True", "TRUE"]:
+        return read_envision_csv_fast(file, delimiter=delimiter)
+
     pat_info = ['Plate', 'Repeat', 'Barcode', 'Measured height']
     pat_background = ['Plate', 'Label', 'Result']
 
@@ -319,6 +324,117 @@ def read_envision_csv(file, delimiter=","):
 
 
 
+def read_envision_csv_fast(file, delimiter=","):
+    """Read screen data file in the envision format in a single pass, with the parser states of `read_envision_csv`.
+
+    Only the header lines are parsed as csv; data lines are collected as raw text and each read out table is
+    decoded to a float array in one numpy call. Tables with text or empty cells are decoded cell by cell as in
+    `read_envision_csv`. Quoted fields in data lines are not supported.
+
+    Args:
+        file (str): Path to the file with data in the envision file format.
+        delimiter (str): The field delimiter.
+
+    Returns:
+        plate_info (dict of str): Information per plate
+        channel_wise_reads (dict of np.ndarray): Read out tables (height x width)
+        channel_wise_info (dict of dict of str): Information per read out table
+    """
+
+    pat_info = delimiter.join(['Plate', 'Repeat', 'Barcode', 'Measured height'])
+    pat_background = delimiter.join(['Plate', 'Label', 'Result'])
+    min_delimiters = 24
+
+    LOG.info("Now parsing file (fast): {}".format(file))
+
+    def parse_line(line):
+        return next(csv.reader([line], delimiter=delimiter))
+
+    def is_header(line, pattern):
+        return line.startswith(pattern) and (len(line) == len(pattern) or line[len(pattern)] == delimiter)
+
+    def is_data(line):
+        return line.count(delimiter) >= min_delimiters and not line.startswith(delimiter)
+
+    state = 0
+    data_plate = None
+    data_plate_count = 0
+    channel_wise_reads = {}
+    channel_wise_info = {}
+    plate_info = {}
+    with open(file, encoding="ISO-8859-1") as fh:
+        lines = fh.read().splitlines()
+
+    for line in lines:
+        if delimiter not in line:
+            continue
+        if 0 == state:
+            if is_header(line, pat_info):
+                plate_info_tags = parse_line(line)
+                state = 0.2
+        elif 0.2 == state:
+            plate_info = {i: j for i, j in zip(plate_info_tags, parse_line(line)) if i != ""}
+            state = 2
+        elif 2 == state:
+            if is_header(line, pat_background):
+                data_plate_count += 1
+                data_background_info_tags = parse_line(line)
+                state = 2.2
+        elif 2.2 == state:
+            data_background_info = {i: j for i, j in zip(data_background_info_tags, parse_line(line)) if i != ""}
+            state = 2.3
+        elif 2.3 == state:
+            if is_data(line):
+                data_plate = [line]
+                state = 2.4
+        elif 2.4 == state:
+            if is_data(line):
+                data_plate.append(line)
+            else:
+                channel_wise_reads[str(data_plate_count)] = _decode_envision_block(data_plate, delimiter)
+                channel_wise_info[str(data_plate_count)] = data_background_info
+                data_plate = None
+                state = 2
+
+    if data_plate:
+        channel_wise_reads[str(data_plate_count)] = _decode_envision_block(data_plate, delimiter)
+        channel_wise_info[str(data_plate_count)] = data_background_info
+
+    return plate_info, channel_wise_reads, channel_wise_info
+
+
+def _decode_envision_block(lines, delimiter):
+    """Decode the raw data lines of one envision read out table.
+
+    Numeric tables are returned as float array. Otherwise, as in `read_envision_csv`, alphabetic cells and one
+    trailing empty cell per line are dropped, empty cells are replaced by "0", and the cells are returned as lists of
+    str.
+    """
+
+    stripped_lines = [line[:-len(delimiter)] if line.endswith(delimiter) else line for line in lines]
+    block = "\n".join(stripped_lines)
+    # Only rectangular tables are decoded at once; ragged lines are reported by the line-wise decoding below.
+    is_rectangular = len(set(line.count(delimiter) for line in stripped_lines)) == 1
+    if is_rectangular and not re.search("[A-Za-z\"]", block) and delimiter * 2 not in block and \
+            "\n" + delimiter not in block:
+        try:
+            values = np.array(block.replace("\n", delimiter).split(delimiter), dtype=float)
+        except ValueError:
+            values = None
+        if values is not None:
+            return values.reshape(len(lines), -1)
+
+    reads = []
+    for line in lines:
+        read = [i for i in line.split(delimiter) if not i.isalpha()]
+        if read[-1] == "":
+            read.pop()
+        reads.append(["0" if i == "" else i for i in read])
+    if len(set(len(read) for read in reads)) != 1:
+        LOG.error(" The lines in the plate differ in length: {}".format(sorted(set(len(read) for read in reads))))
+    return reads
+
+
 def read_insulin_csv(file):
     """Read screen data file in [] format. Afterwards, map to plate layout.
 
@@ -348,13 +464,36 @@ def read_insulin_csv(file):
 
 
     Returns:
-        plate_info (dict of ?): Information per plate
-        channel_wise_reads (dict of list of lists): Read out tales
+        plate_info (list of str): Plate information
+        channel_wise_reads (dict of np.ndarray): Read out tables per time point in minutes (views into the reads of
+                                                 `read_insulin_csv_kinetic`)
         channel_wise_info (dict of ?): Information per read out table
 
     """
 
+    plate_info, times, reads = read_insulin_csv_kinetic(file)
+    # Later reads of the same time point replace earlier reads.
+    plate_reads = {time: read for time, read in zip(times.tolist(), reads)}
+    return plate_info, plate_reads, {}
+
+
+def read_insulin_csv_kinetic(file):
+    """Read a kinetic screen data file in the insulin (BMG) format (see `read_insulin_csv`) as a single time series.
+
+    All data lines are collected first, and converted and placed in one step: the wells are mapped to their plate
+    positions through the "Well Row" and "Well Col" header lines, and the reads are sorted by time.
+
+    Args:
+        file (str): Path to the file with data in the insulin file format.
+
+    Returns:
+        plate_info (list of str): Plate information
+        times (np.ndarray of int): The sorted time points in minutes
+        reads (np.ndarray): The reads (n_times x height x width), of dtype float, or of dtype str if not all reads are
+                            numbers (e.g. empty cells). Empty wells are "" or NaN.
+    """
 
+    pattern_time = re.compile(r"\s*(\d+) h\s*(?:(\d+) min)?")
 
     # Our possible parser states:
     #
@@ -364,71 +503,76 @@ def read_insulin_csv(file):
     # 2: searching for well row definition & store.
     # 2.1: searching for well column definition & store.
     # 3: searching for data header & store.
-    # 4: searching for data column & store
+    # 4: collecting data lines
 
     state = 1
-    data_plate_count = 0
-    plate_reads = {}
-    hour_re = "(\d+) h"
-    min_re = "(\d+) min"
+    plate_info = []
+    well_row = None
+    well_column = None
+    times = []
+    data_lines = []
 
+    LOG.info("Now parsing file: {}".format(file))
     with open(file) as csvfile:
-        #dialect = csv.Sniffer().sniff(csvfile.read(1024))
-        #sample_text = ''.join(csvfile.readline() for x in range(3))
-        #dialect = csv.Sniffer().sniff(sample_text)
-        #reader = csv.reader(csvfile, dialect)
-        #csvfile.seek(0)
-        #import pdb; pdb.set_trace()
-        reader = csv.reader(csvfile, delimiter = ",")
-        for i, line in enumerate(reader):
+        reader = csv.reader(csvfile, delimiter=",")
+        for line in reader:
             if len(line) < 1:
                 continue
-            LOG.debug("Line %s: %s", i, line)
             if 1 == state:
                 if line[0].startswith("User"):
-                    LOG.debug(" * (1->1.1) Found plate info I")
                     plate_info = line
                     state = 1.1
             elif 1.1 == state:
                 if line[0].startswith("Test"):
-                    LOG.debug(" * (1.1->1.2) Found plate info II")
                     plate_info += line
                     state = 1.2
             elif 1.2 == state:
-                LOG.debug(" * (1.2->2) Save plate info III")
                 plate_info += line
                 state = 2
             elif 2 == state:
                 if line[0].startswith("Well Row"):
-                    LOG.debug(" * (2->2.1) Found well row info")
-                    well_row = [i for i in line[1:] if i != '']
+                    well_row = line[2:]
                     state = 2.1
             elif 2.1 == state:
                 if line[0].startswith("Well Col"):
-                    LOG.debug(" * (2.1->3) Found well column info")
-                    well_column = [i for i in line[1:] if i != '']
+                    well_column = line[2:]
                     state = 3
             elif 3 == state:
                 if line[0].startswith("Content"):
-                    LOG.debug(" * (3->4) Found content row (currently not storing)")
                     state = 4
-                    #import pdb; pdb.set_trace()
             elif 4 == state:
-                hour = re.search(hour_re, line[1])
-                minute = re.search(min_re, line[1])
-                if hour:
-                    LOG.debug(" * (4->4) Found data row. Storing.")
-                    hour = int(hour.group(1))
-                    if minute:
-                        minute = int(minute.group(1))
-                    else:
-                        minute = 0
-                    plate_reads[60*hour + minute] = line[2:]
-                    state = 4
-    # Transform well_row and well_column elements
-    # Give back tables instead of lists
-    # For now, assume that elements are ordered: 1st row, 2nd row, 3rd row, and so on...
-    width = well_row.count("A")
-    plate_reads2 = {i: [j[i:i+width] for i in range(0, len(j), width)]  for i,j in plate_reads.items()}
-    return plate_info, plate_reads2, {}
+                if len(line) > 1:
+                    time = pattern_time.match(line[1])
+                    if time:
+                        times.append(60 * int(time.group(1)) + int(time.group(2) or 0))
+                        data_lines.append(line[2:])
+
+    if well_row is None or well_column is None:
+        raise Exception("No well row and well column definition found in file {}.".format(file))
+
+    # Wells without a row or column label (e.g. trailing empty cells) are ignored.
+    n_well = min(len(well_row), len(well_column))
+    well_row, well_column = np.array(well_row[:n_well]), np.array(well_column[:n_well])
+    is_well = (well_row != "") & (well_column != "")
+    row_labels, rows = np.unique(well_row[is_well], return_inverse=True)
+    # Row labels are A, ..., Z, AA, AB, ...
+    row_indices = np.array([sum(26 ** i * (ord(letter) - ord("A") + 1) for i, letter in enumerate(label.upper()[::-1]))
+                            for label in row_labels], dtype=int) - 1
+    rows = row_indices[rows]
+    columns = well_column[is_well].astype(int) - 1
+    height = rows.max() + 1 if len(rows) > 0 else 0
+    width = columns.max() + 1 if len(columns) > 0 else 0
+
+    times = np.array(times, dtype=int)
+    order = np.argsort(times, kind="stable")
+
+    values = np.array([line[:n_well] + [""] * (n_well - len(line)) for line in data_lines],
+                      dtype=str).reshape(len(data_lines), n_well)[:, is_well]
+    try:
+        values = values.astype(float)
+        reads = np.full((len(times), height, width), np.nan)
+    except ValueError:
+        reads = np.full((len(times), height, width), "", dtype=values.dtype)
+    reads[:, rows, columns] = values
+    return plate_info, times[order], reads[order]
 
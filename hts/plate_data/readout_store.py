@@ -0,0 +1,117 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: A memory-mapped on-disk store for the readouts of many plates.
+
+    A store is a directory with one .npy array file per readout data tag (n_plates x height x width), and a small
+    json index of the plate names, data tags and dimensions. Opened stores return views into the memory-mapped
+    files, such that only the accessed pages are read from disk.
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import json
+import logging
+import numpy as np
+import os
+
+LOG = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+FORMAT_VERSION = 1
+
+
+def write(path, readouts, plate_names):
+    """ Write the readouts of several plates to a store.
+
+    Args:
+        path (str): Path to the store directory. Created if it does not exist.
+        readouts (list of ``Readout``): The readouts, one per plate. Readouts may have different data tags.
+        plate_names (list of str): The plate names, in the order of `readouts`.
+    """
+
+    if len(readouts) != len(plate_names):
+        raise ValueError("The number of readouts {} differs from the number of plate names {}."
+                         "".format(len(readouts), len(plate_names)))
+
+    if not os.path.exists(path):
+        LOG.debug("Create dir: {}".format(path))
+        os.makedirs(path)
+
+    height, width = readouts[0].height, readouts[0].width
+
+    # The data tags in order of first occurence, with the plates that hold them.
+    plates_per_data_tag = {}
+    for i_plate, plate_readout in enumerate(readouts):
+        if (plate_readout.height, plate_readout.width) != (height, width):
+            raise ValueError("Readout of plate {} has shape {}, not {}.".format(plate_names[i_plate],
+                             (plate_readout.height, plate_readout.width), (height, width)))
+        for data_tag in plate_readout.data:
+            plates_per_data_tag.setdefault(data_tag, []).append(i_plate)
+
+    index = {"format_version": FORMAT_VERSION, "height": height, "width": width, "plate_names": list(plate_names),
+             "data_tags": []}
+    for i_data_tag, (data_tag, plate_indices) in enumerate(plates_per_data_tag.items()):
+        file = "readout_{}.npy".format(i_data_tag)
+        dtype = np.result_type(*[readouts[i_plate].get_data(data_tag) for i_plate in plate_indices])
+        stack = np.lib.format.open_memmap(os.path.join(path, file), mode="w+", dtype=dtype,
+                                          shape=(len(plate_indices), height, width))
+        for i_stack, i_plate in enumerate(plate_indices):
+            stack[i_stack] = readouts[i_plate].get_data(data_tag)
+        stack.flush()
+        del stack
+        index["data_tags"].append({"data_tag": data_tag, "file": file, "plates": plate_indices})
+
+    with open(os.path.join(path, INDEX_FILE), "w") as fh:
+        json.dump(index, fh)
+
+
+class ReadoutStore:
+
+    """ ``ReadoutStore`` gives memory-mapped access to a store written with `readout_store.write`.
+
+    Attributes:
+        path (str): Path to the store directory.
+        height (int): Height of the plates
+        width (int): Width of the plates
+        plate_names (list of str): The plate names.
+        stacks (dict of np.memmap): The memory-mapped readouts (n_plates_with_data_tag x height x width) per data tag.
+        positions (dict of dict of int): Per data tag, the position in the stack for the index (in plate_names) of
+                                         each plate that holds the data tag.
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+
+        with open(os.path.join(path, INDEX_FILE)) as fh:
+            index = json.load(fh)
+
+        if index["format_version"] != FORMAT_VERSION:
+            raise Exception("Readout store {} has format version {}, but only version {} can be read."
+                            "".format(path, index["format_version"], FORMAT_VERSION))
+
+        self.path = path
+        self.height = index["height"]
+        self.width = index["width"]
+        self.plate_names = index["plate_names"]
+        self.stacks = {}
+        self.positions = {}
+        for data_tag_index in index["data_tags"]:
+            data_tag = data_tag_index["data_tag"]
+            self.stacks[data_tag] = np.load(os.path.join(path, data_tag_index["file"]), mmap_mode=mmap_mode)
+            self.positions[data_tag] = {i_plate: i_stack for i_stack, i_plate in enumerate(data_tag_index["plates"])}
+
+
+    def get_data(self, plate_name):
+        """ Get all readouts of the plate `plate_name`, as views into the memory-mapped stacks.
+
+        Returns:
+            dict of np.ndarray (height x width)
+        """
+
+        try:
+            i_plate = self.plate_names.index(plate_name)
+        except ValueError:
+            raise ValueError("Plate {} is not in the readout store {}.".format(plate_name, self.path))
+
+        return {data_tag: self.stacks[data_tag][positions[i_plate]] for data_tag, positions in self.positions.items()
+                if i_plate in positions}
@@ -28,5 +28,5 @@ def test_read_manual_data_issue(path):
     test_data_issue = data_issue.DataIssue.create(formats=["csv"], paths=[os.path.join(path, "Manual", TEST_DATA_ISSUE)], remove_empty_row=False)
     assert test_data_issue.height == 16
     assert test_data_issue.width == 24
-    assert test_data_issue.data[TEST_DATA_ISSUE] == TEST_DATA_ISSUE_DATA
+    assert test_data_issue.data[TEST_DATA_ISSUE].tolist() == TEST_DATA_ISSUE_DATA
 
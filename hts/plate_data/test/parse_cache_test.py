@@ -0,0 +1,105 @@
+import datetime
+import os
+import logging
+import numpy as np
+import pytest
+
+from hts.plate_data import parse_cache, plate_data_io, readout
+from hts.plate_data.plate_data import PlateData
+
+logging.basicConfig(level=logging.INFO)
+
+
+@pytest.fixture
+def path_csv(tmpdir):
+    """Return the path to a small plate csv file.
+    """
+    path = os.path.join(str(tmpdir), "plate.csv")
+    with open(path, "w") as fh:
+        fh.write("1,2,3\n4,N/A,6\n")
+    return path
+
+
+@pytest.mark.no_external_software_required
+def test_parse_cache(tmpdir, path_csv):
+    cache = parse_cache.ParseCache(os.path.join(str(tmpdir), "cache"))
+    data = cache.parse(plate_data_io.read_csv, path_csv)
+    assert isinstance(data, np.ndarray) and data.dtype.kind == "U"
+    assert data.tolist() == plate_data_io.read_csv(path_csv)
+    assert (cache.n_hits, cache.n_misses) == (0, 1)
+    assert cache.parse(plate_data_io.read_csv, path_csv).tolist() == data.tolist()
+    assert (cache.n_hits, cache.n_misses) == (1, 1)
+
+    # Other parser kwargs, or changed file content are parsed again.
+    cache.parse(plate_data_io.read_csv, path_csv, remove_empty_row=False)
+    assert (cache.n_hits, cache.n_misses) == (1, 2)
+    with open(path_csv, "w") as fh:
+        fh.write("1,2,3\n4,5,6\n")
+    assert cache.parse(plate_data_io.read_csv, path_csv).tolist() == [["1", "2", "3"], ["4", "5", "6"]]
+    assert (cache.n_hits, cache.n_misses) == (1, 3)
+
+    # Cached and uncached creation give the same data.
+    test_readout = readout.Readout.create_csv(path=path_csv, name="test", parse_cache=cache)
+    assert cache.n_hits == 2
+    assert test_readout.get_data(None).tolist() == [[1, 2, 3], [4, 5, 6]]
+    test_plate_data = PlateData.create_csv(path=path_csv, name="test", parse_cache=cache.path)
+    assert test_plate_data.get_data(None).tolist() == PlateData.create_csv(path=path_csv, name="test").get_data(None).tolist()
+
+
+@pytest.mark.no_external_software_required
+def test_parse_cache_eviction(tmpdir):
+    cache = parse_cache.ParseCache(os.path.join(str(tmpdir), "cache"), max_size=0)
+    paths = []
+    for i in range(3):
+        paths.append(os.path.join(str(tmpdir), "plate_{}.csv".format(i)))
+        np.savetxt(paths[-1], np.full((2, 3), i), fmt="%d", delimiter=",")
+        cache.parse(plate_data_io.read_csv, paths[-1])
+    assert len(os.listdir(cache.path)) == 0
+
+    cache.max_size = None
+    for path in paths:
+        cache.parse(plate_data_io.read_csv, path)
+    entries = sorted(os.listdir(cache.path))
+    for i, entry in enumerate(entries):
+        os.utime(os.path.join(cache.path, entry), (i, i))
+    cache.max_size = sum(os.path.getsize(os.path.join(cache.path, i)) for i in entries[1:])
+    cache.evict()
+    assert sorted(os.listdir(cache.path)) == sorted(entries[1:])
+
+
+@pytest.mark.no_external_software_required
+def test_parse_cache_without_pickle(tmpdir, path_csv):
+    result = ({"a": "b", 1: None}, {"1": [["1", "2"], ["3", ""]], "2": [[1.0, "x"], [None, float("nan")]]}, [2.5])
+    cache = parse_cache.ParseCache(os.path.join(str(tmpdir), "cache"))
+    cache.parse(lambda file: result, path_csv)
+    cached = cache.parse(lambda file: result, path_csv)
+    assert cache.n_hits == 1
+    assert cached[0] == {"a": "b", 1: None} and cached[2] == [2.5]
+    assert cached[1]["1"].tolist() == [["1", "2"], ["3", ""]]
+    assert cached[1]["2"].dtype == object and cached[1]["2"].tolist()[0] == [1.0, "x"]
+    # Entries are read without unpickling.
+    entry, = os.listdir(cache.path)
+    with np.load(os.path.join(cache.path, entry), allow_pickle=False) as members:
+        assert sorted(members.files) == ["0", parse_cache.STRUCTURE_MEMBER]
+
+    # Other results are only cached, as pickles, if pickling is allowed.
+    def parser(file):
+        return {"date": datetime.date(2016, 1, 1)}
+
+    for allow_pickle, n_entries in [(False, 1), (True, 2)]:
+        cache = parse_cache.ParseCache(cache.path, allow_pickle=allow_pickle)
+        for _ in range(2):
+            assert cache.parse(parser, path_csv) == parser(path_csv)
+        assert (cache.n_hits, len(os.listdir(cache.path))) == (int(allow_pickle), n_entries)
+    # Pickled entries are ignored by default.
+    cache = parse_cache.ParseCache(cache.path)
+    cache.parse(parser, path_csv)
+    assert cache.n_hits == 0
+
+
+@pytest.mark.no_external_software_required
+def test_compact():
+    compacted = parse_cache.compact(({"a": "b"}, {"1": [["1", "2"], ["3", ""]], "2": [[1.0, "x"], [None, 2.0]]}))
+    assert compacted[0] == {"a": "b"}
+    assert compacted[1]["1"].dtype.kind == "U"
+    assert compacted[1]["2"].dtype == object and compacted[1]["2"][0, 0] == 1.0
@@ -0,0 +1,144 @@
+import concurrent.futures
+import os
+import logging
+import threading
+
+import numpy as np
+import pytest
+
+from hts.plate_data import plate_data, plate_data_io
+
+logging.basicConfig(level=logging.INFO)
+
+TEST_DATA_FLOAT = [[1.5, 2.5, 3.5], [4.5, 5.5, 6.5]]
+TEST_DATA_BOOL = [[True, False, True], [False, False, True]]
+TEST_DATA_INT = [[1, 2, 3], [4, 5, 6]]
+TEST_DATA_STR = [["s_1", "neg", "pos"], ["s_2", None, "pos"]]
+TEST_DATA = {"float": TEST_DATA_FLOAT, "bool": TEST_DATA_BOOL, "int": TEST_DATA_INT, "str": TEST_DATA_STR}
+
+notfixed = pytest.mark.notfixed
+
+
+@pytest.mark.no_external_software_required
+def test_array_storage():
+    test_plate_data = plate_data.PlateData(data=TEST_DATA)
+    assert test_plate_data.height == 2
+    assert test_plate_data.width == 3
+    assert all(type(i) == np.ndarray for i in test_plate_data.data.values())
+    assert test_plate_data.get_data("float").dtype == np.float64
+    assert test_plate_data.get_data("bool").dtype == bool
+    assert test_plate_data.get_data("int").dtype.kind == "i"
+    assert test_plate_data.get_data("str").dtype == object
+    assert test_plate_data.get_data("str").tolist() == TEST_DATA_STR
+
+
+@pytest.mark.no_external_software_required
+def test_add_data():
+    test_plate_data = plate_data.PlateData(data={"float": TEST_DATA_FLOAT})
+    test_plate_data.add_data(data={"int": TEST_DATA_INT}, tag="int")
+    assert test_plate_data.get_data("int").dtype.kind == "i"
+    assert test_plate_data.tags == ["int"]
+    with pytest.raises(ValueError):
+        test_plate_data.add_data(data={"wrong_shape": [[1, 2], [3, 4]]}, tag="wrong_shape")
+
+
+@pytest.mark.no_external_software_required
+def test_get_wells_and_values():
+    test_plate_data = plate_data.PlateData(data=TEST_DATA)
+    wells = test_plate_data.get_wells(data_tag="str", condition=lambda x: x == "pos")
+    assert wells == [(0, 2), (1, 2)]
+    assert test_plate_data.get_values(wells=wells, data_tag="float") == [3.5, 6.5]
+    assert test_plate_data.get_values(wells=[], data_tag="float") == []
+
+
+@pytest.mark.no_external_software_required
+def test_write_csv(tmpdir):
+    test_plate_data = plate_data.PlateData(data=TEST_DATA)
+    path = os.path.join(str(tmpdir), "plate_data.csv")
+    test_plate_data.write(format="csv", path=path, tag="str")
+    with open(path) as fh:
+        assert fh.read() == "s_1,neg,pos\ns_2,None,pos\n"
+
+
+@pytest.mark.no_external_software_required
+def test_get_mask_predicates():
+    test_plate_data = plate_data.PlateData(data=TEST_DATA)
+    assert test_plate_data.get_mask("str", {"eq": "pos"}).tolist() == [[False, False, True], [False, False, True]]
+    assert test_plate_data.get_mask("str", {"in": ["neg", "s_1"]}).tolist() == [[True, True, False], [False, False, False]]
+    assert test_plate_data.get_mask("str", {"in": "neg"}).tolist() == [[False, True, False], [False, False, False]]
+    assert test_plate_data.get_mask("float", {"range": (2, 5)}).tolist() == [[False, True, True], [True, False, False]]
+    assert test_plate_data.get_mask("float", {"gt": 2, "lt": 6}).tolist() == [[False, True, True], [True, True, False]]
+    assert test_plate_data.get_mask("float").all()
+    # Methods are still supported as conditions.
+    assert (test_plate_data.get_mask("str", lambda x: x == "pos") == test_plate_data.get_mask("str", {"eq": "pos"})).all()
+    with pytest.raises(ValueError):
+        test_plate_data.get_mask("str", {"unknown_predicate": "pos"})
+
+
+@pytest.mark.no_external_software_required
+def test_get_wells_as_array_and_values_by_mask():
+    test_plate_data = plate_data.PlateData(data=TEST_DATA)
+    wells = test_plate_data.get_wells(data_tag="str", condition={"eq": "pos"}, as_array=True)
+    assert wells.tolist() == [[0, 2], [1, 2]]
+    mask = test_plate_data.get_mask("bool", {"eq": True})
+    assert test_plate_data.get_values(mask=mask, data_tag="int") == [1, 3, 6]
+
+
+@pytest.mark.no_external_software_required
+def test_create_excel_multiple_plates_per_file_opens_workbook_once(tmpdir, monkeypatch):
+    class Sheet:
+        def __init__(self, name, value):
+            self.name = name
+            self.nrows = 2
+            self.value = value
+
+        def row_values(self, i):
+            return [self.value] * 3
+
+    class Book:
+        def __init__(self):
+            self.sheets = {"plate_{}".format(i): Sheet("plate_{}".format(i), float(i)) for i in range(3)}
+
+        def sheet_by_name(self, name):
+            return self.sheets[name]
+
+    opened = []
+    monkeypatch.setattr(plate_data_io.xlrd, "open_workbook", lambda path: opened.append(path) or Book())
+    path = str(tmpdir.join("plates.xls"))
+    with open(path, "w") as fh:
+        fh.write("workbook")
+
+    workbook_cache = plate_data_io.WorkbookCache()
+    for i in range(3):
+        test_plate_data = plate_data.PlateData.create_excel_multiple_plates_per_file(
+            path="plate_{}".format(i), name="p{}".format(i), file=path, workbook_cache=workbook_cache)
+        assert test_plate_data.get_data("plate_{}".format(i)).tolist() == [[float(i)] * 3] * 2
+    assert opened == [path]
+
+    # Once closed, workbooks are opened on each read, and not held.
+    workbook_cache.close()
+    for _ in range(2):
+        plate_data.PlateData.create_excel_multiple_plates_per_file(path="plate_0", name="p0", file=path,
+                                                                   workbook_cache=workbook_cache)
+    assert opened == [path] * 3
+    assert len(workbook_cache.workbooks) == 0
+
+
+@pytest.mark.no_external_software_required
+def test_workbook_cache_opens_different_workbooks_concurrently(tmpdir, monkeypatch):
+    paths = [str(tmpdir.join("plates_{}.xls".format(i))) for i in range(2)]
+    for path in paths:
+        with open(path, "w") as fh:
+            fh.write("workbook")
+    # Each workbook is only opened once both are being opened, which requires a lock per path.
+    barrier = threading.Barrier(2, timeout=10)
+
+    def open_workbook(path):
+        barrier.wait()
+        return path
+
+    monkeypatch.setattr(plate_data_io.xlrd, "open_workbook", open_workbook)
+
+    workbook_cache = plate_data_io.WorkbookCache()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        assert list(pool.map(workbook_cache.open, paths)) == paths
@@ -1,4 +1,5 @@
 import os
+import numpy as np
 import pytest
 
 from hts.plate_data import plate_layout
@@ -27,7 +28,7 @@ def test_read_plate_layout_siRNA(path):
     assert test_plate_layout.height == 16
     assert test_plate_layout.width == 24
     assert test_plate_layout.name == "plate_layout_siRNA_1.csv"
-    assert test_plate_layout.data["layout"] == TEST_LAYOUT_siRNA_LIST
+    assert test_plate_layout.data["layout"].tolist() == TEST_LAYOUT_siRNA_LIST
 
 
 @pytest.mark.no_external_software_required
@@ -41,4 +42,63 @@ def test_read_plate_layout_insulin(path):
 def test_read_read_plate_layout_dpia(path):
     test_plate_layout = plate_layout.PlateLayout.create(formats=["csv"], paths=[os.path.join(path, TEST_LAYOUT_dpia)])
     assert test_plate_layout.height == 16
-    assert test_plate_layout.width == 24
\ No newline at end of file
+    assert test_plate_layout.width == 24
+
+@pytest.mark.no_external_software_required
+def test_plate_layout_index():
+    test_plate_layout = plate_layout.PlateLayout(layout=[["neg_1", "s_1", "pos"], ["neg_2", "s_1", "POS"]])
+    assert test_plate_layout.get_well_indices("pos").tolist() == [2, 5]
+    assert test_plate_layout.get_well_indices(["neg_2", "neg_1"]).tolist() == [0, 3]
+    assert test_plate_layout.get_well_indices("neg", data_tag="layout_general_type").tolist() == [0, 3]
+    assert test_plate_layout.get_well_indices("unknown").tolist() == []
+    assert test_plate_layout.get_mask("layout_general_type", {"in": ["s", "pos"]}).tolist() == \
+           [[False, True, True], [False, True, True]]
+    assert (test_plate_layout.get_mask("layout", {"eq": "s_1"}) ==
+            test_plate_layout.get_mask("layout", lambda x: x == "s_1")).all()
+
+
+@pytest.mark.no_external_software_required
+def test_plate_layout_codes():
+    test_plate_layout = plate_layout.PlateLayout(layout=[["neg_1", "s_1", "pos"], ["neg_2", "s_1", "POS"]])
+    assert test_plate_layout.vocabulary["layout"].tolist() == ["neg_1", "neg_2", "pos", "s_1"]
+    assert test_plate_layout.codes["layout"].dtype == np.uint8
+    assert test_plate_layout.codes["layout"].tolist() == [[0, 3, 2], [1, 3, 2]]
+    assert test_plate_layout.get_data("layout_general_type").tolist() == [["neg", "s", "pos"], ["neg", "s", "pos"]]
+    assert test_plate_layout.get_data("sample_replicate_count").tolist() == [[1, 1, 1], [1, 2, 2]]
+    assert test_plate_layout.get_data("sample_replicate_count").dtype.kind == "i"
+    test_plate_layout.add_data(data={"layout": [["a", "a", "b"], ["b", "a", "c"]]}, tag="layout")
+    assert test_plate_layout.vocabulary["layout"].tolist() == ["a", "b", "c"]
+    assert test_plate_layout.get_well_indices("a").tolist() == [0, 1, 4]
+    # The derived data tags follow the new layout.
+    assert test_plate_layout.get_data("layout_general_type").tolist() == [["a", "a", "b"], ["b", "a", "c"]]
+    assert test_plate_layout.get_data("sample_replicate_count").tolist() == [[1, 2, 1], [2, 3, 1]]
+    with pytest.raises(ValueError):
+        test_plate_layout.add_data(data={"layout_general_type": [["a", "a", "a"], ["a", "a", "a"]]}, tag="layout")
+
+    # Labels set via the data view are lower-cased, and the derived data tags are updated.
+    test_plate_layout.data["layout"] = [["NEG_1", "s_1", "s_2"], ["neg_1", "s_1", "pos"]]
+    assert test_plate_layout.get_data("layout").tolist() == [["neg_1", "s_1", "s_2"], ["neg_1", "s_1", "pos"]]
+    assert test_plate_layout.get_well_indices("neg", data_tag="layout_general_type").tolist() == [0, 3]
+    test_plate_layout.data["comment"] = np.zeros((2, 3))
+    assert test_plate_layout.get_data("comment").shape == (2, 3)
+    assert sorted(test_plate_layout.data) == ["comment", "layout", "layout_general_type", "sample_replicate_count"]
+
+
+@pytest.mark.no_external_software_required
+def test_plate_layout_unpickle_label_matrices():
+    # PlateLayouts pickled before the labels were stored as codes hold the label matrices in data.
+    test_plate_layout = plate_layout.PlateLayout.__new__(plate_layout.PlateLayout)
+    test_plate_layout.__setstate__({"name": "layout", "height": 1, "width": 2, "tags": [],
+                                    "data": {"layout": [["neg_1", "s_1"]], "layout_general_type": [["neg", "s"]],
+                                             "sample_replicate_count": [["1", "1"]]}})
+    assert test_plate_layout.vocabulary["layout"].tolist() == ["neg_1", "s_1"]
+    assert test_plate_layout.get_data("sample_replicate_count").tolist() == [[1, 1]]
+    assert test_plate_layout.get_well_indices("s", data_tag="layout_general_type").tolist() == [1]
+
+
+@pytest.mark.no_external_software_required
+def test_plate_layout_invert():
+    test_plate_layout = plate_layout.PlateLayout(name="layout", layout=[["neg_1", "s_1", "pos"], ["neg_2", "s_2", "pos"]])
+    inverted_plate_layout = test_plate_layout.invert()
+    assert inverted_plate_layout.name == "layout_inverted"
+    assert inverted_plate_layout.get_data("layout").tolist() == [["pos", "s_2", "neg_2"], ["pos", "s_1", "neg_1"]]
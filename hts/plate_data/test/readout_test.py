@@ -1,10 +1,11 @@
 import itertools
 import os
+import pickle
 import logging
 import numpy as np
 import pytest
 
-from hts.plate_data import plate_layout, readout
+from hts.plate_data import plate_layout, readout, readout_io
 
 logging.basicConfig(level=logging.INFO)
 
@@ -46,3 +47,166 @@ def test_get_wells(path):
     TEST_VALUES = [cc for cc in itertools.product(range(len(TEST_PLATE)), range(len(TEST_PLATE[0]))) if float(TEST_PLATE2[cc[0]][cc[1]]) > TEST_THRESHOLD]
     assert test_values == TEST_VALUES
 
+
+
+@pytest.mark.no_external_software_required
+def test_readout_na_and_sentinel_values():
+    test_data = [["1", " 2.5", ""], ["N/A", None, "260000"]]
+    test_readout = readout.Readout(data={"1": test_data})
+    assert test_readout.get_data("1").dtype == np.float64
+    assert np.array_equal(test_readout.get_data("1"), np.array([[1, 2.5, np.nan], [np.nan, np.nan, 260000]]),
+                          equal_nan=True)
+    test_readout = readout.Readout(data={"1": test_data}, sentinel_values={"260000": "inf", 1: 2})
+    assert np.array_equal(test_readout.get_data("1"), np.array([[2, 2.5, np.nan], [np.nan, np.nan, np.inf]]),
+                          equal_nan=True)
+    with pytest.raises(ValueError):
+        readout.Readout(data={"1": [["1", "overflow"]]})
+
+    # Sentinels are not replaced in the caller's float array.
+    test_array = np.array([[1, 260000.]])
+    assert np.array_equal(readout.to_float_array(test_array, sentinel_values={260000: np.nan}), [[1, np.nan]],
+                          equal_nan=True)
+    readout.Readout(data={"1": test_array}, sentinel_values={260000: np.nan})
+    assert test_array.tolist() == [[1, 260000]]
+
+
+@pytest.mark.no_external_software_required
+def test_lazy_readout(tmpdir):
+    paths = []
+    for i in range(3):
+        paths.append(os.path.join(str(tmpdir), "readout_{}.csv".format(i)))
+        with open(paths[-1], "w") as fh:
+            fh.write("{0},1,2\n3,4,{0}\n".format(i))
+
+    cache = readout.ReadoutCache(max_size=2)
+    test_readouts = [readout.LazyReadout(cache=cache, formats=["csv"], paths=[path], tags=["1"], types=["data"])
+                     for path in paths]
+    assert test_readouts[0].name == "readout_0.csv"
+    assert cache.n_parsed == 0 and not test_readouts[0].is_loaded
+
+    assert test_readouts[0].get_data("data").tolist() == [[0, 1, 2], [3, 4, 0]]
+    assert test_readouts[1].height == 2
+    assert test_readouts[0].get_values(wells=[(0, 0)], data_tag="data") == [0]
+    assert cache.n_parsed == 2
+    # Loading a third readout evicts the least recently used.
+    assert test_readouts[2].get_data("data")[0, 0] == 2
+    assert test_readouts[0].is_loaded and not test_readouts[1].is_loaded
+    assert test_readouts[1].get_data("data")[0, 0] == 1
+    assert cache.n_parsed == 4
+
+    # Readouts with added or removed data are still evicted, and their changes are restored once reparsed.
+    for i, test_readout in enumerate(test_readouts):
+        test_readout.add_data(data={"added": np.full((2, 3), i)}, tag="added")
+    test_readouts[1].remove_data(["data"])
+    assert len(cache.readouts) == 2 and not test_readouts[0].is_loaded
+    assert len(os.listdir(cache.temporary_directory.name)) == 1
+    for i, test_readout in enumerate(test_readouts):
+        assert test_readout.get_data("added").tolist() == [[i] * 3] * 2
+        assert ("data" in test_readout.data) == (i != 1)
+    assert len(cache.readouts) == 2
+    # Added data is written once, and overwritten data is discarded.
+    test_readouts[0].add_data(data={"added": np.full((2, 3), 5)}, tag="added")
+    for test_readout in test_readouts[1:]:
+        test_readout.get_data("added")
+    assert test_readouts[0].get_data("added")[0, 0] == 5
+    assert len(os.listdir(cache.temporary_directory.name)) <= len(test_readouts)
+
+    # Pickled lazy readouts keep their added data.
+    unpickled = pickle.loads(pickle.dumps(test_readouts[2]))
+    assert unpickled.get_data("added")[0, 0] == 2
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("na_cell", [None, "N/A"])
+def test_read_envision_csv_fast(tmpdir, na_cell):
+    plate2 = [list(row) for row in TEST_PLATE2]
+    if na_cell:
+        plate2[3][5] = na_cell
+    lines = ["Plate information", "Plate,Repeat,Barcode,Measured height,Kinetics,Measurement date,",
+             "1,1,,14.76,0,5/23/2015 16:41:02,", ""]
+    for i_channel, plate in enumerate([TEST_PLATE, plate2]):
+        lines += ["Background information", "Plate,Label,Result,Signal,MeasInfo,",
+                  "1,US LUM 384 (cps),0,{},\"De=USLum, Ex=N/A\",".format(i_channel), ""]
+        lines += [",".join(row) + "," for row in plate]
+        lines += ["", "Plate information", "Plate,Repeat,Barcode,Measured height,", "1,1,,14.76,", ""]
+    lines += ["Basic assay information", "Assay ID: ,,,,13383"]
+    file = str(tmpdir.join("envision.csv"))
+    with open(file, "w") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+    plate_info, channel_wise_reads, channel_wise_info = readout_io.read_envision_csv(file)
+    plate_info_fast, channel_wise_reads_fast, channel_wise_info_fast = readout_io.read_envision_csv(file, fast=True)
+    assert plate_info_fast == plate_info
+    assert channel_wise_info_fast == channel_wise_info
+    assert channel_wise_info_fast["2"]["MeasInfo"] == "De=USLum, Ex=N/A"
+    assert sorted(channel_wise_reads_fast) == ["1", "2"]
+    assert isinstance(channel_wise_reads_fast["1"], np.ndarray)
+    test_readout = readout.Readout(data=channel_wise_reads)
+    test_readout_fast = readout.Readout(data=channel_wise_reads_fast)
+    for data_tag in ["1", "2"]:
+        assert np.array_equal(test_readout_fast.get_data(data_tag), test_readout.get_data(data_tag), equal_nan=True)
+    assert np.isnan(test_readout_fast.get_data("2")[3, 5]) == bool(na_cell)
+
+
+@pytest.mark.no_external_software_required
+def test_decode_envision_block_ragged_lines(caplog):
+    # Ragged lines are not re-packed into a rectangular array, but decoded and reported line by line.
+    reads = readout_io._decode_envision_block(["1,2,3,", "4,5,", "6,7,8,9,"], ",")
+    assert reads == [["1", "2", "3"], ["4", "5"], ["6", "7", "8", "9"]]
+    assert "differ in length" in caplog.text
+    assert readout_io._decode_envision_block(["1,2,3,", "4,5,6,"], ",").tolist() == [[1, 2, 3], [4, 5, 6]]
+
+
+@pytest.fixture
+def path_insulin_kinetic(tmpdir):
+    """Return the path to a kinetic insulin file of a 2 x 3 plate, with reads 10 * time + well index.
+    """
+    lines = ["User: USER,Path: C:\\Data\\,Test run no.: 33", "Test name: M_InsulinAssay6,Date: 29.06.2015",
+             "Fluorescence (FI)", "Well Row,,A,A,A,B,B,B", "Well Col,,1,2,3,1,2,3",
+             "Content,Time," + ",".join("Sample X{}".format(i) for i in range(1, 7))]
+    # Time points are not in order, e.g. as in merged files.
+    for hour, minute in [(0, 0), (1, 0), (0, 30), (2, 0)]:
+        time = 60 * hour + minute
+        time_label = "{} h {}".format(hour, "{} min".format(minute) if minute else "")
+        lines.append("Raw Data (450-10/480-10),{},".format(time_label) +
+                     ",".join(str(10 * time + i) for i in range(6)))
+    lines.append("," * 7)
+    path = str(tmpdir.join("insulin_kinetic.csv"))
+    with open(path, "w") as fh:
+        fh.write("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.mark.no_external_software_required
+def test_read_insulin_csv_kinetic(path_insulin_kinetic):
+    plate_info, times, reads = readout_io.read_insulin_csv_kinetic(path_insulin_kinetic)
+    assert plate_info[0] == "User: USER"
+    assert times.tolist() == [0, 30, 60, 120]
+    assert reads.shape == (4, 2, 3)
+    assert reads[1].tolist() == [[300, 301, 302], [303, 304, 305]]
+
+    plate_info, channel_wise_reads, channel_wise_info = readout_io.read_insulin_csv(path_insulin_kinetic)
+    assert list(channel_wise_reads.keys()) == [0, 30, 60, 120]
+    assert channel_wise_reads[120].tolist() == reads[3].tolist()
+
+
+@pytest.mark.no_external_software_required
+def test_kinetic_readout_features(path_insulin_kinetic):
+    test_readout = readout.Readout.create_insulin_kinetic_csv(path=path_insulin_kinetic, name="test")
+    assert isinstance(test_readout, readout.KineticReadout)
+    assert test_readout.kinetic_data.shape == (4, 2, 3)
+    assert test_readout.get_data(30).tolist() == [[300, 301, 302], [303, 304, 305]]
+    assert np.shares_memory(test_readout.get_data(30), test_readout.kinetic_data)
+
+    assert np.allclose(test_readout.get_slope(), 10)
+    assert np.allclose(test_readout.get_auc(), 120 * (10 * 60 + np.arange(6).reshape(2, 3)))
+    assert test_readout.get_max_signal().tolist() == [[1200, 1201, 1202], [1203, 1204, 1205]]
+    assert test_readout.get_time_to_threshold(602).tolist() == [[120, 120, 60], [60, 60, 60]]
+    assert np.isnan(test_readout.get_time_to_threshold(5000)).all()
+
+    # NaN reads are ignored in slope and maximum.
+    test_readout.kinetic_data[2, 0, 0] = np.nan
+    assert np.allclose(test_readout.get_slope(), 10)
+    assert test_readout.get_max_signal()[0, 0] == 1200
+    test_readout.add_kinetic_features(threshold=1000)
+    assert test_readout.get_data("time_to_threshold").tolist() == [[120] * 3] * 2
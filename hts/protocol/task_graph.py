@@ -0,0 +1,374 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Compilation of protocol tasks into a dependency graph, with memoization of task results.
+
+    Each task reads and writes readout data tags (and run level artifacts, e.g. Gaussian process models). A task
+    depends on the earlier tasks (in protocol order) that write the data it reads, or read or write the data it writes.
+    Independent tasks that are declared thread-safe may be performed concurrently. A task is skipped if its method,
+    its config, the content of its input readouts and the fingerprints of the tasks providing its run level artifacts
+    are unchanged since it was last performed on the run (its fingerprint), and its outputs still exist.
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+
+import numpy as np
+
+from hts.run import parallel
+
+LOG = logging.getLogger(__name__)
+
+# The data read and written by task methods. "inputs" and "outputs" are readout data tags, "requires" and "provides"
+# are run level artifacts. All are patterns formatted with the task config, and the method's "defaults" for config
+# keys that are not set. Outputs of missing config keys without default are ignored.
+# Tasks of other methods are assumed to read all readout data tags named in their config, and to write none. Such
+# preprocessing tasks are performed after all earlier tasks, and before all later tasks, and are never skipped.
+# Only "thread_safe" methods (numpy calculations on the readouts) are performed concurrently with other tasks. All
+# other tasks, e.g. plots (which use the global pyplot state) or Gaussian process fits (which hold the GIL), are
+# performed one at a time.
+TASK_DATA = {
+    "calculate_linearly_normalized_signal": {"inputs": ["{unnormalized_key}"], "outputs": ["{normalized_key}"],
+                                             "thread_safe": True},
+    "calculate_normalization_by_division": {"inputs": ["{unnormalized_key}", "{normalizer_key}"],
+                                            "outputs": ["{normalized_key}"], "thread_safe": True},
+    "subtract_readouts": {"inputs": ["{data_tag_readout_minuend}", "{data_tag_readout_subtrahend}"],
+                          "outputs": ["{data_tag_readout_difference}"], "thread_safe": True},
+    "calculate_net_fret": {"inputs": ["{donor_channel}", "{acceptor_channel}"], "outputs": ["{net_fret_key}"],
+                           "defaults": {"net_fret_key": "net_fret"}},
+    "calculate_control_normalized_signal": {
+        "inputs": ["{data_tag_readout}"], "outputs": ["{data_tag_normalized_readout}"],
+        "defaults": {"data_tag_normalized_readout": "{data_tag_readout}__control_normalized"}},
+    "calculate_significance_compared_to_null_distribution": {
+        "inputs": ["{data_tag_readout}"], "outputs": ["{data_tag_standard_score}", "{data_tag_p_value}"],
+        "thread_safe": True},
+    "calculate_local_ssmd": {"inputs": ["{data_tag_mean_pos}", "{data_tag_mean_neg}", "{data_tag_std_pos}",
+                                        "{data_tag_std_neg}"], "outputs": ["{data_tag_ssmd}"], "thread_safe": True},
+    "classify_by_cutoff": {"inputs": ["{data_tag_readout}"], "outputs": ["{data_tag_classified_readout}"],
+                           "thread_safe": True},
+    "calculate_b_score": {"inputs": ["{data_tag_readout}"], "outputs": ["{data_tag_b_score}"],
+                          "defaults": {"data_tag_b_score": "{data_tag_readout}__b_score"}, "thread_safe": True},
+    "calculate_robust_z_score": {"inputs": ["{data_tag_readout}"], "outputs": ["{data_tag_robust_z_score}"],
+                                 "defaults": {"data_tag_robust_z_score": "{data_tag_readout}__robust_z_score"},
+                                 "thread_safe": True},
+    "calculate_well_position_correction": {
+        "inputs": ["{data_tag_readout}"], "outputs": ["{data_tag_corrected_readout}"],
+        "defaults": {"data_tag_corrected_readout": "{data_tag_readout}__well_position_corrected"}, "thread_safe": True},
+    "gaussian_processes.add_gaussian_processes": {"inputs": ["{data_tag_readout}"],
+                                                  "provides": ["gp_models:{data_tag_readout}"]},
+    "gaussian_processes.do_gaussian_process_prediction": {
+        "inputs": ["{data_tag_readout}"], "requires": ["gp_models:{data_tag_readout}"],
+        "outputs": ["{best_mean_tag}", "{best_sd_tag}"],
+        "defaults": {"best_mean_tag": "best__predicted_mean", "best_sd_tag": "best__predicted_sd"}},
+    "qc_detect_data_issues.detect_low_cell_viability": {"inputs": ["{control_readout_tag}"],
+                                                        "provides": ["data_issues:{data_issue_tag}"]},
+}
+TASK_DATA["data_normalization.calculate_local_ssmd"] = TASK_DATA["calculate_local_ssmd"]
+TASK_DATA["data_normalization.classify_by_cutoff"] = TASK_DATA["classify_by_cutoff"]
+
+
+def format_patterns(patterns, config):
+    """ Format `patterns` with `config`. Patterns referring to missing config keys are ignored.
+    """
+
+    names = []
+    for pattern in patterns:
+        try:
+            names.append(pattern.format(**config))
+        except KeyError:
+            continue
+    return names
+
+
+def get_config_values(config):
+    """ Get all string values in `config`, including the values of lists and nested sections.
+    """
+
+    values = []
+    for value in config.values():
+        if isinstance(value, dict):
+            values.extend(get_config_values(value))
+        elif isinstance(value, (list, tuple)):
+            values.extend(i for i in value if isinstance(i, str))
+        elif isinstance(value, str):
+            values.append(value)
+    return values
+
+
+def to_plain_config(config):
+    """ Convert a (possibly nested) configobj section to dicts, e.g. for hashing.
+    """
+
+    return {key: to_plain_config(value) if isinstance(value, dict) else value for key, value in config.items()}
+
+
+def hash_readout(plates, data_tag):
+    """ Hash the content of the readouts tagged with `data_tag` of `plates`.
+    """
+
+    digest = hashlib.sha1()
+    for i_plate in plates:
+        digest.update(i_plate.name.encode())
+        if data_tag not in i_plate.readout.data:
+            digest.update(b"\x00missing")
+            continue
+        data = np.ascontiguousarray(i_plate.readout.get_data(data_tag))
+        digest.update("{}{}".format(data.dtype.str, data.shape).encode())
+        digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
+def hash_plate_layouts(plates):
+    """ Hash the labels of the plate layouts of `plates`.
+    """
+
+    digest = hashlib.sha1()
+    layout_digests = {}
+    for i_plate in plates:
+        layout = getattr(i_plate, "plate_layout", None)
+        if layout is None:
+            digest.update(b"\x00none")
+            continue
+        if id(layout) not in layout_digests:
+            labels = layout.get_data("layout")
+            layout_digests[id(layout)] = hashlib.sha1("\x1f".join(str(i) for i in np.ravel(labels)).encode()).digest()
+        digest.update(layout_digests[id(layout)])
+    return digest.hexdigest()
+
+
+class TaskGraph:
+
+    """ ``TaskGraph`` describes protocol tasks, and their dependencies through the data they read and write.
+
+    Attributes:
+        tasks (list of ProtocolTask): The tasks, in protocol order.
+        inputs (dict): Per task name, the readout data tags read by the task.
+        outputs (dict): Per task name, the readout data tags written by the task.
+        requires (dict): Per task name, the run level artifacts read by the task.
+        provides (dict): Per task name, the run level artifacts written by the task.
+        providers (dict of dict): Per task name, for each run level artifact read by the task, the name of the task
+                                  that last wrote it before (or None).
+        dependencies (dict of set): Per task name, the names of the tasks that need to be performed before.
+        is_tracked (dict of bool): Per task name, whether the data written by the task is known. Only tracked tasks
+                                   are skipped.
+        is_thread_safe (dict of bool): Per task name, whether the task may be performed concurrently with other tasks.
+    """
+
+    def __init__(self, tasks, inputs, outputs, requires, provides, providers, dependencies, is_tracked,
+                 is_thread_safe):
+
+        self.tasks = tasks
+        self.inputs = inputs
+        self.outputs = outputs
+        self.requires = requires
+        self.provides = provides
+        self.providers = providers
+        self.dependencies = dependencies
+        self.is_tracked = is_tracked
+        self.is_thread_safe = is_thread_safe
+
+
+    @classmethod
+    def create(cls, tasks, readout_tags):
+        """ Compile `tasks` into a ``TaskGraph``.
+
+        Args:
+            tasks (list of ProtocolTask): The tasks, in protocol order.
+            readout_tags (list of str): The readout data tags available before any task is performed.
+        """
+
+        names = [task.name for task in tasks]
+        if len(set(names)) != len(names):
+            raise ValueError("Task names are not unique: {}".format(names))
+
+        inputs, outputs, requires, provides, providers, dependencies, is_tracked, is_thread_safe = \
+            {}, {}, {}, {}, {}, {}, {}, {}
+        available = set(readout_tags)
+        # Per data name, the task that last wrote it, and the tasks that read it since.
+        last_writer = {}
+        readers = collections.defaultdict(list)
+        barrier = None
+        for task in tasks:
+            task_data = TASK_DATA.get(task.method)
+            is_tracked[task.name] = task_data is not None or task.type != "preprocessing"
+            is_thread_safe[task.name] = task_data is not None and task_data.get("thread_safe", False)
+            if task_data is not None:
+                config = dict(task_data.get("defaults", {}))
+                config.update(task.config)
+                for key, value in config.items():
+                    if key in task_data.get("defaults", {}) and key not in task.config:
+                        config[key] = value.format(**config)
+                inputs[task.name] = format_patterns(task_data.get("inputs", []), config)
+                outputs[task.name] = format_patterns(task_data.get("outputs", []), config)
+                requires[task.name] = format_patterns(task_data.get("requires", []), config)
+                provides[task.name] = format_patterns(task_data.get("provides", []), config)
+            else:
+                inputs[task.name] = sorted(set(i for i in get_config_values(task.config) if i in available))
+                outputs[task.name], requires[task.name], provides[task.name] = [], [], []
+
+            providers[task.name] = {i: last_writer.get(i) for i in requires[task.name]}
+            reads = inputs[task.name] + requires[task.name]
+            writes = outputs[task.name] + provides[task.name]
+            task_dependencies = set(last_writer[i] for i in reads if i in last_writer)
+            for i in writes:
+                if i in last_writer:
+                    task_dependencies.add(last_writer[i])
+                task_dependencies.update(readers[i])
+            if barrier is not None:
+                task_dependencies.add(barrier)
+            if not is_tracked[task.name]:
+                # The task may read and write any data.
+                task_dependencies.update(names[:names.index(task.name)])
+                barrier = task.name
+            task_dependencies.discard(task.name)
+            dependencies[task.name] = task_dependencies
+
+            for i in reads:
+                readers[i].append(task.name)
+            for i in writes:
+                last_writer[i] = task.name
+                readers[i] = []
+            available.update(outputs[task.name])
+
+        return cls(tasks=list(tasks), inputs=inputs, outputs=outputs, requires=requires, provides=provides,
+                   providers=providers, dependencies=dependencies, is_tracked=is_tracked,
+                   is_thread_safe=is_thread_safe)
+
+
+    def get_fingerprint(self, task, plates, config_data, readout_hashes, layout_hash, fingerprints):
+        """ Get the fingerprint of `task`: a hash of its method, its config, the content of its input readouts and the
+        fingerprints of the tasks that provide its run level artifacts.
+
+        A run level artifact (e.g. a Gaussian process model) is thus fingerprinted by the task that provides it: if the
+        providing task is performed with a changed config, all tasks requiring the artifact are performed again.
+
+        Args:
+            task (ProtocolTask): The task.
+            plates (list of Plate): The plates of the run.
+            config_data (dict): The run config data of the task, which updates the task config.
+            readout_hashes (dict): Hashes of the readouts per data tag, updated with the input readouts of `task`.
+            layout_hash (str): The hash of the plate layouts.
+            fingerprints (dict): The fingerprints of the tasks last performed, per task name.
+        """
+
+        for data_tag in self.inputs[task.name]:
+            if data_tag not in readout_hashes:
+                readout_hashes[data_tag] = hash_readout(plates, data_tag)
+        description = {"method": task.method, "type": task.type, "config": to_plain_config(task.config),
+                       "config_data": to_plain_config(config_data), "plate_layouts": layout_hash,
+                       "inputs": {data_tag: readout_hashes[data_tag] for data_tag in self.inputs[task.name]},
+                       "requires": {artifact: fingerprints.get(provider) if provider is not None else None
+                                    for artifact, provider in self.providers[task.name].items()}}
+        return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+    def run(self, run, perform_task, fingerprints, results, executor="serial", max_workers=None, force=False):
+        """ Perform all tasks in dependency order.
+
+        With the "thread" executor, independent thread-safe tasks (see `is_thread_safe`) are performed concurrently in
+        a thread pool. All other tasks are performed one at a time in the calling thread, once no task is running.
+
+        Args:
+            run (Run): The run.
+            perform_task (function): Performs a task on `run`, and returns its result.
+            fingerprints (dict): The fingerprints of the tasks last performed, per task name. Updated in place.
+            results (dict): The results of the tasks last performed, per task name. Updated in place.
+            executor (str): "serial", or "thread" to perform independent thread-safe tasks in a thread pool. The
+                            tasks change the run in place, hence "process" is not supported.
+            max_workers (int): The maximum number of threads. If None, the concurrent.futures default.
+            force (bool): If True, no task is skipped.
+
+        Returns:
+            list of str: The names of the performed (that is, not skipped) tasks, in order of completion.
+        """
+
+        if executor not in ["serial", "thread"]:
+            raise ValueError("executor {} is not one of: serial, thread".format(executor))
+
+        plates = list(run.plates.values())
+        readout_hashes = {}
+        layout_hash = hash_plate_layouts(plates)
+        performed = []
+
+        def perform(task):
+            config_data = run.config_data.get(task.name, {}) if task.type != "preprocessing" else {}
+            fingerprint = self.get_fingerprint(task, plates, config_data, readout_hashes, layout_hash, fingerprints)
+            is_complete = all(all(data_tag in i_plate.readout.data for i_plate in plates)
+                              for data_tag in self.outputs[task.name]) and \
+                (task.type == "preprocessing" or task.name in results)
+            if not force and self.is_tracked[task.name] and fingerprints.get(task.name) == fingerprint and is_complete:
+                LOG.info("Task {} is unchanged: skipped.".format(task.name))
+                return
+            # Outputs are recalculated: the task methods keep existing data.
+            for i_plate in plates:
+                i_plate.readout.remove_data(self.outputs[task.name])
+            for data_tag in self.outputs[task.name]:
+                readout_hashes.pop(data_tag, None)
+            result = perform_task(task)
+            if task.type != "preprocessing":
+                results[task.name] = result
+            fingerprints[task.name] = fingerprint
+            performed.append(task.name)
+
+        done = set()
+        failed = {}
+
+        def finish(task, get_result):
+            try:
+                get_result()
+                done.add(task.name)
+            except Exception as e:
+                LOG.error("Task {}: {}: {}".format(task.name, type(e).__name__, e))
+                failed[task.name] = e
+
+        def get_ready(pending):
+            # Tasks whose dependencies failed are not performed.
+            ready = []
+            for task in list(pending):
+                blocking = sorted(i for i in self.dependencies[task.name] if i in failed)
+                if blocking:
+                    failed[task.name] = Exception("Dependencies failed: {}".format(", ".join(blocking)))
+                    pending.remove(task)
+                elif self.dependencies[task.name] <= done:
+                    ready.append(task)
+                    pending.remove(task)
+            return ready
+
+        pending = list(self.tasks)
+        if executor == "serial":
+            while pending:
+                ready = get_ready(pending)
+                if not ready:
+                    break
+                for task in ready:
+                    finish(task, lambda: perform(task))
+        else:
+            with parallel.get_pool("thread", max_workers=max_workers) as pool:
+                running = {}
+                exclusive = []
+                while pending or running or exclusive:
+                    for task in get_ready(pending):
+                        if self.is_thread_safe[task.name]:
+                            running[pool.submit(perform, task)] = task
+                        else:
+                            exclusive.append(task)
+                    if not running:
+                        if not exclusive:
+                            break
+                        task = exclusive.pop(0)
+                        finish(task, lambda: perform(task))
+                        continue
+                    finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        finish(running.pop(future), future.result)
+
+        if failed:
+            raise Exception("{} of {} tasks failed:\n{}".format(len(failed), len(self.tasks), "\n".join(
+                "{}: {}: {}".format(name, type(e).__name__, e) for name, e in failed.items()))) \
+                from list(failed.values())[0]
+        return performed
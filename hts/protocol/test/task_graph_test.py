@@ -0,0 +1,220 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from hts.plate.plate import Plate
+from hts.plate_data.plate_layout import PlateLayout
+from hts.plate_data.readout import Readout
+from hts.protocol import protocol, task_graph
+from hts.run.run import Run
+
+PROTOCOL = """name = task_graph_test
+[normalize]
+    tags = preprocessing,
+    method = calculate_linearly_normalized_signal
+    unnormalized_key = signal
+    normalized_0 = neg
+    normalized_1 = pos
+    normalized_key = normalized
+[fret]
+    tags = preprocessing,
+    method = calculate_net_fret
+    donor_channel = donor
+    acceptor_channel = acceptor
+[score]
+    tags = preprocessing,
+    method = calculate_significance_compared_to_null_distribution
+    data_tag_readout = normalized
+    sample_tag_null_distribution = neg, s_1
+    data_tag_standard_score = score
+    data_tag_p_value = p_value
+    is_higher_value_better = True
+[ssmd]
+    tags = qc,
+    method = data_normalization.calculate_local_ssmd
+    data_tag_mean_pos = score
+    data_tag_mean_neg = normalized
+    data_tag_std_pos = p_value
+    data_tag_std_neg = net_fret
+    data_tag_ssmd = {ssmd}
+"""
+
+
+@pytest.fixture
+def path_protocol(tmpdir):
+    """Return the path to a protocol with three preprocessing tasks (two dependent, one independent) and a qc task.
+    """
+    path = os.path.join(str(tmpdir), "protocol.txt")
+    with open(path, "w") as fh:
+        fh.write(PROTOCOL.format(ssmd="ssmd"))
+    return path
+
+
+def create_run(path_protocol):
+    random = np.random.RandomState(0)
+    layout = PlateLayout(layout=[["neg", "pos", "buffer", "s_1"],
+                                 ["fluorophore_donor", "fluorophore_acceptor", "neg", "pos"]])
+    plates = [Plate(data={"readout": Readout(data={tag: random.normal(size=(2, 4)) for tag in
+                                                   ["signal", "donor", "acceptor"]}),
+                          "plate_layout": layout}, name="p{}".format(i), height=2, width=4) for i in range(3)]
+    test_run = Run(plates=plates)
+    test_run.protocol(path=path_protocol, format="config")
+    return test_run
+
+
+@pytest.mark.no_external_software_required
+def test_create(path_protocol):
+    test_protocol = protocol.Protocol.create(path_protocol, format="config")
+    graph = task_graph.TaskGraph.create(test_protocol.tasks, readout_tags=["signal", "donor", "acceptor"])
+
+    assert graph.inputs["fret"] == ["donor", "acceptor"]
+    assert graph.outputs["fret"] == ["net_fret"]
+    assert graph.outputs["score"] == ["score", "p_value"]
+    assert graph.dependencies == {"normalize": set(), "fret": set(), "score": {"normalize"},
+                                 "ssmd": {"normalize", "fret", "score"}}
+    assert graph.is_thread_safe == {"normalize": True, "fret": False, "score": True, "ssmd": True}
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", ["serial", "thread"])
+def test_run_protocol(path_protocol, executor, monkeypatch):
+    test_run = create_run(path_protocol)
+    performed = []
+    perform_preprocessing_task = test_run.perform_preprocessing_task
+    perform_task = test_run.perform_task
+    monkeypatch.setattr(test_run, "perform_preprocessing_task",
+                        lambda task: performed.append(task.name) or perform_preprocessing_task(task))
+    monkeypatch.setattr(test_run, "perform_task", lambda task: performed.append(task.name) or perform_task(task))
+
+    test_run.run_protocol(executor=executor)
+    assert sorted(performed) == ["fret", "normalize", "score", "ssmd"]
+    assert performed.index("normalize") < performed.index("score") < performed.index("ssmd")
+    expected = {name: i_plate.readout.data.copy() for name, i_plate in test_run.plates.items()}
+
+    # Nothing changed.
+    del performed[:]
+    test_run.run_protocol(executor=executor)
+    assert performed == []
+
+    # Only the edited qc task is performed again.
+    with open(path_protocol, "w") as fh:
+        fh.write(PROTOCOL.format(ssmd="ssmd_edited"))
+    del test_run._protocol
+    test_run.protocol(path=path_protocol, format="config")
+    test_run.run_protocol(executor=executor)
+    assert performed == ["ssmd"]
+
+    # A changed readout invalidates the tasks downstream of it.
+    del performed[:]
+    i_plate = test_run.plates["p1"]
+    i_plate.readout.add_data(data={"signal": i_plate.readout.get_data("signal") * 2}, tag="signal")
+    test_run.run_protocol(executor=executor)
+    assert performed == ["normalize"]
+    # The normalized readouts are unchanged, hence the downstream tasks are skipped.
+    for name, i_plate in test_run.plates.items():
+        assert np.array_equal(i_plate.readout.get_data("normalized"), expected[name]["normalized"])
+        assert np.array_equal(i_plate.readout.get_data("score"), expected[name]["score"])
+
+    del performed[:]
+    test_run.run_protocol(executor=executor, force=True)
+    assert sorted(performed) == ["fret", "normalize", "score", "ssmd"]
+
+
+GP_PROTOCOL = """name = task_graph_gp_test
+[gp_models]
+    tags = analysis,
+    method = gaussian_processes.add_gaussian_processes
+    data_tag_readout = signal
+    methods = {methods}
+[gp_prediction]
+    tags = analysis,
+    method = gaussian_processes.do_gaussian_process_prediction
+    data_tag_readout = signal
+"""
+
+
+@pytest.mark.no_external_software_required
+def test_run_protocol_required_artifacts(tmpdir):
+    path = os.path.join(str(tmpdir), "protocol.txt")
+    random = np.random.RandomState(0)
+    plates = [Plate(data={"readout": Readout(data={"signal": random.normal(size=(2, 4))}),
+                          "plate_layout": PlateLayout(layout=[["neg", "pos", "s_1", "s_2"]] * 2)},
+                    name="p{}".format(i), height=2, width=4) for i in range(2)]
+    test_run = Run(plates=plates)
+
+    def perform_task(task):
+        if task.method.endswith("do_gaussian_process_prediction"):
+            for i_plate in plates:
+                i_plate.readout.add_data(data={tag: np.zeros((2, 4)) for tag in
+                                               ["best__predicted_mean", "best__predicted_sd"]}, tag=task.name)
+        return task.name
+
+    fingerprints, results = {}, {}
+    for methods, expected in [("a", ["gp_models", "gp_prediction"]), ("a", []),
+                              ("b", ["gp_models", "gp_prediction"])]:
+        with open(path, "w") as fh:
+            fh.write(GP_PROTOCOL.format(methods=methods))
+        test_protocol = protocol.Protocol.create(path, format="config")
+        graph = task_graph.TaskGraph.create(test_protocol.tasks, readout_tags=["signal"])
+        assert graph.providers["gp_prediction"] == {"gp_models:signal": "gp_models"}
+        # The input readout of the prediction is unchanged, but the models it requires are not.
+        assert graph.run(test_run, perform_task, fingerprints, results, executor="serial") == expected
+
+
+THREAD_PROTOCOL = """name = task_graph_thread_test
+[normalize]
+    tags = preprocessing,
+    method = calculate_linearly_normalized_signal
+    unnormalized_key = signal
+    normalized_0 = neg
+    normalized_1 = pos
+    normalized_key = normalized
+[z_score]
+    tags = preprocessing,
+    method = calculate_robust_z_score
+    data_tag_readout = signal
+[heat_map]
+    tags = qc,
+    method = qc_matplotlib.heat_map_single
+    data_tag = signal
+[heat_map_normalized]
+    tags = qc,
+    method = qc_matplotlib.heat_map_single
+    data_tag = normalized
+"""
+
+
+@pytest.mark.no_external_software_required
+def test_run_thread_safe_tasks(tmpdir):
+    path = os.path.join(str(tmpdir), "protocol.txt")
+    with open(path, "w") as fh:
+        fh.write(THREAD_PROTOCOL)
+    test_run = create_run(path)
+    graph = task_graph.TaskGraph.create(test_run.protocol().tasks, readout_tags=["signal", "donor", "acceptor"])
+    assert graph.is_thread_safe == {"normalize": True, "z_score": True, "heat_map": False,
+                                    "heat_map_normalized": False}
+
+    # The thread-safe tasks wait for each other: they fail unless they are performed concurrently.
+    barrier = threading.Barrier(2, timeout=10)
+    lock = threading.Lock()
+    running = set()
+    concurrent_tasks = {}
+
+    def perform_task(task):
+        with lock:
+            concurrent_tasks[task.name] = set(running)
+            running.add(task.name)
+        if graph.is_thread_safe[task.name]:
+            barrier.wait()
+        with lock:
+            running.remove(task.name)
+        return task.name
+
+    performed = graph.run(test_run, perform_task, {}, {}, executor="thread", max_workers=4)
+    assert sorted(performed) == ["heat_map", "heat_map_normalized", "normalize", "z_score"]
+    # The plots are performed alone, and after the tasks they depend on.
+    assert concurrent_tasks["heat_map"] == set()
+    assert concurrent_tasks["heat_map_normalized"] == set()
+    assert performed.index("normalize") < performed.index("heat_map_normalized")
@@ -0,0 +1,268 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Ingestion of plate data files as they are written, e.g. by a plate reader, with rolling quality control.
+
+    A ``WatchFolder`` polls for the data files of all plates of a run config. Once all files of a plate are complete
+    (that is, they exist and did not change since the previous poll), the plate is created and appended to the run,
+    the protocol's preprocessing tasks and plate wise QC tasks are performed, and the plate's QC metrics are published
+    (as json lines, and to callbacks).
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import collections
+import json
+import logging
+import numpy as np
+import os
+import time
+
+from hts.plate import plate
+from hts.plate_data.parse_cache import ParseCache
+from hts.run.run import Run
+
+LOG = logging.getLogger(__name__)
+
+
+def get_plate_files(config_plate):
+    """ Get the data files of one plate.
+
+    Args:
+        config_plate (dict): The `Plate.create` keyword arguments of the plate, see `Run.get_plate_configs`.
+
+    Returns:
+        list of str
+    """
+
+    files = []
+    for config_data_type in config_plate.values():
+        configs = config_data_type.get("configs", [config_data_type] * len(config_data_type["paths"]))
+        for path, config in zip(config_data_type["paths"], configs):
+            # For files with the data of several plates, "paths" holds the tags, and "file" the path.
+            files.append(config.get("file", path))
+    return files
+
+
+def calculate_plate_qc_metrics(i_plate, data_tag, negative_control="neg", positive_control="pos",
+                               label_data_tag="layout_general_type"):
+    r""" Calculate the QC metrics of the negative and positive controls of a plate.
+
+    .. math::
+    Z' = 1 - \frac{3 (\sigma_{pos} + \sigma_{neg})}{|\mu_{pos} - \mu_{neg}|}
+
+    SSMD = \frac{\mu_{pos} - \mu_{neg}}{\sqrt{\sigma_{pos}^2 + \sigma_{neg}^2}}
+
+    Args:
+        i_plate (Plate): The plate.
+        data_tag (str): The readout data tag.
+        negative_control (str): The label of the negative controls in the plate layout.
+        positive_control (str): The label of the positive controls in the plate layout.
+        label_data_tag (str): The plate layout data tag of the labels.
+
+    Returns:
+        collections.OrderedDict: The number, mean and standard deviation of the negative and positive controls, the
+                                 Z'-factor and the SSMD. NaN if there are less than two controls of a kind.
+    """
+
+    metrics = collections.OrderedDict()
+    for control_type, label in [("neg", negative_control), ("pos", positive_control)]:
+        values = np.asarray(i_plate.get_values_by_label(value_data_tag=data_tag, labels=label,
+                                                        label_data_tag=label_data_tag), dtype=float)
+        values = values[~np.isnan(values)]
+        metrics["n_" + control_type] = len(values)
+        metrics[control_type + "_mean"] = values.mean() if len(values) > 1 else np.nan
+        metrics[control_type + "_std"] = values.std(ddof=1) if len(values) > 1 else np.nan
+
+    difference = metrics["pos_mean"] - metrics["neg_mean"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics["z_prime_factor"] = 1 - 3 * (metrics["pos_std"] + metrics["neg_std"]) / abs(difference)
+        metrics["ssmd"] = difference / np.sqrt(metrics["pos_std"] ** 2 + metrics["neg_std"] ** 2)
+    return metrics
+
+
+class WatchFolder:
+
+    """ ``WatchFolder`` ingests the plates of a run config as their data files appear.
+
+    Attributes:
+        run (Run): The run with all ingested plates, in the order of ingestion.
+        pending (collections.OrderedDict): Per plate name of the plates not yet ingested, the `Plate.create` keyword
+                                           arguments.
+        additional_data (dict of PlateData): The data shared by all plates (e.g. the plate layout), per data type.
+        qc_data_tag (str): The readout data tag for the QC metrics. If None, the first (sorted) readout data tag.
+        negative_control (str): The label of the negative controls in the plate layout (general type).
+        positive_control (str): The label of the positive controls in the plate layout (general type).
+        z_prime_factor_threshold (float): Plates with a lower (or undefined) Z'-factor fail QC.
+        window (int): The number of most recently ingested plates in the rolling QC metrics.
+        metrics_path (str): If set, the QC metrics of each plate are appended to this file, one json object per line.
+        callbacks (list of function): Called with the plate and its QC metrics, for each ingested plate.
+        qc_metrics (collections.OrderedDict): The QC metrics per plate name.
+        file_states (dict): The (size, modification time) of the data files of pending plates at the previous poll.
+        failures (dict): Per plate that could not be created or ingested, the state of its files and the error. The
+                         plate stays pending, and is retried once its files change. For ingested plates with a failing
+                         callback, the state is None.
+    """
+
+    def __init__(self, run_config, parse_cache=None, qc_data_tag=None, negative_control="neg",
+                 positive_control="pos", z_prime_factor_threshold=0.5, window=10, metrics_path=None, callbacks=None):
+
+        path, file = os.path.split(run_config)
+        config = Run.read_config(path, file)
+        if isinstance(parse_cache, str):
+            parse_cache = ParseCache(parse_cache)
+        config_plate_wise, self.additional_data, plates = Run.get_plate_configs(config, parse_cache=parse_cache)
+        if plates is not None:
+            raise ValueError("Runs read from a single csv file with one well per row cannot be ingested plate wise.")
+
+        self.pending = collections.OrderedDict(zip(config["plate_names"], config_plate_wise))
+        self.run = Run(plates=[], path=run_config, **config)
+        self.qc_data_tag = qc_data_tag
+        self.negative_control = negative_control
+        self.positive_control = positive_control
+        self.z_prime_factor_threshold = float(z_prime_factor_threshold)
+        self.window = int(window)
+        self.metrics_path = metrics_path
+        self.callbacks = callbacks if callbacks is not None else []
+        self.qc_metrics = collections.OrderedDict()
+        self.file_states = {}
+        self.failures = {}
+
+
+    def get_file_state(self, file):
+
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+
+    def poll(self):
+        """ Ingest all pending plates whose data files are complete, i.e. exist and did not change since the
+        previous poll.
+
+        Returns:
+            list of Plate: The ingested plates.
+        """
+
+        ready = []
+        for plate_name, config_plate in self.pending.items():
+            files = get_plate_files(config_plate)
+            states = [self.get_file_state(file) for file in files]
+            is_stable = all(state is not None and state == self.file_states.get(file)
+                            for file, state in zip(files, states))
+            self.file_states.update(zip(files, states))
+            if is_stable and (plate_name not in self.failures or self.failures[plate_name][0] != states):
+                ready.append((plate_name, files, states))
+
+        plates = []
+        for plate_name, files, states in ready:
+            self.failures.pop(plate_name, None)
+            try:
+                i_plate = plate.Plate.create(format="config", name=plate_name, **self.pending[plate_name])
+                self.ingest(i_plate)
+            except Exception as e:
+                LOG.error("Could not ingest plate {} from {}: {}".format(plate_name, ", ".join(files), e))
+                self.failures[plate_name] = (states, e)
+                continue
+            for file in files:
+                self.file_states.pop(file, None)
+            del self.pending[plate_name]
+            plates.append(i_plate)
+        return plates
+
+
+    def ingest(self, i_plate):
+        """ Append `i_plate` to the run, perform its preprocessing and QC tasks, and publish its QC metrics.
+
+        If a task fails, `i_plate` is removed from the run again (and the run's data frame is reset), and the error is
+        raised.
+        """
+
+        LOG.info("Ingest plate {}".format(i_plate.name))
+        for data_type, data in self.additional_data.items():
+            i_plate.add_data(data_type, data, force=True)
+        try:
+            # The protocol's preprocessing tasks are performed by `Run.append_plates`.
+            self.run.append_plates([i_plate])
+
+            if self.run.protocol():
+                for task in self.run.protocol().get_tasks_by_tag("qc"):
+                    if hasattr(i_plate, task.method):
+                        i_plate.preprocess(task.method, **task.config)
+                    else:
+                        LOG.debug("QC task {} is performed on the whole run, not per plate.".format(task.name))
+
+            metrics = self.calculate_qc_metrics(i_plate)
+        except Exception:
+            if self.run.plates.get(i_plate.name) is i_plate:
+                del self.run.plates[i_plate.name]
+                self.run.reset_data_frame()
+            self.qc_metrics.pop(i_plate.name, None)
+            raise
+        self.publish(i_plate, metrics)
+
+
+    def calculate_qc_metrics(self, i_plate):
+        """ Calculate the QC metrics of `i_plate` (see `calculate_plate_qc_metrics`), and the rolling median Z'-factor
+        of the most recent `window` plates.
+        """
+
+        data_tag = self.qc_data_tag
+        if data_tag is None:
+            data_tag = sorted(i_plate.readout.data.keys())[0]
+        metrics = collections.OrderedDict([("plate", i_plate.name), ("n_plates", len(self.run.plates)),
+                                           ("data_tag", data_tag)])
+        metrics.update(calculate_plate_qc_metrics(i_plate, data_tag=data_tag, negative_control=self.negative_control,
+                                                  positive_control=self.positive_control))
+        metrics["is_failed"] = bool(not metrics["z_prime_factor"] >= self.z_prime_factor_threshold)
+        self.qc_metrics[i_plate.name] = metrics
+
+        recent_z_prime_factors = [i["z_prime_factor"] for i in list(self.qc_metrics.values())[-self.window:]]
+        metrics["z_prime_factor_rolling_median"] = np.nanmedian(recent_z_prime_factors) \
+            if not np.isnan(recent_z_prime_factors).all() else np.nan
+        metrics["n_failed_rolling"] = sum(i["is_failed"] for i in list(self.qc_metrics.values())[-self.window:])
+        return metrics
+
+
+    def publish(self, i_plate, metrics):
+        """ Publish the QC metrics of `i_plate`: log failures, append them to `metrics_path`, and call the callbacks.
+
+        Errors of the callbacks are logged, and recorded in `failures`.
+        """
+
+        if metrics["is_failed"]:
+            LOG.warning("Plate {} failed QC: Z'-factor {} < {}".format(i_plate.name, metrics["z_prime_factor"],
+                                                                      self.z_prime_factor_threshold))
+        if self.metrics_path:
+            # NaN is written as null, to keep the lines valid json.
+            json_metrics = {key: None if isinstance(value, float) and np.isnan(value) else value
+                            for key, value in metrics.items()}
+            with open(self.metrics_path, "a") as fh:
+                fh.write(json.dumps(json_metrics, default=float) + "\n")
+        for callback in self.callbacks:
+            try:
+                callback(i_plate, metrics)
+            except Exception as e:
+                LOG.error("Callback {} failed for plate {}: {}".format(getattr(callback, "__name__", callback),
+                                                                      i_plate.name, e))
+                self.failures[i_plate.name] = (None, e)
+
+
+    def watch(self, poll_interval=10, max_polls=None):
+        """ Poll every `poll_interval` seconds until all plates are ingested (or `max_polls` polls were made).
+
+        Returns:
+            Run: The run with all ingested plates.
+        """
+
+        n_polls = 0
+        while self.pending and (max_polls is None or n_polls < max_polls):
+            if n_polls > 0:
+                time.sleep(poll_interval)
+            self.poll()
+            n_polls += 1
+        if self.pending:
+            LOG.info("Plates not yet ingested: {}".format(", ".join(self.pending.keys())))
+        return self.run
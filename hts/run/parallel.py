@@ -0,0 +1,227 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: Ordered parallel execution of independent tasks, e.g. the parsing of plate files, or the preprocessing
+    of plates.
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import concurrent.futures
+import copy
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+# "serial": in the calling thread. "thread": a thread pool, e.g. for I/O bound tasks. "process": a process pool, e.g.
+# for CPU bound tasks; the method, arguments and results need to be picklable.
+EXECUTORS = ["serial", "thread", "process"]
+
+
+def get_pool(executor, max_workers=None):
+    """ Create a ``concurrent.futures.Executor`` for `executor` ("thread" or "process").
+    """
+
+    if executor == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    elif executor == "process":
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError("executor {} is not one of: {}".format(executor, EXECUTORS))
+
+
+class TaskErrors(Exception):
+
+    """ ``TaskErrors`` is raised if several of the calls of `map_ordered` failed.
+
+    Attributes:
+        errors (list of (str, Exception)): The label and the exception of each failed call, in call order.
+    """
+
+    def __init__(self, errors, n_tasks):
+
+        self.errors = errors
+        super().__init__("{} of {} tasks failed:\n{}".format(len(errors), n_tasks, "\n".join(
+            "{}: {}: {}".format(label, type(e).__name__, e) for label, e in errors)))
+
+
+def add_label(e, label):
+    """ Attach `label` (e.g. a plate name and its files) to the exception `e`, as a note shown in its traceback.
+    """
+
+    if hasattr(e, "add_note"):
+        e.add_note(label)
+    else:
+        e.__notes__ = getattr(e, "__notes__", []) + [label]
+
+
+def map_ordered(method, kwargs_list, executor="serial", max_workers=None, labels=None, collect_errors=False):
+    """ Call `method` for each set of keyword arguments in `kwargs_list`, and return the results in the same order.
+
+    By default, the first failure (in call order) is raised, and no further calls are started. With `collect_errors`,
+    all calls are performed. A single failure is always raised as the original exception, with its label attached
+    as a note (see `add_label`); several failures are raised together as ``TaskErrors``. All failures are logged
+    with their labels.
+
+    Args:
+        method (function): The method to call.
+        kwargs_list (list of dict): The keyword arguments for each call.
+        executor (str): One of EXECUTORS.
+        max_workers (int): The maximum number of threads or processes. If None, the concurrent.futures default.
+        labels (list of str): A label for each call, used in error messages (e.g. a plate name and its files).
+        collect_errors (bool): If True, perform all calls even if some fail, and report all failures.
+
+    Returns:
+        list: The results, in the order of `kwargs_list`.
+    """
+
+    if labels is None:
+        labels = [str(i) for i in range(len(kwargs_list))]
+    if max_workers is not None:
+        max_workers = int(max_workers)
+
+    results = []
+    errors = []
+    if executor == "serial":
+        for kwargs, label in zip(kwargs_list, labels):
+            try:
+                results.append(method(**kwargs))
+            except Exception as e:
+                errors.append((label, e))
+                if not collect_errors:
+                    break
+    else:
+        with get_pool(executor, max_workers=max_workers) as pool:
+            futures = [pool.submit(method, **kwargs) for kwargs in kwargs_list]
+            for future, label in zip(futures, labels):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    errors.append((label, e))
+                    if not collect_errors:
+                        for pending_future in futures:
+                            pending_future.cancel()
+                        break
+
+    for label, e in errors:
+        LOG.error("{}: {}: {}".format(label, type(e).__name__, e))
+    if len(errors) == 1:
+        label, e = errors[0]
+        add_label(e, label)
+        raise e
+    elif errors:
+        raise TaskErrors(errors, len(kwargs_list)) from errors[0][1]
+
+    return results
+
+
+def preprocess_plate(i_plate, methodname, kwargs):
+
+    i_plate.preprocess(methodname, **kwargs)
+
+
+def preprocess_plates(plates, methodname, kwargs, executor="serial", max_workers=None):
+    """ Perform the ``Plate`` method `methodname` on each of `plates` (see `Plate.preprocess`).
+
+    With "serial", the plates are preprocessed in place one after the other, and the first error of the method is
+    raised. With "thread", the plates are preprocessed in place. With "process", the numeric readouts of all plates
+    are placed in one shared memory block. Each worker process preprocesses a copy of its plate, whose readouts are
+    read-only views on the shared memory, and returns the readout data tags added (or replaced) by the method. These
+    are merged back plate by plate, in the order of `plates`. Other changes of the plate copies are discarded.
+
+    Args:
+        plates (list of Plate): The plates.
+        methodname (str): The name of the ``Plate`` method.
+        kwargs (dict): The keyword arguments of the method.
+        executor (str): One of EXECUTORS.
+        max_workers (int): The maximum number of threads or processes. If None, the concurrent.futures default.
+    """
+
+    if executor == "serial":
+        # Errors of the plate method are raised as is, and the remaining plates are not preprocessed.
+        for i_plate in plates:
+            i_plate.preprocess(methodname, **kwargs)
+        return
+
+    labels = ["Plate {}".format(i_plate.name) for i_plate in plates]
+    if executor != "process":
+        map_ordered(preprocess_plate, [{"i_plate": i_plate, "methodname": methodname, "kwargs": kwargs}
+                                       for i_plate in plates], executor=executor, max_workers=max_workers,
+                    labels=labels)
+        return
+
+    plate_copies, readout_data = [], []
+    for i_plate in plates:
+        # The plate copy is sent without its readout data; LazyReadout instances are parsed first.
+        plate_readout = i_plate.readout.load() if hasattr(i_plate.readout, "load") else i_plate.readout
+        plate_copy = copy.copy(i_plate)
+        plate_copy.readout = copy.copy(plate_readout)
+        plate_copies.append(plate_copy)
+        readout_data.append(dict(plate_readout.data))
+
+    # The layout of the shared memory block: per plate and data tag, (offset, shape, dtype).
+    specs = []
+    size = 0
+    for plate_data in readout_data:
+        plate_specs = {}
+        for data_tag, data in plate_data.items():
+            if data.dtype.kind in "biuf":
+                plate_specs[data_tag] = (size, data.shape, data.dtype.str)
+                size += data.nbytes
+        specs.append(plate_specs)
+
+    memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for plate_data, plate_specs, plate_copy in zip(readout_data, specs, plate_copies):
+            for data_tag, (offset, shape, dtype) in plate_specs.items():
+                np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)[...] = plate_data[data_tag]
+            # Data that cannot be shared (e.g. object arrays) is pickled with the plate copy.
+            plate_copy.readout.data = {data_tag: data for data_tag, data in plate_data.items()
+                                       if data_tag not in plate_specs}
+
+        new_data = map_ordered(preprocess_shared_plate,
+                               [{"i_plate": plate_copy, "methodname": methodname, "kwargs": kwargs,
+                                 "memory_name": memory.name, "specs": plate_specs}
+                                for plate_copy, plate_specs in zip(plate_copies, specs)],
+                               executor=executor, max_workers=max_workers, labels=labels)
+    finally:
+        memory.close()
+        memory.unlink()
+
+    for i_plate, plate_data in zip(plates, new_data):
+        for data_tag, data in plate_data.items():
+            i_plate.readout.add_data(data={data_tag: data}, tag=data_tag)
+
+
+def preprocess_shared_plate(i_plate, methodname, kwargs, memory_name, specs):
+    """ Preprocess `i_plate`, with the readouts of `specs` in the shared memory block `memory_name`.
+
+    Returns:
+        dict of np.ndarray: The readout data added or replaced by the method, per data tag.
+    """
+
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        shared_data = {}
+        for data_tag, (offset, shape, dtype) in specs.items():
+            shared_data[data_tag] = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+            shared_data[data_tag].flags.writeable = False
+        original_data = dict(i_plate.readout.data, **shared_data)
+        i_plate.readout.data = dict(original_data)
+
+        i_plate.preprocess(methodname, **kwargs)
+
+        new_data = {data_tag: np.array(data) for data_tag, data in i_plate.readout.data.items()
+                    if original_data.get(data_tag) is not data}
+    finally:
+        # The views on the shared memory need to be released before it is closed.
+        i_plate = original_data = shared_data = data = None
+        try:
+            memory.close()
+        except BufferError:
+            # Views are still referenced, e.g. by a traceback. The memory is released when the process exits.
+            LOG.debug("Could not close shared memory {}.".format(memory_name))
+    return new_data
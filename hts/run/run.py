@@ -9,6 +9,8 @@
 import collections
 import configobj
 import copy
+import functools
+import io
 import logging
 import numpy as np
 import os
@@ -17,13 +19,14 @@ import pickle
 import pandas as pd
 import scipy.stats
 
-from hts.data_tasks import data_tasks, gaussian_processes
+from hts.data_tasks import data_normalization, data_tasks, gaussian_processes
 from hts.plate_data.meta_data import MetaData
-from hts.run import run_io
+from hts.plate_data.parse_cache import ParseCache
+from hts.run import parallel, run_container, run_io
 from hts.run.constants import *
 from hts.plate import plate
-from hts.plate_data import plate_layout
-from hts.protocol import protocol
+from hts.plate_data import plate_data, plate_data_io, plate_layout, readout
+from hts.protocol import protocol, task_graph
 
 LOG = logging.getLogger(__name__)
 
@@ -32,44 +35,90 @@ KNOWN_DATA_TYPES = plate.KNOWN_DATA_TYPES
 
 ### Decorator
 
-def merged_replicates(f):
+# The undecorated mergers, and whether they aggregate per replicate (with `group_by`), or use the aggregate of all
+# replicates (e.g. rankings). By merger name.
+MERGERS = {}
+
+
+def merged_replicates(f=None, per_replicate=True):
     # Organize pandas dataframes a) grouped_by replicates b) with one row per replicate.
-    def inner(self, replicate_defining_column, *args, **kwargs):
+    # The calls are recorded by merger name, with their parameters, such that the aggregates can be updated for
+    # appended plates (see `Run.append_to_data_frame`).
+    if f is None:
+        return functools.partial(merged_replicates, per_replicate=per_replicate)
+    MERGERS[f.__name__] = (f, per_replicate)
 
-        # Groupby on data_frame with sample data only for replicates.
-        group_by = self.data_frame_samples.groupby(replicate_defining_column)
+    @functools.wraps(f)
+    def inner(self, replicate_defining_column, *args, **kwargs):
 
         if not hasattr(self, "_merged_data_frame"):
             self._merged_data_frame = {}
-        if not replicate_defining_column in self._merged_data_frame:
-            # Set up first aggregate. Add basic columns: [SAMPLE, SAMPLE_TYPE]
-            agg = {}
-            for column in [replicate_defining_column, SAMPLE, SAMPLE_TYPE]:
-                agg[column] = {column: lambda x: x.iloc[0]}
-            aggregate = group_by.agg(agg)
-            aggregate.columns = aggregate.columns.droplevel(0)
-            # aggregate[RUN_HUMAN] = self.name # <- This works if all runs are attached a name.
-            self._merged_data_frame[replicate_defining_column] = aggregate
-
-        aggregate_old = self._merged_data_frame[replicate_defining_column]
-
-        # Calculate on group_by and aggregate. Return another aggregate.
-        aggregator = {replicate_defining_column: {replicate_defining_column: lambda x: x.iloc[0]}}
-        aggregate_new = f(self=self,
-                          group_by=group_by,
-                          aggregate=aggregate_old,
-                          aggregator=aggregator, *args, **kwargs)
-
-        # Combine the two aggregate dataframes.
-        # Assume that we can merge on all columns that go by the same name.
-        common_column_names = list((set(aggregate_old.columns.values) & set(aggregate_new.columns.values)))
-        aggregate_merged = pd.merge(aggregate_old, aggregate_new, on=common_column_names)
+        if not hasattr(self, "_merger_calls"):
+            self._merger_calls = {}
+        self._merger_calls.setdefault(replicate_defining_column, []).append((f.__name__, args, kwargs))
+
+        aggregate_merged = merge_replicates(self, f, self.data_frame_samples, replicate_defining_column,
+                                            self._merged_data_frame.get(replicate_defining_column), *args, **kwargs)
         self._merged_data_frame[replicate_defining_column] = aggregate_merged
         return aggregate_merged
 
     return inner
 
 
+def aggregate_groups(group_by, aggregator):
+    """ Aggregate the groups of `group_by` with `aggregator`, a dict {column: {aggregate_column: method}}.
+
+    This is ``group_by.agg(aggregator)`` with a flat column index, as nested renaming is not supported by pandas >= 1.0.
+    The group keys are not kept as index, as they are aggregated as columns (e.g. the replicate defining column), and
+    aggregates are merged on their columns.
+
+    Returns:
+        pandas.DataFrame: One row per group, and one column per aggregate_column.
+    """
+
+    return group_by.agg(**{aggregate_column: (column, method) for column, methods in aggregator.items()
+                           for aggregate_column, method in methods.items()}).reset_index(drop=True)
+
+
+def merge_replicates(run, f, samples, replicate_defining_column, aggregate_old, *args, **kwargs):
+    """ Calculate `f` on the replicates in `samples`, and merge the result into the aggregate `aggregate_old`.
+
+    Args:
+        run (Run): The run.
+        f (function): The merger, e.g. ``Run.merger_add_data_from_data_frame`` (undecorated).
+        samples (pandas.DataFrame): The sample rows of the run data frame.
+        replicate_defining_column (str): The column that defines the replicates.
+        aggregate_old (pandas.DataFrame): The aggregate with one row per replicate. If None, it is set up.
+
+    Returns:
+        pandas.DataFrame: The merged aggregate.
+    """
+
+    # Groupby on data_frame with sample data only for replicates.
+    # Sample columns are categorical: only group by observed samples.
+    group_by = samples.groupby(replicate_defining_column, observed=True)
+
+    if aggregate_old is None:
+        # Set up first aggregate. Add basic columns: [SAMPLE, SAMPLE_TYPE]
+        agg = {}
+        for column in [replicate_defining_column, SAMPLE, SAMPLE_TYPE]:
+            agg[column] = {column: lambda x: x.iloc[0]}
+        aggregate_old = aggregate_groups(group_by, agg)
+        # aggregate[RUN_HUMAN] = self.name # <- This works if all runs are attached a name.
+
+    # Calculate on group_by and aggregate. Return another aggregate.
+    aggregator = {replicate_defining_column: {replicate_defining_column: lambda x: x.iloc[0]}}
+    aggregate_new = f(run,
+                      group_by=group_by,
+                      aggregate=aggregate_old,
+                      aggregator=aggregator, *args, **kwargs)
+
+    # Combine the two aggregate dataframes.
+    # Assume that we can merge on all columns that go by the same name.
+    common_column_names = list((set(aggregate_old.columns.values) & set(aggregate_new.columns.values)))
+    return pd.merge(aggregate_old, aggregate_new, on=common_column_names)
+
+
 ### Run class
 
 class Run:
@@ -156,15 +205,23 @@ class Run:
         Create ``Run`` instance.
 
         Args:
-            origin (str):  At current only "config" or "plates"
+            origin (str):  At current only "config", "envision", "csv", "pickle", "readout_store" or "container"
             format (str):  Format of the origin, at current not specified
             path (str): Path to input file or directory
 
             dir (Bool): True if all files in directory shall be read, else false.
+            plate_names (list of str): For "container" only: load only these plates.
+            readout_tags (list of str): For "container" only: load only these readout data tags.
 
         .. todo:: Write checks for ``format`` and ``path``.
         """
 
+        if origin == 'readout_store':
+            # The store is a directory.
+            return run_io.read_readout_store(path, **kwargs)
+        if origin == 'container':
+            return run_container.read(path, **kwargs)
+
         if dir == True:
             if os.path.isdir(path):
                 file = os.listdir(path)
@@ -191,7 +248,8 @@ class Run:
                              "cls.create()".format(origin, format))
 
     @classmethod
-    def create_from_config(cls, path, file, reload=True):
+    def create_from_config(cls, path, file, reload=True, lazy=False, cache_size=None, executor="serial",
+                           max_workers=None, parse_cache=None, parse_cache_size=None):
         """ Read config and use data to create `Run` instance.
 
         Read config and use data to create `Run` instance.
@@ -200,6 +258,94 @@ class Run:
             path (str): Path to input configobj file
             file (str): Filename of configobj file
             force (boolean): If not force and the run instance exists as a pickle, reload the pickle instead of reloading the data.
+            lazy (bool): If True, readout files are only parsed when a plate's readout data is first accessed.
+            cache_size (int): For lazy runs, the maximum number of parsed plate readouts held in memory. The least
+                              recently used are evicted, and reparsed on demand. Data added to evicted readouts
+                              (e.g. by preprocessing) is kept on disk (see `readout.ReadoutCache`). If None, nothing
+                              is evicted.
+            executor (str): How plates are created from their files: "serial", "thread" (e.g. for slow file
+                            systems) or "process" (e.g. for CPU bound parsing). See `parallel.map_ordered`.
+                            Plate order is always that of plate_names. Lazy runs are created serially. The first
+                            plate that fails is raised, with its original exception.
+            max_workers (int): The maximum number of threads or processes.
+            parse_cache (str): Path to a parse cache directory. If set, unchanged data files (e.g. Envision, insulin,
+                               csv and excel files) are not parsed again, but retrieved from the cache.
+            parse_cache_size (int): The maximum size of the parse cache in bytes. If None, nothing is evicted.
+        """
+
+        if parse_cache is not None:
+            parse_cache = ParseCache(parse_cache, max_size=parse_cache_size)
+
+        config = cls.read_config(path, file)
+
+        if reload==False and "write" in config and "pickle_path" in config["write"] and os.path.isfile(config["write"]["pickle_path"]):
+            my_run = cls.create(origin='pickle', path=config["write"]["pickle_path"])
+            my_run.is_created_from_pickle = True
+            return my_run
+
+        plate_names = config["plate_names"]
+        # Workbooks with one sheet per plate are opened only once for all plates of this run.
+        workbook_cache = plate_data_io.WorkbookCache()
+        config_plate_wise, additional_data, plates = cls.get_plate_configs(config, parse_cache=parse_cache,
+                                                                           workbook_cache=workbook_cache)
+
+        if not plates:
+            # plate.Plate.create expects: formats, paths, configs = None, names=None, tags=None
+            readout_cache = None
+            dimensions = {}
+            if lazy:
+                readout_cache = readout.ReadoutCache(max_size=cache_size)
+                if "plate_layout" in additional_data:
+                    dimensions = {"height": additional_data["plate_layout"].height,
+                                  "width": additional_data["plate_layout"].width}
+            if lazy:
+                plates = []
+                for config_plate, plate_name in zip(config_plate_wise, plate_names):
+                    plates.append(plate.Plate.create(format="config", name=plate_name, readout_cache=readout_cache,
+                                                     **dimensions, **config_plate))
+                    if not dimensions:
+                        # Parse at most one plate for the dimensions of all plates.
+                        dimensions = {"height": plates[0].height, "width": plates[0].width}
+            else:
+                if executor == "process":
+                    # Worker processes do not share the workbook cache: each workbook with one sheet per plate is
+                    # read once here, and each plate is sent only its sheets.
+                    config_plate_wise = [cls.get_plate_config_with_sheets(config_plate, workbook_cache)
+                                         for config_plate in config_plate_wise]
+                labels = ["Plate {} ({})".format(plate_name, ", ".join(str(i_path) for data_type in config_plate.values()
+                                                                       for i_path in data_type["paths"]))
+                          for config_plate, plate_name in zip(config_plate_wise, plate_names)]
+                plates = parallel.map_ordered(plate.Plate.create,
+                                              [dict(format="config", name=plate_name, **config_plate)
+                                               for config_plate, plate_name in zip(config_plate_wise, plate_names)],
+                                              executor=executor, max_workers=max_workers, labels=labels)
+            # Release the workbooks. Lazy readouts parsed later on open their workbooks without holding them.
+            workbook_cache.close()
+        for data_type, data in additional_data.items():
+            for i_plate in plates:
+                i_plate.add_data(data_type, data, force=True)
+
+        # Data: may be all in one file (csv .xlxs), or in separated .csv files (default case, e.g. .csv)
+        # Data: In particular for readouts, there may be several sets of data (e.g. Readouts for different points in time.)
+
+        # if len(data_types_plate_wise) == 0:
+        #    raise Exception("No plate wise information was defined in Run config.")
+
+
+        # Check if the number of files is equal for all data_types_plate_wise:
+
+        return Run(path=os.path.join(path, file), plates=plates, **config)
+
+    @classmethod
+    def read_config(cls, path, file):
+        """ Read a run config. If base_path is defined, it is added to all paths.
+
+        Args:
+            path (str): Path to input configobj file
+            file (str): Filename of configobj file
+
+        Returns:
+            configobj.ConfigObj
         """
 
         config = configobj.ConfigObj(os.path.join(path, file), stringify=True)
@@ -219,11 +365,24 @@ class Run:
 
             walk_configobj_and_add_basepath(config)
 
+        return config
 
-        if reload==False and "write" in config and "pickle_path" in config["write"] and os.path.isfile(config["write"]["pickle_path"]):
-            my_run = cls.create(origin='pickle', path=config["write"]["pickle_path"])
-            my_run.is_created_from_pickle = True
-            return my_run
+    @classmethod
+    def get_plate_configs(cls, config, parse_cache=None, workbook_cache=None):
+        """ Map a run config to the keyword arguments of `Plate.create` for each plate.
+
+        Args:
+            config (configobj.ConfigObj): The run config, see `read_config`.
+            parse_cache (ParseCache): If not None, passed on to the file parsers.
+            workbook_cache (plate_data_io.WorkbookCache): If not None, passed on to the parsers of excel files with
+                                                          one sheet per plate.
+
+        Returns:
+            config_plate_wise (list of dict): Per plate (in the order of plate_names), the configs per data type.
+            additional_data (dict of PlateData): The data shared by all plates, per data type (e.g. a plate layout).
+            plates (list of Plate): If all plates are read from one csv file with one well per row, the plates. Else,
+                                    None.
+        """
 
         plate_names = config["plate_names"]
         n_plate = len(plate_names)
@@ -244,6 +403,10 @@ class Run:
                 l_format = []
                 for local_set, config_set in config_local.items():
                     config_set, paths, tags = cls.map_config_file_definition(config_set, n_plate=n_plate)
+                    if parse_cache is not None:
+                        config_set["parse_cache"] = parse_cache
+                    if workbook_cache is not None and config_set["format"] == "excel_multiple_plates_per_file":
+                        config_set["workbook_cache"] = workbook_cache
                     l_config_set.append(config_set)
                     l_paths.append(paths)
                     l_tags.append(tags)
@@ -272,6 +435,10 @@ class Run:
                 # Only a single file for each plate is defined.
                 config_local, paths, tags = cls.map_config_file_definition(config_local, n_plate=n_plate)
                 format = config_local.pop("format")
+                if parse_cache is not None and format != "csv_one_well_per_row":
+                    config_local["parse_cache"] = parse_cache
+                if workbook_cache is not None and format == "excel_multiple_plates_per_file":
+                    config_local["workbook_cache"] = workbook_cache
                 if len(paths) == 1 and n_plate != 1:
                     if data_type == "plate_layout":
                         data = plate_layout.PlateLayout.create(paths=paths, formats=[format], **config_local)
@@ -289,24 +456,31 @@ class Run:
                         config_plate_wise[i_plate][data_type] = copy.deepcopy(
                             config_local)  # For current shallow dicts, config_local.copy() is ok.
 
-        if not plates:
-            # plate.Plate.create expects: formats, paths, configs = None, names=None, tags=None
-            plates = [plate.Plate.create(format="config", name=plate_name, **config_plate) for config_plate, plate_name
-                      in zip(config_plate_wise, plate_names)]
-        for data_type, data in additional_data.items():
-            for i_plate in plates:
-                i_plate.add_data(data_type, data, force=True)
-
-        # Data: may be all in one file (csv .xlxs), or in separated .csv files (default case, e.g. .csv)
-        # Data: In particular for readouts, there may be several sets of data (e.g. Readouts for different points in time.)
-
-        # if len(data_types_plate_wise) == 0:
-        #    raise Exception("No plate wise information was defined in Run config.")
+        return config_plate_wise, additional_data, plates
 
+    @classmethod
+    def get_plate_config_with_sheets(cls, config_plate, workbook_cache):
+        """ Replace the workbook cache in the plate config `config_plate` (see `get_plate_configs`) by a cache with
+        only the sheets of the plate, read once per workbook with `workbook_cache`.
 
-        # Check if the number of files is equal for all data_types_plate_wise:
+        Returns:
+            dict: A copy of `config_plate`.
+        """
 
-        return Run(path=os.path.join(path, file), plates=plates, **config)
+        def with_sheets(config, sheet):
+            if "workbook_cache" not in config:
+                return config
+            workbook_cache.read_sheets(config["file"])
+            return dict(config, workbook_cache=workbook_cache.get_subset(config["file"], [sheet]))
+
+        config_plate = dict(config_plate)
+        for data_type, config in config_plate.items():
+            if "configs" in config:
+                config_plate[data_type] = dict(config, configs=[with_sheets(i, sheet) for i, sheet in
+                                                                zip(config["configs"], config["paths"])])
+            else:
+                config_plate[data_type] = with_sheets(config, config["paths"][0])
+        return config_plate
 
     @classmethod
     def map_config_file_definition(cls, config, n_plate):
@@ -390,23 +564,249 @@ class Run:
             list of floats
         """
 
+        # Readout values filtered on coded plate layout data are selected run-wide on the stacked view.
+        condition_data_type = kwargs.get("condition_data_type")
+        if kwargs.get("value_data_type") == "readout" and not kwargs.get("value_type") \
+                and (condition_data_type is None or (condition_data_type == "plate_layout" and
+                                                     kwargs.get("condition_data_tag") in plate_layout.CODED_DATA_TAGS)):
+            values = self.get_readout_stack(kwargs["value_data_tag"])
+            if condition_data_type:
+                mask = self.get_layout_mask(data_tag=kwargs["condition_data_tag"], condition=kwargs.get("condition"))
+                if kwargs.get("return_list", True):
+                    return [plate_values[plate_mask].tolist() for plate_values, plate_mask in zip(values, mask)]
+                return list(np.where(mask, values, np.nan))
+            if kwargs.get("return_list", True):
+                return [plate_values.ravel().tolist() for plate_values in values]
+            return list(values)
+
         data = [plate.filter(**kwargs) for plate in self.plates.values()]
         # return [item for sublist in data for item in sublist]
         return data
 
-    def preprocess(self):
+
+    def get_readout_stack(self, data_tag):
+        """ Get the readout tagged with `data_tag` of all plates, stacked into one array.
+
+        Args:
+            data_tag (str): The readout data tag.
+
+        Returns:
+            np.ndarray (n_plates x height x width): The readouts, in the order of self.plates.
+        """
+
+        return np.stack([plate.readout.get_data(data_tag) for plate in self.plates.values()])
+
+
+    def add_readout_stack(self, data, tag=None):
+        """ Add stacked readouts to all plates.
+
+        The readout of each plate is a view on the respective slice of the stack.
+
+        Args:
+            data (dict of np.ndarray): The stacked readouts (n_plates x height x width), per data tag.
+            tag (str): The tag of the readouts.
+        """
+
+        for data_tag, stack in data.items():
+            if stack.shape != (len(self.plates), self.height, self.width):
+                raise ValueError("Shape of data_tag {}: {} differs from the run shape: {}"
+                                 "".format(data_tag, stack.shape, (len(self.plates), self.height, self.width)))
+
+        for i_plate, plate in enumerate(self.plates.values()):
+            plate.readout.add_data(data={data_tag: stack[i_plate] for data_tag, stack in data.items()}, tag=tag)
+
+
+    def get_layout_stack(self, data_tag="layout"):
+        """ Get the plate layout codes of all plates, stacked into one array, with a run-wide vocabulary.
+
+        Plates sharing a ``PlateLayout`` instance are encoded only once.
+
+        Args:
+            data_tag (str): One of plate_layout.CODED_DATA_TAGS.
+
+        Returns:
+            codes (np.ndarray of unsigned int): The codes (n_plates x height x width), in the order of self.plates.
+            vocabulary (np.ndarray): The labels, such that vocabulary[codes] are the plate layouts.
+        """
+
+        layouts = {id(plate.plate_layout): plate.plate_layout for plate in self.plates.values()}
+        vocabulary = np.unique(np.concatenate([layout.vocabulary[data_tag] for layout in layouts.values()]))
+        # Map the codes of each layout to the run-wide vocabulary.
+        codes = {layout_id: plate_layout.compact_codes(np.searchsorted(vocabulary, layout.vocabulary[data_tag]),
+                                                       len(vocabulary))[layout.codes[data_tag]]
+                 for layout_id, layout in layouts.items()}
+
+        return np.stack([codes[id(plate.plate_layout)] for plate in self.plates.values()]), vocabulary.astype(object)
+
+
+    def get_layout_mask(self, data_tag, condition=None):
+        """ Get a boolean mask of the wells of all plates for which the plate layout conforms to `condition`.
+
+        Args:
+            data_tag (str): One of plate_layout.CODED_DATA_TAGS.
+            condition (dict or method): See `plate_data.evaluate_condition`.
+
+        Returns:
+            np.ndarray of bool (n_plates x height x width)
+        """
+
+        codes, vocabulary = self.get_layout_stack(data_tag=data_tag)
+        return plate_data.evaluate_condition(vocabulary, condition)[codes]
+
+
+    def preprocess(self, plates=None, batched=True, executor=None, max_workers=None):
         """ Perform data preprocessing.
 
-        Perform data preprocessing.
+        Perform data preprocessing. Methods with a batched implementation (see `data_normalization.is_batched`) are
+        performed on all plates at once, all others (including the Gaussian process normalization) plate by plate,
+        optionally concurrently (see `parallel.preprocess_plates`).
 
+        Args:
+            plates (list of Plate): The plates to preprocess. If None, all plates are preprocessed.
+            batched (bool): If False, all methods are performed plate by plate.
+            executor (str): One of parallel.EXECUTORS, for methods performed plate by plate. If None, the "executor"
+                            of the task config, or "serial".
+            max_workers (int): The maximum number of threads or processes. If None, the "max_workers" of the task
+                               config, or the concurrent.futures default.
         """
         tasks = self.protocol().get_tasks_by_tag("preprocessing")
         for task in tasks:
-            for i_plate in self.plates.values():
-                i_plate.preprocess(task.method, **task.config)
+            self.perform_preprocessing_task(task, plates=plates, batched=batched, executor=executor,
+                                            max_workers=max_workers)
         else:
             LOG.info("No preprocessing tasks defined in protocol: {}".format(self.protocol().name))
 
+    def perform_preprocessing_task(self, task, plates=None, batched=True, executor=None, max_workers=None):
+        """ Perform one preprocessing task of the protocol. See `preprocess`.
+
+        Args:
+            task (protocol.ProtocolTask): The task.
+            plates (list of Plate): The plates to preprocess. If None, all plates are preprocessed.
+            batched (bool): If False, the method is performed plate by plate.
+            executor (str): One of parallel.EXECUTORS, for methods performed plate by plate.
+            max_workers (int): The maximum number of threads or processes.
+        """
+        if plates is None:
+            plates = list(self.plates.values())
+        config = dict(task.config)
+        task_executor = config.pop("executor", "serial")
+        task_max_workers = config.pop("max_workers", None)
+        if data_normalization.is_batched(task.method, config) and (batched or not hasattr(plate.Plate, task.method)):
+            data_normalization.BATCHED_PREPROCESSING[task.method](self, plates=plates, **config)
+            return
+        parallel.preprocess_plates(plates, task.method, config,
+                                   executor=executor if executor is not None else task_executor,
+                                   max_workers=max_workers if max_workers is not None else task_max_workers)
+
+    def append_plates(self, plates):
+        """ Append newly acquired plates to the run.
+
+        Only the new plates are preprocessed (if a protocol is attached). The data frame and the replicate aggregates,
+        if already calculated, are updated incrementally: only the wells of the new plates are serialized, and only
+        the replicates with samples on the new plates are aggregated again.
+
+        Aggregates are updated by replaying the merger calls that created them. These calls are recorded in memory,
+        and not stored in run containers, as neither are the aggregates: for a run read from a container, the
+        aggregates are calculated (and their merger calls recorded) anew. If an aggregate has no recorded merger
+        calls, it cannot be updated, and a ValueError is raised before any plate is appended.
+
+        Args:
+            plates (list of Plate): The new plates, with the height and width of the run.
+        """
+
+        plates = list(plates)
+        if len(plates) == 0:
+            return
+        merger_calls = getattr(self, "_merger_calls", {})
+        missing_merger_calls = [i for i in getattr(self, "_merged_data_frame", {}) if not merger_calls.get(i)]
+        if hasattr(self, "_data_frame") and missing_merger_calls:
+            raise ValueError("The aggregates for {} cannot be updated for the new plates: their merger calls are not "
+                             "recorded. Delete these aggregates, and recalculate them after appending the plates."
+                             "".format(missing_merger_calls))
+        for i_plate in plates:
+            if i_plate.name in self.plates:
+                raise ValueError("Plate {} is already in the run.".format(i_plate.name))
+            if len(self.plates) > 0 and (i_plate.height, i_plate.width) != (self.height, self.width):
+                raise ValueError("Plate {} has shape {}, not {}.".format(i_plate.name, (i_plate.height, i_plate.width),
+                                                                         (self.height, self.width)))
+        if len(plates) != len(set(i_plate.name for i_plate in plates)):
+            raise ValueError("The plate names are not unique: {}".format([i_plate.name for i_plate in plates]))
+
+        n_plates = len(self.plates)
+        if n_plates == 0:
+            self.height, self.width = plates[0].height, plates[0].width
+        for i_plate in plates:
+            self.plates[i_plate.name] = i_plate
+
+        if self.protocol():
+            self.preprocess(plates=plates)
+
+        if hasattr(self, "_data_frame"):
+            self.append_to_data_frame(plates, plate_index_offset=n_plates)
+
+
+    def append_to_data_frame(self, plates, plate_index_offset):
+        """ Append the wells of `plates` to the data frame, and update the replicate aggregates.
+
+        If the data frame has columns that are not serialized for `plates` (e.g. merged meta data), the data frame and
+        aggregates are reset instead, and recalculated on their next use.
+
+        Args:
+            plates (list of Plate): The plates that were appended to the run.
+            plate_index_offset (int): The index of the first plate of `plates` in the run.
+        """
+
+        readouts, meta_data = run_io.get_serialized_data_tags(self)
+        new_rows = run_io.serialize_as_pandas(plates, readouts=readouts, meta_data=meta_data,
+                                              plate_index_offset=plate_index_offset)
+        if list(new_rows.columns) != list(self._data_frame.columns):
+            LOG.info("The data frame columns differ from the serialized plates. Reset the data frame.")
+            self.reset_data_frame()
+            return
+
+        self._data_frame = run_io.append_data_frame(self._data_frame, new_rows)
+        if hasattr(self, "_data_frame_samples"):
+            del self._data_frame_samples
+
+        if not hasattr(self, "_merged_data_frame"):
+            return
+        new_samples = new_rows[new_rows[SAMPLE_TYPE] == "s"]
+        for replicate_defining_column, aggregate_old in list(self._merged_data_frame.items()):
+            # The merger calls are recorded for all aggregates, as checked in `append_plates`.
+            calls = self._merger_calls[replicate_defining_column]
+            # Aggregate the replicates with samples on the new plates again, including their wells on the old plates.
+            replicates = new_samples[replicate_defining_column].unique()
+            samples = self.data_frame_samples[self.data_frame_samples[replicate_defining_column].isin(replicates)]
+            aggregate = None
+            for name, args, kwargs in calls:
+                merger, per_replicate = MERGERS[name]
+                if per_replicate:
+                    aggregate = merge_replicates(self, merger, samples, replicate_defining_column, aggregate,
+                                                 *args, **kwargs)
+            categorical_dtypes = {column: dtype for column, dtype in aggregate.dtypes.items()
+                                  if isinstance(dtype, pd.CategoricalDtype)}
+            # The categories of the new aggregate include the samples of the new plates.
+            aggregate = pd.concat([aggregate_old[~aggregate_old[replicate_defining_column].isin(replicates)],
+                                   aggregate], ignore_index=True).astype(categorical_dtypes)
+            # Mergers that use the aggregate of all replicates (e.g. rankings) are calculated on all replicates.
+            for name, args, kwargs in calls:
+                merger, per_replicate = MERGERS[name]
+                if not per_replicate:
+                    aggregate = merge_replicates(self, merger, self.data_frame_samples, replicate_defining_column,
+                                                 aggregate, *args, **kwargs)
+            self._merged_data_frame[replicate_defining_column] = aggregate.sort_values(
+                replicate_defining_column).reset_index(drop=True)
+
+
+    def reset_data_frame(self):
+        """ Delete the data frame and the replicate aggregates, such that they are recalculated on their next use.
+        """
+
+        for attribute in ["_data_frame", "_data_frame_samples", "_merged_data_frame", "_merger_calls"]:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+
+
     def get_run_config_data(self):
         """
             Extract relevant meta data for qc and analysis reports.
@@ -447,27 +847,38 @@ class Run:
         result = {}
         tasks = self.protocol().get_tasks_by_tag(type)
         for task in tasks:
-            LOG.info(task.name)
-            LOG.info(task.type)
-            methods_from_protocol = collections.OrderedDict(
-                [(i, j) for i, j in task.config.items() if isinstance(j, configobj.Section)])
-            config_data_from_protocol = collections.OrderedDict(
-                [(i, j) for i, j in task.config.items() if not isinstance(j, configobj.Section)])
-            # This will work Python 3.5 onwards: return {**config_data_from_protocol, **self.config_data[task.name]}
-            if task.name in self.config_data:
-                config_data = dict(config_data_from_protocol, **self.config_data[task.name])
-            else:
-                config_data = config_data_from_protocol
-            result[task.name] = data_tasks.perform_task(run=self,
-                                                        task_name=task.method,
-                                                        methods=methods_from_protocol,
-                                                        force=force,
-                                                        #config_data=self.get_run_config_data(), # <- Perhaps this is necessary for QC or other methods?
-                                                        **config_data)
+            result[task.name] = self.perform_task(task, force=force)
 
         setattr(self, type_attribute, result)
         return result
 
+    def perform_task(self, task, force=True):
+        """ Perform one task of the protocol, e.g. a qc or analysis task. See `do_task`.
+
+        The task config of the protocol is updated with the run config data of the task (if any).
+
+        Returns:
+            The result of the task.
+        """
+
+        LOG.info(task.name)
+        LOG.info(task.type)
+        methods_from_protocol = collections.OrderedDict(
+            [(i, j) for i, j in task.config.items() if isinstance(j, configobj.Section)])
+        config_data_from_protocol = collections.OrderedDict(
+            [(i, j) for i, j in task.config.items() if not isinstance(j, configobj.Section)])
+        # This will work Python 3.5 onwards: return {**config_data_from_protocol, **self.config_data[task.name]}
+        if task.name in self.config_data:
+            config_data = dict(config_data_from_protocol, **self.config_data[task.name])
+        else:
+            config_data = config_data_from_protocol
+        return data_tasks.perform_task(run=self,
+                                       task_name=task.method,
+                                       methods=methods_from_protocol,
+                                       force=force,
+                                       #config_data=self.get_run_config_data(), # <- Perhaps this is necessary for QC or other methods?
+                                       **config_data)
+
     def qc(self, **kwargs):
         """ Perform quality control and save the results
         """
@@ -488,6 +899,47 @@ class Run:
         analysis = self.do_task(type="analysis", **kwargs)
         return analysis
 
+    def run_protocol(self, types=("preprocessing", "qc", "analysis"), executor="serial", max_workers=None,
+                     force=False):
+        """ Perform the protocol tasks of `types` as a dependency graph, see `task_graph.TaskGraph`.
+
+        Tasks are ordered by the readout data tags they read and write, rather than by file order, and independent
+        thread-safe tasks may be performed concurrently. Tasks whose method, config and input readouts are unchanged
+        since they were last performed on this run are skipped, e.g. when the protocol is run again after a qc task was
+        edited.
+
+        Args:
+            types (list of str): The task types (of protocol.KNOWN_TASK_TYPES) to perform.
+            executor (str): "serial", or "thread" to perform independent thread-safe tasks (numeric tasks declared in
+                            `task_graph.TASK_DATA`) in a thread pool. Plots and other tasks are performed serially.
+            max_workers (int): The maximum number of threads. If None, the concurrent.futures default.
+            force (bool): If True, all tasks are performed.
+
+        Returns:
+            dict: The results of all qc and analysis tasks, per task name.
+        """
+
+        tasks = [task for task in self.protocol().tasks if task.type in types]
+        readout_tags = set()
+        for i_plate in self.plates.values():
+            readout_tags.update(i_plate.readout.data.keys())
+        graph = task_graph.TaskGraph.create(tasks, readout_tags=readout_tags)
+
+        if not hasattr(self, "task_fingerprints"):
+            self.task_fingerprints = {}
+        if not hasattr(self, "task_results"):
+            self.task_results = {}
+
+        def perform_task(task):
+            if task.type == "preprocessing":
+                return self.perform_preprocessing_task(task)
+            return self.perform_task(task)
+
+        performed = graph.run(self, perform_task=perform_task, fingerprints=self.task_fingerprints,
+                              results=self.task_results, executor=executor, max_workers=max_workers, force=force)
+        LOG.info("Performed tasks: {}. Skipped {} unchanged tasks.".format(performed, len(tasks) - len(performed)))
+        return {task.name: self.task_results[task.name] for task in tasks if task.type != "preprocessing"}
+
     def protocol(self, path=None, format=None):
         """ Read protocol and attach to `Run` instance.
 
@@ -513,8 +965,12 @@ class Run:
         Serialize ``Run`` instance using the stated ``format``.
 
         Args:
-            format (str):  The output format: Currently only "pickle".
-            path (str): Path to output file
+            format (str):  The output format: "pickle", "readout_store" (a memory-mappable directory, see
+                           `run_io.write_readout_store`), "container" (a binary file for partial loading, see
+                           `run_container`), "csv", "csv_one_well_per_row" or "serialize_as_pandas".
+            path (str): Path to output file. For "csv" and "csv_one_well_per_row", paths ending with ".gz" are
+                        written gzip compressed.
+            compress (bool): For "container" only: If True, the arrays are deflate compressed.
 
         .. todo:: Write checks for ``format`` and ``path``.
         """
@@ -528,22 +984,31 @@ class Run:
             with open(path, 'wb') as fh:
                 pickle.dump(self, fh)
             return
-        elif format == 'csv':
-            output = run_io.serialize_run_for_r(self)
-        elif format == 'csv_one_well_per_row':
-            output = run_io.serialize_as_csv_one_row_per_well(self, **kwargs)
+        elif format == 'readout_store':
+            run_io.write_readout_store(self, path=path)
+            return
+        elif format == 'container':
+            run_container.write(self, path=path, **kwargs)
+            return
+        elif format in ['csv', 'csv_one_well_per_row']:
+            # Written plate by plate, directly to the file (gzip compressed for paths ending with ".gz").
+            if format == 'csv':
+                writer = run_io.write_run_for_r
+            else:
+                writer = run_io.write_csv_one_row_per_well
+            if path:
+                with run_io.open_output(path) as fh:
+                    writer(self, fh, **kwargs)
+            if return_string:
+                s = io.StringIO()
+                writer(self, s, **kwargs)
+                return s.getvalue()
         elif format == 'serialize_as_pandas':
             output = run_io.serialize_as_pandas(self, **kwargs)
             return output
         else:
             raise Exception('Format is unknown: {}'.format(format))
 
-        if path:
-            with open(path, 'w') as fh:
-                fh.write(output)
-        if return_string:
-            return output
-
     ###### Handle Run data as a pandas.data_frame:
     ## - less or no emphasis on plate_layout structure
     ## - calculations that are oblivous of plate_layout may want to go here.
@@ -624,9 +1089,7 @@ class Run:
         for column in columns:
             aggregator[column] = {column: lambda x: x.iloc[0]}
         # Calculate for every group.
-        aggregated_dataframe = group_by.agg(aggregator)
-        aggregated_dataframe.columns = aggregated_dataframe.columns.droplevel(0)
-        return aggregated_dataframe
+        return aggregate_groups(group_by, aggregator)
 
     @merged_replicates
     def merger_summarize_statistical_significance(self, group_by, aggregator,
@@ -675,15 +1138,14 @@ class Run:
 
         # Execute all aggregation methods at once for every aggregate (group).
         try:
-            aggregated_dataframe = group_by.agg(aggregator)
+            aggregated_dataframe = aggregate_groups(group_by, aggregator)
         except:
             logging.error("What goes wrong here?. Columns in readout: {}".format(self.data_frame.columns))
             raise Exception
 
-        aggregated_dataframe.columns = aggregated_dataframe.columns.droplevel(0)
         return aggregated_dataframe
 
-    @merged_replicates
+    @merged_replicates(per_replicate=False)
     def merger_rank_samples(self, aggregate,
                             ranking_column, rank_column_name, rank_threshold, is_hit_by_rank_column_name,
                             value_threshold, is_hit_by_value_column_name, is_one_sided=True, **kwargs):
@@ -0,0 +1,374 @@
+# (C) 2016 Elke Schaper
+
+"""
+    :synopsis: A compact, versioned binary container for ``Run`` instances.
+
+    A container is a single zip file with a small json header, and one .npy member per array (e.g. per readout data
+    tag and plate, or per plate layout code matrix). The header holds the plate names, the plate data classes, and all
+    other (json compatible) attributes, and maps each array to its member. Hence, a subset of the plates, or of the
+    readout data tags, is loaded without reading the rest of the file. Contrary to pickles, containers do not depend
+    on the class definitions at the time of writing: arrays of strings are stored as fixed size unicode arrays, and
+    arrays of mixed python objects (e.g. strings, numbers and None) as json members. Nothing is unpickled on reading,
+    such that containers from untrusted sources are safe to open (except for pickled arrays of format version 1
+    containers, which are only read on request).
+
+    The run's protocol is stored with its tasks. Derived data is not stored: the run's data frames (including the
+    replicate aggregates, and the merger calls recorded to update them for appended plates), Gaussian process models,
+    and the inverted indices of plate layouts (rebuilt on first use).
+
+    .. moduleauthor:: Elke Schaper <elke.schaper@sib.swiss>
+"""
+
+import collections
+import importlib
+import json
+import logging
+import numpy as np
+import zipfile
+
+import configobj
+
+from hts.plate import plate
+from hts.plate_data import plate_data, plate_layout, readout
+from hts.protocol import protocol
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+# Version 1 containers store arrays of mixed python objects as pickles.
+READABLE_FORMAT_VERSIONS = [1, 2]
+HEADER_MEMBER = "header.json"
+ARRAY_MEMBER = "arrays/{}.npy"
+OBJECT_ARRAY_MEMBER = "arrays/{}.json"
+# Run attributes that are stored, besides the protocol. All other attributes (e.g. data frames and Gaussian process
+# models) are derived.
+RUN_ATTRIBUTES = ["path", "width", "height", "config_data"]
+# Derived attributes of plates and plate data, per class, that are rebuilt on first use.
+DERIVED_ATTRIBUTES = {plate.Plate: ["statistics_cache"], plate_layout.PlateLayout: ["index", "version"]}
+JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def numpy_scalar_to_json(value):
+    """ Convert numpy scalars (e.g. in object arrays) for ``json.dumps``.
+    """
+
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("{} of type {} is not json compatible.".format(value, type(value)))
+
+
+class _Writer:
+
+    """ ``_Writer`` encodes values as json compatible header nodes, and writes their arrays as zip members.
+    """
+
+    def __init__(self, zip_file):
+
+        self.zip_file = zip_file
+        self.n_arrays = 0
+
+
+    def write_array(self, array, label):
+
+        node = {}
+        if array.dtype.kind == "O":
+            if all(isinstance(i, str) for i in array.flat):
+                # Strings are stored natively, and restored as object arrays.
+                node["object"] = "str"
+                array = array.astype(str) if array.size > 0 else array.astype("U1")
+            else:
+                # Mixed python objects (e.g. strings, numbers and None) are stored as json.
+                try:
+                    content = json.dumps({"shape": array.shape, "values": array.ravel().tolist()},
+                                         default=numpy_scalar_to_json)
+                except TypeError as e:
+                    LOG.warning("Skip {}: the array values are not json compatible: {}".format(label, e))
+                    return None
+                node["object"] = "json"
+                node["array"] = OBJECT_ARRAY_MEMBER.format(self.n_arrays)
+                self.n_arrays += 1
+                self.zip_file.writestr(node["array"], content)
+                return node
+
+        node["array"] = ARRAY_MEMBER.format(self.n_arrays)
+        self.n_arrays += 1
+        with self.zip_file.open(node["array"], "w", force_zip64=True) as fh:
+            np.lib.format.write_array(fh, np.asanyarray(array), allow_pickle=False)
+        return node
+
+
+    def encode(self, value, label):
+        """ Encode `value` as a json compatible header node. Values that cannot be encoded are skipped (None).
+
+        Args:
+            value: The value, e.g. a numpy array or a dict of numpy arrays.
+            label (str): Description of value for warnings, e.g. "plate p1 readout attribute data".
+        """
+
+        if isinstance(value, np.ndarray):
+            return self.write_array(value, label)
+        elif isinstance(value, np.generic):
+            return {"value": value.item()}
+        elif isinstance(value, JSON_SCALARS):
+            if isinstance(value, float) and not np.isfinite(value):
+                return {"float": repr(value)}
+            return {"value": value}
+        elif isinstance(value, dict):
+            items = []
+            for key, item in value.items():
+                if isinstance(key, np.generic):
+                    key = key.item()
+                if not isinstance(key, JSON_SCALARS) or isinstance(key, float):
+                    LOG.warning("Skip {}: key {} is not supported.".format(label, key))
+                    continue
+                node = self.encode(item, "{}[{}]".format(label, key))
+                if node is not None:
+                    items.append([key, node])
+            return {"dict": items}
+        elif isinstance(value, (list, tuple)):
+            nodes = [self.encode(item, "{}[{}]".format(label, i)) for i, item in enumerate(value)]
+            if any(node is None for node in nodes):
+                return None
+            return {"list" if isinstance(value, list) else "tuple": nodes}
+        LOG.warning("Skip {}: type {} is not supported.".format(label, type(value)))
+        return None
+
+
+    def encode_attributes(self, attributes, label, skip=()):
+
+        return {key: node for key, node in ((key, self.encode(value, "{} attribute {}".format(label, key)))
+                                            for key, value in attributes.items() if key not in skip)
+                if node is not None}
+
+
+class _Reader:
+
+    """ ``_Reader`` decodes header nodes, and reads their arrays from the zip members.
+
+    Attributes:
+        allow_pickle (bool): If True, pickled arrays (of format version 1 containers) are read.
+    """
+
+    def __init__(self, zip_file, allow_pickle=False):
+
+        self.zip_file = zip_file
+        self.allow_pickle = allow_pickle
+
+
+    def read_array(self, node):
+
+        if node.get("object") == "json":
+            content = json.loads(self.zip_file.read(node["array"]).decode())
+            array = np.empty(len(content["values"]), dtype=object)
+            array[:] = content["values"]
+            return array.reshape(content["shape"])
+        if node.get("object") == "pickle" and not self.allow_pickle:
+            raise ValueError("The container member {} is pickled, and unpickling may execute arbitrary code. Only "
+                             "if the container is trusted, read it with allow_pickle=True.".format(node["array"]))
+        with self.zip_file.open(node["array"]) as fh:
+            array = np.lib.format.read_array(fh, allow_pickle=node.get("object") == "pickle")
+        if node.get("object") == "str":
+            array = array.astype(object)
+        return array
+
+
+    def decode(self, node):
+
+        if "array" in node:
+            return self.read_array(node)
+        elif "value" in node:
+            return node["value"]
+        elif "float" in node:
+            return float(node["float"])
+        elif "dict" in node:
+            return {key: self.decode(item) for key, item in node["dict"]}
+        elif "list" in node:
+            return [self.decode(item) for item in node["list"]]
+        elif "tuple" in node:
+            return tuple(self.decode(item) for item in node["tuple"])
+        raise ValueError("Unknown container node: {}".format(node))
+
+
+def write(run, path, compress=False):
+    """ Write `run` as container to `path`.
+
+    Plate data that is shared by several plates (e.g. a plate layout for all plates) is stored once.
+
+    Args:
+        run (Run): A ``Run`` instance.
+        path (str): Path to the container file.
+        compress (bool): If True, members are deflate compressed. This results in smaller files, but slower loading.
+    """
+
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path, "w", compression=compression, allowZip64=True) as zip_file:
+        writer = _Writer(zip_file)
+        header = {"format_version": FORMAT_VERSION,
+                  "run": writer.encode_attributes({key: getattr(run, key) for key in RUN_ATTRIBUTES
+                                                   if hasattr(run, key)}, label="run"),
+                  "plate_data": [],
+                  "plates": []}
+
+        plate_data_positions = {}
+        for plate_name, i_plate in run.plates.items():
+            attributes = {}
+            data = {}
+            for key, value in i_plate.__dict__.items():
+                if isinstance(value, plate_data.PlateData):
+                    if id(value) not in plate_data_positions:
+                        plate_data_positions[id(value)] = len(header["plate_data"])
+                        header["plate_data"].append(encode_plate_data(writer, value,
+                                                                      label="plate {} {}".format(plate_name, key)))
+                    data[key] = plate_data_positions[id(value)]
+                else:
+                    attributes[key] = value
+            header["plates"].append({"name": plate_name,
+                                     "attributes": writer.encode_attributes(
+                                         attributes, label="plate {}".format(plate_name),
+                                         skip=DERIVED_ATTRIBUTES[plate.Plate]),
+                                     "plate_data": data})
+
+        if run.protocol() is not None:
+            header["protocol"] = encode_protocol(writer, run.protocol())
+
+        zip_file.writestr(HEADER_MEMBER, json.dumps(header))
+
+
+def encode_protocol(writer, run_protocol):
+    """ Encode the ``Protocol`` instance `run_protocol` as header node, including its tasks.
+    """
+
+    tasks = [{"name": task.name, "tags": task.tags, "type": task.type, "method": task.method,
+              "config": writer.encode(task.config, label="protocol task {} config".format(task.name))}
+             for task in run_protocol.tasks]
+    return {"attributes": writer.encode_attributes(run_protocol.__dict__, label="protocol", skip=["tasks"]),
+            "tasks": tasks}
+
+
+def decode_protocol(reader, node):
+    """ Create the ``Protocol`` instance of the header node `node`.
+    """
+
+    attributes = {key: reader.decode(item) for key, item in node["attributes"].items()}
+    # Nested task configs (e.g. methods defined in the protocol) are configobj sections, as for protocol files.
+    tasks = [protocol.ProtocolTask(name=task["name"], tags=task["tags"], type=task["type"], method=task["method"],
+                                   config=configobj.ConfigObj(reader.decode(task["config"])))
+             for task in node["tasks"]]
+    return protocol.Protocol(file=attributes.pop("file", None), name=attributes.pop("name", None), tasks=tasks,
+                             config=attributes)
+
+
+def encode_plate_data(writer, data, label):
+    """ Encode the ``PlateData`` instance `data` as header node, and write its arrays.
+    """
+
+    if isinstance(data, readout.LazyReadout):
+        data = data.load()
+    data_class = type(data)
+    skip = DERIVED_ATTRIBUTES.get(data_class, [])
+    return {"module": data_class.__module__, "class": data_class.__name__,
+            "attributes": writer.encode_attributes(data.__dict__, label=label, skip=skip)}
+
+
+def get_plate_data_class(node):
+    """ Get the ``PlateData`` class of a plate data header node.
+    """
+
+    if not node["module"].startswith("hts."):
+        raise ValueError("Plate data class {}.{} is not part of hts.".format(node["module"], node["class"]))
+    data_class = getattr(importlib.import_module(node["module"]), node["class"])
+    if not issubclass(data_class, plate_data.PlateData):
+        raise ValueError("{}.{} is not a PlateData class.".format(node["module"], node["class"]))
+    return data_class
+
+
+def read_header(path):
+    """ Read the header of the container at `path`.
+
+    Returns:
+        dict: With keys "format_version", "run", "plate_data" and "plates".
+    """
+
+    with zipfile.ZipFile(path) as zip_file:
+        return _read_header(zip_file, path)
+
+
+def _read_header(zip_file, path):
+
+    header = json.loads(zip_file.read(HEADER_MEMBER).decode())
+    if header["format_version"] not in READABLE_FORMAT_VERSIONS:
+        raise Exception("Run container {} has format version {}, but only versions {} can be read."
+                        "".format(path, header["format_version"], READABLE_FORMAT_VERSIONS))
+    return header
+
+
+def read(path, plate_names=None, readout_tags=None, allow_pickle=False):
+    """ Read a run from the container at `path`. Only the arrays of the selected plates and readouts are read.
+
+    Args:
+        path (str): Path to the container file.
+        plate_names (list of str): The names of the plates to load. If None, all plates are loaded.
+        readout_tags (list of str): The readout data tags to load. If None, all readout data tags are loaded.
+        allow_pickle (bool): If True, read the pickled arrays of format version 1 containers. Unpickling may
+                             execute arbitrary code: only use for trusted containers.
+
+    Returns:
+        run.Run
+    """
+
+    from hts.run.run import Run
+
+    with zipfile.ZipFile(path) as zip_file:
+        header = _read_header(zip_file, path)
+        reader = _Reader(zip_file, allow_pickle=allow_pickle)
+
+        plate_nodes = header["plates"]
+        if plate_names is not None:
+            plate_nodes_by_name = {node["name"]: node for node in plate_nodes}
+            missing_plate_names = [i for i in plate_names if i not in plate_nodes_by_name]
+            if missing_plate_names:
+                raise ValueError("Plates {} are not in the run container {}.".format(missing_plate_names, path))
+            plate_nodes = [plate_nodes_by_name[i] for i in plate_names]
+
+        plate_data_instances = {}
+        plates = []
+        for plate_node in plate_nodes:
+            i_plate = plate.Plate.__new__(plate.Plate)
+            i_plate.__dict__.update({key: reader.decode(node) for key, node in plate_node["attributes"].items()})
+            for key, position in plate_node["plate_data"].items():
+                if position not in plate_data_instances:
+                    plate_data_instances[position] = decode_plate_data(reader, header["plate_data"][position],
+                                                                       readout_tags=readout_tags)
+                setattr(i_plate, key, plate_data_instances[position])
+            plates.append(i_plate)
+
+        # The constructor is not called: all run attributes are restored, and the protocol was applied before writing.
+        run = Run.__new__(Run)
+        run.__dict__.update({key: reader.decode(node) for key, node in header["run"].items()})
+        if "protocol" in header:
+            run._protocol = decode_protocol(reader, header["protocol"])
+        run.plates = collections.OrderedDict((i_plate.name, i_plate) for i_plate in plates)
+        if "config_data" not in run.__dict__:
+            run.config_data = {}
+    return run
+
+
+def decode_plate_data(reader, node, readout_tags=None):
+    """ Create the ``PlateData`` instance of the header node `node`.
+
+    Args:
+        reader (_Reader): The reader of the container.
+        node (dict): A plate data header node.
+        readout_tags (list of str): If not None, only load these data tags of readouts.
+    """
+
+    data_class = get_plate_data_class(node)
+    attributes = node["attributes"]
+    if readout_tags is not None and issubclass(data_class, readout.Readout) and "data" in attributes:
+        attributes = dict(attributes)
+        attributes["data"] = {"dict": [[key, item] for key, item in attributes["data"]["dict"]
+                                       if key in readout_tags]}
+
+    data = data_class.__new__(data_class)
+    data.__dict__.update({key: reader.decode(item) for key, item in attributes.items()})
+    return data
@@ -8,157 +8,283 @@
 
 import collections
 import csv
+import gzip
 import io
 import itertools
 import logging
-import re
+import os
+import pickle
 
+import numpy as np
 import pandas as pd
 
-from hts.plate import plate
-from hts.plate_data import plate_data, readout
+from hts.plate import plate, well_name_codec
+from hts.plate_data import plate_data, readout, readout_store
 from hts.run.constants import *
 
 LOG = logging.getLogger(__name__)
 
+RUN_STORE_SKELETON_FILE = "run.pickle"
+
 
 ################################## READ RUN DATA  #########################
 
 def convert_well_id_format(well, read="letternumber"):
+    """ Convert a human readable well name (e.g. "A01") to a 0-based coordinate (row, column).
 
-    if read=="letternumber":
-        p = re.compile("([A-Za-z]+)(\d+)")
-        match = p.match(well)
-        row = match.group(1)
-        column = str(int(match.group(2)))
-        well_id = plate.TRANSLATE_HUMANREADABLE_COORDINATE[(row, column)]
+    For many well names, use `well_name_codec.decode`.
+    """
 
-    return well_id
+    if read != "letternumber":
+        raise ValueError("Well id format {} is not implemented.".format(read))
+    return plate.translate_humanreadable_coordinate(well)
 
 
-def read_csv(file, column_plate_name, column_well, columns_readout, columns_meta, width, height, delimiter=",", remove_empty_row=True):
+def read_csv(file, column_plate_name, column_well, columns_readout, columns_meta, width, height, delimiter=",",
+             remove_empty_row=True, chunksize=100000):
     """Read run data file in csv format, with one row for each well.
 
     E.g.:
     Plate ID,Well ID,Compound,,Data_0,Data_1,signal
     XYZ005,A001,Glucose,,4444,5555,0.3
 
+    The file is streamed in chunks of `chunksize` rows. The values of each chunk are scattered directly into
+    preallocated arrays per plate, such that memory is bounded by the chunk size and the plate data.
+
     Attributes:
         file (str): The path to the file.
         column_plate_name (str): The column with plate name information.
         column_well (str): The column with well coordinate information.
         columns_readouts (list of str): Columns with readout data.
         columns_metas (list of str): Columns with meta data.
+        chunksize (int): The number of rows read at once.
     """
 
-    data = collections.defaultdict(dict)
-
     with open(file, 'r') as fh:
-        reader = csv.reader(fh, delimiter=delimiter)
-        header = next(reader)
-
-        try:
-            column_id_plate_name = header.index(column_plate_name)
-            column_id_well = header.index(column_well)
-            columns_id_readouts = [header.index(i) for i in columns_readout]
-            columns_id_metas = [header.index(i) for i in columns_meta]
-        except:
-            raise Exception('Please check column_plate_name {}, column_well {}, and columns_save {}. No match '
-                            'in the header {} found.'.format(column_plate_name, column_well, columns_readout, columns_meta, header))
-
-        for line in reader:
-            if remove_empty_row and (line == [] or set(line) == {''}):
+        header = next(csv.reader(fh, delimiter=delimiter))
+
+    try:
+        column_id_plate_name = header.index(column_plate_name)
+        column_id_well = header.index(column_well)
+        columns_id_readouts = [header.index(i) for i in columns_readout]
+        columns_id_metas = [header.index(i) for i in columns_meta]
+    except:
+        raise Exception('Please check column_plate_name {}, column_well {}, and columns_save {}. No match '
+                        'in the header {} found.'.format(column_plate_name, column_well, columns_readout, columns_meta, header))
+
+    # Positions of the used columns in the chunks (pandas keeps the column order of the file).
+    columns_id_used = sorted(set([column_id_plate_name, column_id_well] + columns_id_readouts + columns_id_metas))
+    position = {column_id: i for i, column_id in enumerate(columns_id_used)}
+
+    # Per plate (in order of first occurence): readout arrays, meta data arrays and the filled wells.
+    readout_data = collections.OrderedDict()
+    meta_data = {}
+    is_well_filled = {}
+
+    try:
+        chunks = pd.read_csv(file, sep=delimiter, header=0, usecols=columns_id_used, dtype=str,
+                             keep_default_na=False, skip_blank_lines=True, chunksize=int(chunksize))
+        for chunk in chunks:
+            values = chunk.to_numpy(dtype=object)
+            if remove_empty_row:
+                values = values[(values != "").any(axis=1)]
+            if len(values) == 0:
                 continue
-            if len(header) != len(line):
-                raise Exception('Header and rows in {} are not of the same length:\nHeader: {}\nRow: {}'.format(file, header, line))
-            data[line[column_id_plate_name]][convert_well_id_format(line[column_id_well])] = [line[i] for i in columns_id_readouts + columns_id_metas]
-
-
-    # Convert well-wise to plate-wise data and create PlateData and Plate Objects
+            rows, columns = well_name_codec.decode(values[:, position[column_id_well]])
+            plate_names = values[:, position[column_id_plate_name]]
+            for plate_name in pd.unique(plate_names):
+                is_plate = plate_names == plate_name
+                plate_rows, plate_columns = rows[is_plate], columns[is_plate]
+                if plate_name not in readout_data:
+                    readout_data[plate_name] = {i: np.full((height, width), np.nan) for i in columns_readout}
+                    meta_data[plate_name] = {i: np.empty((height, width), dtype=object) for i in columns_meta}
+                    is_well_filled[plate_name] = np.zeros((height, width), dtype=bool)
+                for column_name, column_id in zip(columns_readout, columns_id_readouts):
+                    readout_data[plate_name][column_name][plate_rows, plate_columns] = \
+                        readout.to_float_array(values[is_plate, position[column_id]])
+                for column_name, column_id in zip(columns_meta, columns_id_metas):
+                    meta_data[plate_name][column_name][plate_rows, plate_columns] = values[is_plate, position[column_id]]
+                is_well_filled[plate_name][plate_rows, plate_columns] = True
+    except (pd.errors.ParserError, IndexError) as e:
+        raise Exception('Rows in {} do not match the header {}: {}'.format(file, header, e))
+
+    # Create PlateData and Plate Objects
     plates = []
-    for plate_name, plate_data_unstructured in data.items():
-        if len(plate_data_unstructured) != width * height:
-            LOG.error('Plate "{}" is ignored: {} instead of {} wells.'.format(plate_name, len(plate_data_unstructured), width * height))
+    for plate_name, plate_readout_data in readout_data.items():
+        n_wells = is_well_filled[plate_name].sum()
+        if n_wells != width * height:
+            LOG.error('Plate "{}" is ignored: {} instead of {} wells.'.format(plate_name, n_wells, width * height))
             continue
-        plate_data_structured = {}
-        # Shape readout data
-        readout_data = {}
-        for column_name in columns_readout:
-            try:
-                readout_data[column_name] = [[plate_data_unstructured[(row, column)].pop(0) for column in range(width)] for row in range(height)]
-            except:
-                import pdb; pdb.set_trace()
-        plate_data_structured["readout"] = readout.Readout(readout_data)
-        # Shape meta data
-        meta_data = {}
-        for column_name in columns_meta:
-            meta_data[column_name] = [[plate_data_unstructured[(row, column)].pop(0) for column in range(width)] for row in range(height)]
-        plate_data_structured["config_data"] = plate_data.PlateData(meta_data)
-
+        plate_data_structured = {"readout": readout.Readout(plate_readout_data),
+                                 "config_data": plate_data.PlateData(meta_data[plate_name])}
         plates.append(plate.Plate(data=plate_data_structured, name=plate_name, width=width, height=height))
 
-    LOG.info("Number of plates: {}, height: {}, width: {}".format(len(data), 11, 66))
+    LOG.info("Number of plates: {}, height: {}, width: {}".format(len(plates), height, width))
     return plates
 
 
+def read_readout_store(path, mmap_mode="r"):
+    """ Open a run written with `write_readout_store`.
+
+    The readouts of all plates are views into the memory-mapped store, and are only read from disk on access.
+
+    Args:
+        path (str): Path to the store directory.
+        mmap_mode (str): The numpy memory-map mode: "r" (read-only), "r+" (write to the store) or "c" (copy-on-write).
+
+    Returns:
+        run.Run
+    """
+
+    with open(os.path.join(path, RUN_STORE_SKELETON_FILE), "rb") as fh:
+        run = pickle.load(fh)
+
+    store = readout_store.ReadoutStore(path, mmap_mode=mmap_mode)
+    for plate_name, i_plate in run.plates.items():
+        i_plate.readout.data = store.get_data(plate_name)
+
+    return run
 
 
 ################################## WRITE RUN DATA  #########################
 
 
-def serialize_run_for_r(run_data, delimiter = ",", column_name = None):
-    ''' Serialize run data for easy read-in as a data.frame in R.
+def write_readout_store(run, path):
+    """ Write run data as a memory-mappable readout store (see `readout_store`).
 
-    Serialize run data for easy read-in as a data.frame in R, in e.g. csv or
-    tsv format.
+    The readouts go to one array file per data tag. All other run data (e.g. plate layouts, meta data, readout
+    attributes) is pickled without the readout data.
 
-    Attributes:
+    Args:
         run (Run): A ``Run`` instance.
-        delimiter (str): A String instance. Defines the delimiter in the output
-            file (e.g. "," for csv or "\t" for tsv)
+        path (str): Path to the store directory. Created if it does not exist.
+    """
 
-    Returns:
-        str: The serialized run_data as a string.
+    plates = list(run.plates.values())
+    readouts = [i_plate.readout for i_plate in plates]
+    readout_store.write(path=path, readouts=readouts, plate_names=list(run.plates.keys()))
+
+    # Temporarily replace the readouts by copies without data to pickle the remaining object graph.
+    for i_plate, i_readout in zip(plates, readouts):
+        if isinstance(i_readout, readout.LazyReadout):
+            i_readout = i_readout.load()
+        readout_skeleton = readout.Readout.__new__(readout.Readout)
+        readout_skeleton.__dict__.update(i_readout.__dict__)
+        readout_skeleton.data = {}
+        i_plate.readout = readout_skeleton
+    try:
+        with open(os.path.join(path, RUN_STORE_SKELETON_FILE), "wb") as fh:
+            pickle.dump(run, fh)
+    finally:
+        for i_plate, i_readout in zip(plates, readouts):
+            i_plate.readout = i_readout
+
+
+
+def open_output(path):
+    """ Open `path` for writing text. Paths ending with ".gz" are written as gzip compressed stream.
+    """
+
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt")
+    return open(path, "w")
+
+
+def write_run_for_r(run_data, fh, delimiter=",", column_name=None):
+    """ Write run data for easy read-in as a data.frame in R, in e.g. csv or tsv format, to the file handle `fh`.
+
+    One row is written per well and readout. The rows are written per plate and readout, such that the memory use does
+    not depend on the number of plates.
+
+    Args:
+        run_data (Run): A ``Run`` instance.
+        fh (file): A file handle opened for writing text, e.g. by `open_output`, or a ``io.StringIO``.
+        delimiter (str): Defines the delimiter in the output file (e.g. "," for csv or "\t" for tsv)
+        column_name (list of str): The header.
+    """
 
-    ..ToDo: Update to fit current Run class.
-    '''
     if not column_name:
         column_name = [PLATE_HUMAN, WELL_COLUMN_HUMAN, WELL_ROW_HUMAN, WELL_ROW_HUMAN, WELL_COLUMN_MACHINE, WELL_ROW_MACHINE,
                        VALUE_MACHINE, VALUE_TYPE_MACHINE, SAMPLE, SAMPLE_TYPE, SAMPLE_REPLICATE]
 
-    all_data = [column_name]
+    fh.write(delimiter.join(column_name))
+    well_names = {}
     # Iterate over plates
     for i_plate_index, i_plate in run_data.plates.items():
+        shape = (i_plate.height, i_plate.width)
+        if shape not in well_names:
+            row_names, _, _ = get_well_names(*shape)
+            rows, columns = np.indices(shape).reshape(2, -1)
+            well_names[shape] = [[str(i_row + 1) for i_row in rows], list(row_names[rows]), list(columns + 1),
+                                 list(rows + 1)]
+        row_numbers, row_names, column_numbers, row_numbers_machine = well_names[shape]
         # Plates can have different layouts.
         plate_layout_container = i_plate.plate_layout
-        plate_layout = plate_layout_container.data["layout"]
-        layout_general_type = plate_layout_container.data["layout_general_type"]
-        sample_replicate_count = plate_layout_container.data["sample_replicate_count"]
+        plate_layout = plate_layout_container.get_data("layout").ravel().tolist()
+        layout_general_type = plate_layout_container.get_data("layout_general_type").ravel().tolist()
+        sample_replicate_count = plate_layout_container.get_data("sample_replicate_count").ravel().tolist()
         # Iterate over readouts in plates (raw and preprocessed)
-        #import pdb; pdb.set_trace()
         for iReadout_index, iReadout in i_plate.readout.data.items():
-            # Iterate over the x axis ("width") and the y axis ("height")
-            for i_row, i_col in itertools.product(range(i_plate.height), range(i_plate.width)):
-                h_coordinate = plate.translate_coordinate_humanreadable((i_row, i_col))
-                all_data.append([i_plate.name,
-                                h_coordinate[1],
-                                h_coordinate[0],
-                                i_col + 1,
-                                i_row + 1,
-                                i_plate_index,
-                                iReadout[i_row][i_col],
-                                iReadout_index,
-                                plate_layout[i_row][i_col],
-                                layout_general_type[i_row][i_col],
-                                sample_replicate_count[i_row][i_col]])
+            n_well = len(row_numbers)
+            rows = zip([i_plate.name] * n_well, row_numbers, row_names, column_numbers, row_numbers_machine,
+                       [i_plate_index] * n_well, np.asarray(iReadout).ravel().tolist(), [iReadout_index] * n_well,
+                       plate_layout, layout_general_type, sample_replicate_count)
+            fh.write("".join(["\n" + delimiter.join([str(j) for j in i]) for i in rows]))
 
 
+def serialize_run_for_r(run_data, delimiter = ",", column_name = None):
+    ''' Serialize run data for easy read-in as a data.frame in R.
+
+    Serialize run data for easy read-in as a data.frame in R, in e.g. csv or
+    tsv format. See `write_run_for_r` to write to files.
+
+    Attributes:
+        run (Run): A ``Run`` instance.
+        delimiter (str): A String instance. Defines the delimiter in the output
+            file (e.g. "," for csv or "\t" for tsv)
+
+    Returns:
+        str: The serialized run_data as a string.
+    '''
+
+    s = io.StringIO()
+    write_run_for_r(run_data, s, delimiter=delimiter, column_name=column_name)
+    return s.getvalue()
+
 
-    return "\n".join([delimiter.join([str(j) for j in i]) for i in all_data])
+def write_csv_one_row_per_well(run_data, fh, readouts=None, rename_columns_dict=None, **kwargs):
+    """Write run data in csv format, with one row for each well, to the file handle `fh`.
+
+    The rows are written plate by plate, such that the memory use does not depend on the number of plates. The output
+    is that of ``serialize_as_pandas(run_data).to_csv(fh, **kwargs)``.
+
+    Args:
+        run_data (Run): A ``Run`` instance.
+        fh (file): A file handle opened for writing text, e.g. by `open_output`, or a ``io.StringIO``.
+        readouts (list of str): Which readouts will be printed. If not indicated, all readouts are printed.
+        rename_columns_dict (dict): Columns to rename.
+        **kwargs: Keyword arguments of ``pandas.DataFrame.to_csv``.
+    """
+
+    readouts, meta_data = get_serialized_data_tags(run_data, readouts=readouts)
+    header = kwargs.pop("header", True)
+    n_written = 0
+    well_names = {}
+    for i_plate_index, i_plate in enumerate(run_data):
+        columns = serialize_plate_as_arrays(i_plate, i_plate_index, readouts=readouts, meta_data=meta_data,
+                                            well_names=well_names)
+        n_well = len(columns[PLATE_MACHINE])
+        data_frame = pd.DataFrame(columns, index=pd.RangeIndex(n_written, n_written + n_well))
+        if rename_columns_dict or i_plate_index == 0:
+            # Without rename_columns_dict, only warn once.
+            data_frame = rename_pd_columns(data_frame=data_frame, rename_dict=rename_columns_dict)
+        data_frame.to_csv(fh, header=header if i_plate_index == 0 else False, **kwargs)
+        n_written += n_well
 
 
 def serialize_as_csv_one_row_per_well(run_data, readouts=None, rename_columns_dict=None, **kwargs):
-    """Write run data file in csv format, with one row for each well.
+    """Write run data file in csv format, with one row for each well. See `write_csv_one_row_per_well` to write to
+    files.
 
     E.g.:
     Plate ID,Well ID,Compound,,Data_0,Data_1,signal
@@ -171,20 +297,82 @@ def serialize_as_csv_one_row_per_well(run_data, readouts=None, rename_columns_di
         plate_layout_name (str): The name of the plate layout column
     """
 
-    # Get data as pandas.
-    data_frame = serialize_as_pandas(run_data=run_data, readouts=readouts)
+    s = io.StringIO()
+    write_csv_one_row_per_well(run_data, s, readouts=readouts, rename_columns_dict=rename_columns_dict, **kwargs)
+    return s.getvalue()
 
-    # Rename columns on demand.
-    data_frame = rename_pd_columns(data_frame=data_frame, rename_dict=rename_columns_dict)
 
-    # Give back results as csv.
-    s = io.StringIO()
-    data_frame.to_csv(s, **kwargs)
-    string = s.getvalue()
-    return string
+def get_serialized_data_tags(run_data, readouts=None, meta_data=None):
+    """ Get the readout and meta data tags serialized per well: by default, those of the first plate.
+    """
 
+    if readouts == None:
+        readouts = sorted(list(run_data[0].readout.data.keys()))
 
-def serialize_as_pandas(run_data, readouts=None, meta_data=None, well_name_pattern="{}{}", filter_condition=None):
+    if meta_data == None:
+        try:
+            meta_data = sorted(list(run_data[0].meta_data.data.keys()))
+        except:
+            meta_data = []
+
+    return readouts, meta_data
+
+
+def serialize_plate_as_arrays(i_plate, i_plate_index, readouts, meta_data, well_name_pattern="{}{}",
+                              filter_condition=None, well_names=None):
+    """ Serialize the data of one plate as arrays with one element per well (in row-major order).
+
+    Args:
+        i_plate (Plate): The plate.
+        i_plate_index (int): The index of the plate in the run.
+        readouts (list of str): The readouts.
+        meta_data (list of str): The meta data tags.
+        well_name_pattern (str): The pattern of the well names (see `get_well_names`)
+        filter_condition (dict or method): Condition on layout_general_type (e.g. {"eq": "s"}). If not indicated,
+                                           all wells are serialized.
+        well_names (dict): Well names per plate shape, as returned by `get_well_names`. Filled on demand.
+
+    Returns:
+        collections.OrderedDict of np.ndarray: The columns of `serialize_as_pandas`.
+    """
+
+    if well_names is None:
+        well_names = {}
+
+    # Plates can have different layouts. Select wells with plate layout specific conditions.
+    #  layout_general_type has s, neg, pos. layout has s_0, neg_0, pos_0, ...
+    mask = i_plate.plate_layout.get_mask(data_tag="layout_general_type", condition=filter_condition)
+    rows, cols = np.nonzero(mask)
+    if (mask.shape, well_name_pattern) not in well_names:
+        well_names[(mask.shape, well_name_pattern)] = get_well_names(*mask.shape, pattern=well_name_pattern)
+    row_names, column_names, names = well_names[(mask.shape, well_name_pattern)]
+
+    # Here, we decide what data is saved:
+    columns = collections.OrderedDict()
+    columns[SAMPLE] = i_plate.plate_layout.get_data("layout")[rows, cols]
+    columns[SAMPLE_TYPE] = i_plate.plate_layout.get_data("layout_general_type")[rows, cols]
+    columns[WELL_COLUMN_HUMAN] = column_names[cols]
+    columns[WELL_ROW_HUMAN] = row_names[rows]
+    columns[WELL_COLUMN_MACHINE] = cols
+    columns[WELL_ROW_MACHINE] = rows
+    columns[WELL_HUMAN] = names[rows, cols]
+    columns[PLATE_HUMAN] = np.full(len(rows), i_plate.name, dtype=object)
+    columns[PLATE_MACHINE] = np.full(len(rows), i_plate_index)
+    for readout in readouts:
+        if readout in i_plate.readout.data:
+            columns[readout] = i_plate.readout.data[readout][rows, cols]
+        else:
+            columns[readout] = np.full(len(rows), np.nan)
+    for meta in meta_data:
+        if meta in i_plate.meta_data.data:
+            columns[meta] = np.asarray(i_plate.meta_data.data[meta])[rows, cols]
+        else:
+            columns[meta] = np.full(len(rows), None, dtype=object)
+    return columns
+
+
+def serialize_as_pandas(run_data, readouts=None, meta_data=None, well_name_pattern="{}{}", filter_condition=None,
+                        plate_index_offset=0):
     """ Serialize data as pandas with one row == one well.
 
     E.g.:
@@ -196,58 +384,79 @@ def serialize_as_pandas(run_data, readouts=None, meta_data=None, well_name_patte
         plate_name (str): The name of the plate name column
         well_name (str): The name of the well name column
         plate_layout_name (str): The name of the plate layout column
+        filter_condition (dict or method): Condition on layout_general_type (e.g. {"eq": "s"}). If not indicated,
+                                           all wells are serialized.
+        plate_index_offset (int): The plate index of the first plate, e.g. for plates appended to a run.
     """
 
-    if readouts == None:
-        readouts = sorted(list(run_data[0].readout.data.keys()))
+    readouts, meta_data = get_serialized_data_tags(run_data, readouts=readouts, meta_data=meta_data)
 
-    if meta_data == None:
-        try:
-            meta_data = sorted(list(run_data[0].meta_data.data.keys()))
-        except:
-            meta_data = []
+    # The data is collected as whole-plate arrays of the selected wells, and concatenated once.
+    # Well names are created once per plate shape.
+    columns = collections.OrderedDict()
+    well_names = {}
+    for i_plate_index, i_plate in enumerate(run_data):
+        plate_columns = serialize_plate_as_arrays(i_plate, i_plate_index + plate_index_offset, readouts=readouts,
+                                                  meta_data=meta_data, well_name_pattern=well_name_pattern,
+                                                  filter_condition=filter_condition, well_names=well_names)
+        for column, data in plate_columns.items():
+            columns.setdefault(column, []).append(data)
+
+    all_data = collections.OrderedDict((column, np.concatenate(data)) for column, data in columns.items())
+    for column in [SAMPLE, SAMPLE_TYPE, PLATE_HUMAN]:
+        all_data[column] = pd.Categorical(all_data[column])
+    return pd.DataFrame(all_data)
 
-    if filter_condition == None:
-        filter_condition = lambda x: True
 
-    all_data = collections.defaultdict(list)
+def append_data_frame(data_frame, new_rows):
+    """ Append `new_rows` to `data_frame` (both as returned by `serialize_as_pandas`).
 
-    # Iterate over plates
-    for i_plate_index, i_plate in enumerate(run_data):
-        # Plates can have different layouts. Iterate over all wells with plate layout specific conditions.
-        #  layout_general_type has s, neg, pos. layout has s_0, neg_0, pos_0, ...
-        plate_layout = i_plate.plate_layout.data["layout"]
-        plate_layout_general = i_plate.plate_layout.data["layout_general_type"]
-        for i_row, i_col in i_plate.plate_layout.get_wells(data_tag="layout_general_type", condition=filter_condition):
-            h_coordinate = plate.translate_coordinate_humanreadable((i_row, i_col))
-            # Here, we decide what data is saved:
-            all_data[SAMPLE].append(plate_layout[i_row][i_col])
-            all_data[SAMPLE_TYPE].append(plate_layout_general[i_row][i_col])
-            all_data[WELL_COLUMN_HUMAN].append(h_coordinate[2])
-            all_data[WELL_ROW_HUMAN].append(h_coordinate[0])
-            all_data[WELL_COLUMN_MACHINE].append(i_col)
-            all_data[WELL_ROW_MACHINE].append(i_row)
-            all_data[WELL_HUMAN].append(plate.translate_coordinate_humanreadable((i_row, i_col), pattern=well_name_pattern))
-            all_data[PLATE_HUMAN].append(i_plate.name)
-            all_data[PLATE_MACHINE].append(i_plate_index)
-            for readout in readouts:
-                if readout in i_plate.readout.data:
-                    try:
-                        all_data[readout].append(i_plate.readout.data[readout][i_row][i_col])
-                    except:
-                        import pdb; pdb.set_trace()
-                else:
-                    all_data[readout].append(None)
-            for meta in meta_data:
-                if meta in i_plate.meta_data.data:
-                    try:
-                        all_data[meta].append(i_plate.meta_data.data[meta][i_row][i_col])
-                    except:
-                        import pdb; pdb.set_trace()
-                else:
-                    all_data[meta].append(None)
+    Categorical columns stay categorical, with the sorted union of the categories.
 
-    return pd.DataFrame(all_data)
+    Returns:
+        pandas.DataFrame: With a new range index.
+    """
+
+    data_frame = data_frame.copy()
+    new_rows = new_rows.copy()
+    for column in data_frame.columns:
+        if isinstance(data_frame[column].dtype, pd.CategoricalDtype) and \
+                isinstance(new_rows[column].dtype, pd.CategoricalDtype):
+            categories = data_frame[column].cat.categories.union(new_rows[column].cat.categories)
+            data_frame[column] = data_frame[column].cat.set_categories(categories)
+            new_rows[column] = new_rows[column].cat.set_categories(categories)
+    return pd.concat([data_frame, new_rows], ignore_index=True)
+
+
+def get_well_names(height, width, pattern="{}{}"):
+    """ Get the human readable row names, column names and well names of a plate.
+
+    Args:
+        height (int): Height of the plate
+        width (int): Width of the plate
+        pattern (str): The pattern of the well names, formatted with the row name and the column number, e.g.
+                       "{}{:03d}" for "A001". If None, well names are tuples (row name, row number, column number), as
+                       returned by ``plate.translate_coordinate_humanreadable``.
+
+    Returns:
+        row_names (np.ndarray of str), column_names (np.ndarray of str), well_names (np.ndarray (height x width))
+    """
+
+    row_names = well_name_codec.encode_row_names(np.arange(height)).astype(object)
+    column_names = np.arange(1, width + 1).astype(str).astype(object)
+    rows, columns = np.indices((height, width))
+    padding = well_name_codec.get_padding(pattern)
+    if padding is not None:
+        well_names = well_name_codec.encode(rows, columns, padding=padding).astype(object)
+    else:
+        well_names = np.empty((height, width), dtype=object)
+        for i_row in range(height):
+            for i_column in range(width):
+                if pattern:
+                    well_names[i_row, i_column] = pattern.format(row_names[i_row], i_column + 1)
+                else:
+                    well_names[i_row, i_column] = (row_names[i_row], str(i_row + 1), column_names[i_column])
+    return row_names, column_names, well_names
 
 
 def add_meta_data(run_data, meta_data_kwargs, meta_data_well_name_pattern=None, filter_condition=None,
@@ -268,6 +477,16 @@ def add_meta_data(run_data, meta_data_kwargs, meta_data_well_name_pattern=None,
         for excluded_column in meta_data_exclude_columns:
             meta_data.drop(excluded_column, axis=1, inplace=True)
 
+    # Well names that differ only in case or zero padding (e.g. "a1" and "A001") are joined.
+    padding = well_name_codec.get_padding(meta_data_well_name_pattern)
+    if padding is not None and WELL_HUMAN in meta_data:
+        try:
+            rows, columns = well_name_codec.decode(meta_data[WELL_HUMAN].to_numpy())
+        except ValueError as e:
+            LOG.info("Meta data well names are joined as they are: {}".format(e))
+        else:
+            meta_data[WELL_HUMAN] = well_name_codec.encode(rows, columns, padding=padding).astype(object)
+
     for i in [WELL_HUMAN, PLATE_HUMAN]:
         if len(set(read_data[i]) & set(meta_data[i])) == 0:
             raise Exception("Different {} format: hts data {} and meta_data {}".format(i,
@@ -0,0 +1,105 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from hts.run import ingestion
+from hts.run.run import Run
+
+
+@pytest.fixture
+def path_watched_run_config(tmpdir):
+    """Return the path to a run config with a plate layout, a protocol, and readout csv files for three plates that
+    do not yet exist.
+    """
+    with open(os.path.join(str(tmpdir), "layout.csv"), "w") as fh:
+        fh.write("neg,s_1,pos\nneg,s_2,pos\n")
+    with open(os.path.join(str(tmpdir), "protocol.txt"), "w") as fh:
+        fh.write("name = watch_test\n"
+                 "[normalize]\n    tags = preprocessing,\n    method = calculate_linearly_normalized_signal\n"
+                 "    unnormalized_key = signal\n    normalized_0 = neg\n    normalized_1 = pos\n"
+                 "    normalized_key = normalized\n")
+    with open(os.path.join(str(tmpdir), "run_config.txt"), "w") as fh:
+        fh.write("base_path = {}\n"
+                 "plate_names = p0, p1, p2\n"
+                 "[protocol]\n    path = protocol.txt\n    format = config\n"
+                 "[plate_layout]\n    path = layout.csv\n    format = csv\n"
+                 "[readout]\n    [[signal]]\n        path = .\n        filename = readout_{{}}.csv\n"
+                 "        filenumber = 0, 1, 2\n        format = csv\n".format(str(tmpdir)))
+    return os.path.join(str(tmpdir), "run_config.txt")
+
+
+def write_readout(path_run_config, i_plate, data):
+    np.savetxt(os.path.join(os.path.dirname(path_run_config), "readout_{}.csv".format(i_plate)), data, fmt="%g",
+               delimiter=",")
+
+
+@pytest.mark.no_external_software_required
+def test_watch_folder(path_watched_run_config, tmpdir):
+    metrics_path = os.path.join(str(tmpdir), "qc_metrics.jsonl")
+    published = []
+    watch_folder = ingestion.WatchFolder(path_watched_run_config, metrics_path=metrics_path,
+                                         callbacks=[lambda i_plate, metrics: published.append(metrics["plate"])])
+    assert watch_folder.poll() == []
+
+    write_readout(path_watched_run_config, 1, [[1, 5, 10], [1.1, 5, 10.1]])
+    # Files are ingested once they did not change between two polls.
+    assert watch_folder.poll() == []
+    assert [i_plate.name for i_plate in watch_folder.poll()] == ["p1"]
+    assert list(watch_folder.run.plates.keys()) == ["p1"]
+    assert np.allclose(watch_folder.run.plates["p1"].readout.get_data("normalized"),
+                       (np.array([[1, 5, 10], [1.1, 5, 10.1]]) - 1.05) / 9)
+
+    # The controls of p0 overlap: the plate fails QC.
+    write_readout(path_watched_run_config, 0, [[1, 5, 2], [3, 5, 4]])
+    write_readout(path_watched_run_config, 2, [[1, 5, 10], [1, 5, 10.2]])
+    watch_folder.poll()
+    run = watch_folder.watch(poll_interval=0, max_polls=2)
+
+    assert list(run.plates.keys()) == ["p1", "p0", "p2"]
+    assert published == ["p1", "p0", "p2"]
+    assert [watch_folder.qc_metrics[i]["is_failed"] for i in ["p0", "p1", "p2"]] == [True, False, False]
+    assert watch_folder.qc_metrics["p2"]["n_failed_rolling"] == 1
+    with open(metrics_path) as fh:
+        metrics = [json.loads(line) for line in fh]
+    assert [i["plate"] for i in metrics] == ["p1", "p0", "p2"]
+    assert metrics[1]["z_prime_factor"] < 0 < metrics[0]["z_prime_factor"]
+    assert metrics[2]["z_prime_factor_rolling_median"] == pytest.approx(metrics[0]["z_prime_factor"])
+
+
+@pytest.mark.no_external_software_required
+def test_watch_folder_failures(path_watched_run_config, monkeypatch):
+
+    def failing_callback(i_plate, metrics):
+        if i_plate.name == "p1":
+            raise RuntimeError("Callback failed.")
+
+    watch_folder = ingestion.WatchFolder(path_watched_run_config, callbacks=[failing_callback])
+    write_readout(path_watched_run_config, 0, [[1, 5, 10], [1.1, 5, 10.1]])
+    write_readout(path_watched_run_config, 1, [[1, 5, 10], [1.2, 5, 10.1]])
+    watch_folder.poll()
+
+    # Plates that fail preprocessing are removed from the run again, and stay pending.
+    def failing_preprocess(self, plates=None):
+        raise RuntimeError("Preprocessing failed.")
+    with monkeypatch.context() as m:
+        m.setattr(Run, "preprocess", failing_preprocess)
+        assert watch_folder.poll() == []
+    assert list(watch_folder.run.plates.keys()) == []
+    assert list(watch_folder.pending.keys()) == ["p0", "p1", "p2"]
+    assert str(watch_folder.failures["p0"][1]) == "Preprocessing failed."
+    # Failed plates are retried once their files change.
+    assert watch_folder.poll() == []
+    write_readout(path_watched_run_config, 0, [[1, 5, 10], [1.1, 5, 10.2]])
+    write_readout(path_watched_run_config, 1, [[1, 5, 10], [1.2, 5, 10.2]])
+    watch_folder.poll()
+
+    # A failing callback does not stop the ingestion.
+    assert [i_plate.name for i_plate in watch_folder.poll()] == ["p0", "p1"]
+    assert list(watch_folder.run.plates.keys()) == ["p0", "p1"]
+    assert list(watch_folder.pending.keys()) == ["p2"]
+    assert list(watch_folder.failures.keys()) == ["p1"]
+    assert watch_folder.failures["p1"][0] is None
+    assert str(watch_folder.failures["p1"][1]) == "Callback failed."
+    assert watch_folder.qc_metrics["p1"]["is_failed"] is False
@@ -0,0 +1,103 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from hts.plate.plate import Plate
+from hts.plate_data.plate_layout import PlateLayout
+from hts.plate_data.readout import Readout
+from hts.run import parallel
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", parallel.EXECUTORS)
+def test_map_ordered(executor):
+    kwargs_list = [{"value": i} for i in range(20)]
+    assert parallel.map_ordered(dict, kwargs_list, executor=executor, max_workers=4) == kwargs_list
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", parallel.EXECUTORS)
+def test_map_ordered_errors(executor):
+    kwargs_list = [{"year": 2016, "month": 1, "day": day} for day in [1, 40, 50]]
+    labels = ["file_1", "file_2", "file_3"]
+    # The first failure is raised as is, with its label.
+    with pytest.raises(ValueError) as e:
+        parallel.map_ordered(datetime.date, kwargs_list, executor=executor, labels=labels)
+    assert e.value.__notes__ == ["file_2"]
+    with pytest.raises(ValueError):
+        parallel.map_ordered(datetime.date, kwargs_list[:2], executor=executor, labels=labels, collect_errors=True)
+
+    with pytest.raises(parallel.TaskErrors) as e:
+        parallel.map_ordered(datetime.date, kwargs_list, executor=executor, labels=labels, collect_errors=True)
+    assert "2 of 3 tasks failed" in str(e.value)
+    assert "file_2: ValueError" in str(e.value)
+    assert "file_1" not in str(e.value)
+    assert [(label, type(error)) for label, error in e.value.errors] == [("file_2", ValueError), ("file_3", ValueError)]
+
+
+@pytest.mark.no_external_software_required
+def test_map_ordered_serial_stops_at_first_error():
+    calls = []
+
+    def create_date(**kwargs):
+        calls.append(kwargs["day"])
+        return datetime.date(**kwargs)
+
+    with pytest.raises(ValueError):
+        parallel.map_ordered(create_date, [{"year": 2016, "month": 1, "day": day} for day in [1, 40, 2]])
+    assert calls == [1, 40]
+
+
+@pytest.mark.no_external_software_required
+def test_map_ordered_unknown_executor():
+    with pytest.raises(ValueError):
+        parallel.map_ordered(dict, [{}], executor="gpu")
+
+
+def create_plates():
+    random = np.random.RandomState(0)
+    layout = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    return [Plate(data={"readout": Readout(data={"signal": random.normal(size=(2, 3))}), "plate_layout": layout},
+                  name="p{}".format(i), height=2, width=3) for i in range(5)]
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", parallel.EXECUTORS)
+def test_preprocess_plates(executor):
+    kwargs = {"data_tag_readout": "signal", "sample_tag_null_distribution": "neg", "data_tag_standard_score": "score",
+              "data_tag_p_value": "p_value", "is_higher_value_better": "True"}
+    expected = create_plates()
+    for i_plate in expected:
+        i_plate.preprocess("calculate_significance_compared_to_null_distribution", **kwargs)
+
+    plates = create_plates()
+    parallel.preprocess_plates(plates, "calculate_significance_compared_to_null_distribution", kwargs,
+                               executor=executor, max_workers=2)
+    for i_plate, expected_plate in zip(plates, expected):
+        assert list(i_plate.readout.data.keys()) == ["signal", "score", "p_value"]
+        for data_tag, data in expected_plate.readout.data.items():
+            assert np.array_equal(i_plate.readout.get_data(data_tag), data)
+        assert i_plate.readout.get_data("p_value").flags.writeable
+
+    with pytest.raises(Exception) as e:
+        parallel.preprocess_plates(plates, "calculate_linearly_normalized_signal",
+                                   {"unnormalized_key": "missing", "normalized_0": "neg", "normalized_1": "pos",
+                                    "normalized_key": "normalized"}, executor=executor)
+    assert "missing" in str(e.value)
+
+
+@pytest.mark.no_external_software_required
+def test_preprocess_plates_serial_raises_method_error(monkeypatch):
+    preprocessed = []
+
+    def check_plate(self):
+        if self.name == "p1":
+            raise ValueError("Plate {} is invalid.".format(self.name))
+        preprocessed.append(self.name)
+
+    monkeypatch.setattr(Plate, "check_plate", check_plate, raising=False)
+    # The error of the plate method is raised as is, and the remaining plates are not preprocessed.
+    with pytest.raises(ValueError):
+        parallel.preprocess_plates(create_plates(), "check_plate", {}, executor="serial")
+    assert preprocessed == ["p0"]
@@ -1,9 +1,15 @@
 import collections
+import gzip
 import os
+import numpy as np
 import pytest
 
 from hts.paths import DATA_DIRECTORY
+from hts.plate.plate import Plate
+from hts.plate_data.plate_layout import PlateLayout
+from hts.plate_data.readout import Readout
 from hts.run import run, run_io
+from hts.run.constants import *
 
 # Test file names
 TEST_FOLDER_LUMINESCENCE_CSV = "luminescence_cell_viability_QC"
@@ -62,3 +68,74 @@ def test_read_run_data(path_raw):
     assert test_data.readout.data["Data0"][2][1] == 11822
     assert test_data.meta_data.data["Data2"][5][7] == "8.35"
 
+
+
+@pytest.mark.no_external_software_required
+def test_read_csv_chunked(tmpdir):
+    path = os.path.join(str(tmpdir), "run.csv")
+    with open(path, "w") as fh:
+        fh.write("Plate ID,Well ID,Compound,,Data0,Data1\n")
+        for plate_name in ["P2", "P1"]:
+            for row, column in [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]:
+                fh.write("{},{}{:03d},c_{}{},,{},{}\n".format(plate_name, "AB"[row], column + 1, row, column,
+                                                             10 * row + column, "" if column == 2 else plate_name[1]))
+            fh.write(",,,,,\n\n")
+        # Plate P3 is incomplete, and hence ignored.
+        fh.write("P3,A1,c,,1,1\n")
+
+    for chunksize in [1, 5, 100]:
+        test_plates = run_io.read_csv(file=path, column_plate_name="Plate ID", column_well="Well ID",
+                                      columns_readout=["Data0", "Data1"], columns_meta=["Compound"], width=3, height=2,
+                                      chunksize=chunksize)
+        assert [i.name for i in test_plates] == ["P2", "P1"]
+        assert test_plates[0].readout.get_data("Data0").tolist() == [[0, 1, 2], [10, 11, 12]]
+        assert np.isnan(test_plates[1].readout.get_data("Data1")[:, 2]).all()
+        assert test_plates[1].readout.get_data("Data1")[0, 0] == 1
+        assert test_plates[1].config_data.get_data("Compound")[1, 2] == "c_12"
+
+
+@pytest.mark.no_external_software_required
+def test_serialize_as_pandas():
+    layout_1 = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    layout_2 = PlateLayout(layout=[["pos", "s_1", "neg"], ["pos", "s_3", "neg"]])
+    plates = [Plate(data={"readout": Readout(data={"1": np.arange(6).reshape(2, 3) + 10 * i_plate}),
+                          "plate_layout": layout}, name=name, height=2, width=3)
+              for i_plate, (name, layout) in enumerate([("p1", layout_1), ("p2", layout_2)])]
+    plates[1].readout.add_data(data={"2": np.ones((2, 3))}, tag="2")
+    test_run = run.Run(plates=plates)
+
+    data_frame = run_io.serialize_as_pandas(test_run, readouts=["1", "2"], well_name_pattern="{}{:03d}")
+    assert list(data_frame.columns) == [SAMPLE, SAMPLE_TYPE, WELL_COLUMN_HUMAN, WELL_ROW_HUMAN, WELL_COLUMN_MACHINE,
+                                        WELL_ROW_MACHINE, WELL_HUMAN, PLATE_HUMAN, PLATE_MACHINE, "1", "2"]
+    assert len(data_frame) == 12
+    for column in [SAMPLE, SAMPLE_TYPE, PLATE_HUMAN]:
+        assert data_frame[column].dtype == "category"
+    well = data_frame.iloc[7]
+    assert (well[SAMPLE], well[SAMPLE_TYPE], well[WELL_HUMAN], well[WELL_ROW_HUMAN], well[WELL_COLUMN_HUMAN]) == \
+           ("s_1", "s", "A002", "A", "2")
+    assert (well[WELL_ROW_MACHINE], well[WELL_COLUMN_MACHINE], well[PLATE_HUMAN], well[PLATE_MACHINE]) == (0, 1, "p2", 1)
+    assert (well["1"], well["2"]) == (11, 1)
+    assert data_frame["2"][:6].isnull().all()
+
+    samples = run_io.serialize_as_pandas(test_run, readouts=["1"], filter_condition={"eq": "s"})
+    assert samples[WELL_HUMAN].tolist() == ["A2", "B2"] * 2
+    assert samples["1"].tolist() == [1, 4, 11, 14]
+    assert samples.groupby(SAMPLE, observed=True)["1"].mean().to_dict() == {"s_1": 6, "s_2": 4, "s_3": 14}
+
+
+@pytest.mark.no_external_software_required
+def test_write_csv_streaming(tmpdir):
+    layout = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    plates = [Plate(data={"readout": Readout(data={"1": np.arange(6).reshape(2, 3) + 10 * i_plate}),
+                          "plate_layout": layout}, name="p{}".format(i_plate), height=2, width=3)
+              for i_plate in range(3)]
+    test_run = run.Run(plates=plates)
+
+    path = os.path.join(str(tmpdir), "data.csv.gz")
+    test_run.write(format="csv_one_well_per_row", path=path)
+    with gzip.open(path, "rt") as fh:
+        assert fh.read() == run_io.serialize_as_pandas(test_run).to_csv()
+
+    lines = test_run.write(format="csv", return_string=True).split("\n")
+    assert len(lines) == 1 + 3 * 6
+    assert lines[8].split(",")[:8] == ["p1", "1", "A", "2", "1", "p1", "11.0", "1"]
@@ -1,9 +1,18 @@
 import os
+import threading
+import zipfile
 
+import numpy as np
+import pandas as pd
 import pytest
+from hts.data_tasks import data_normalization
 from hts.paths import DATA_DIRECTORY
+from hts.plate.plate import Plate
+from hts.plate_data import plate_data_io
 from hts.plate_data.plate_layout import PlateLayout
-from hts.protocol.protocol import Protocol
+from hts.plate_data.readout import Readout
+from hts.protocol.protocol import Protocol, ProtocolTask
+from hts.run import run_container
 from hts.run.run import Run
 
 # Test file names
@@ -122,3 +131,421 @@ def test_load_siRNA_multiple(path_run):
     test_qc = test_run.qc()
 
 
+@pytest.mark.no_external_software_required
+def test_readout_and_layout_stack():
+    layout_1 = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    layout_2 = PlateLayout(layout=[["pos", "s_1", "neg"], ["pos", "s_3", "neg"]])
+    plates = [Plate(data={"readout": Readout(data={"1": [[1, 2, 3], [4, 5, 6]]}), "plate_layout": layout},
+                    name=name, height=2, width=3) for name, layout in [("p1", layout_1), ("p2", layout_1), ("p3", layout_2)]]
+    test_run = Run(plates=plates)
+
+    assert test_run.get_readout_stack("1").shape == (3, 2, 3)
+    codes, vocabulary = test_run.get_layout_stack(data_tag="layout")
+    assert codes.shape == (3, 2, 3)
+    assert vocabulary.tolist() == ["neg", "pos", "s_1", "s_2", "s_3"]
+    for i_plate, plate in enumerate(plates):
+        assert (vocabulary[codes[i_plate]] == plate.plate_layout.get_data("layout")).all()
+
+    filter_args = {"condition_data_type": "plate_layout", "condition_data_tag": "layout_general_type",
+                   "condition": {"eq": "neg"}, "value_data_type": "readout", "value_data_tag": "1"}
+    assert test_run.filter(**filter_args) == [plate.filter(**filter_args) for plate in plates]
+    assert test_run.filter(**filter_args) == [[1.0, 4.0], [1.0, 4.0], [3.0, 6.0]]
+
+    for i_plate, plate in enumerate(plates):
+        plate.readout.add_data(data={"2": np.full((2, 3), i_plate + 1.0)}, tag="2")
+    data_normalization.calculate_local_ssmd(test_run, data_tag_mean_pos="1", data_tag_mean_neg="2",
+                                            data_tag_std_pos="2", data_tag_std_neg="2", data_tag_ssmd="ssmd")
+    for plate in plates:
+        plate.calculate_local_ssmd(data_tag_mean_pos="1", data_tag_mean_neg="2", data_tag_std_pos="2",
+                                   data_tag_std_neg="2", data_tag_ssmd="ssmd_plate")
+        assert np.array_equal(plate.readout.get_data("ssmd"), plate.readout.get_data("ssmd_plate"))
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("method, config", [
+    ("calculate_linearly_normalized_signal", {"unnormalized_key": "donor", "normalized_0": "buffer",
+                                              "normalized_1": "fluorophore_donor", "normalized_key": "normalized"}),
+    ("calculate_net_fret", {"donor_channel": "donor", "acceptor_channel": "acceptor", "net_fret_key": "net_fret"}),
+    ("calculate_control_normalized_signal", {"data_tag_readout": "acceptor", "negative_control_key": "buffer",
+                                             "positive_control_key": "fluorophore_acceptor",
+                                             "data_tag_normalized_readout": "normalized", "local": "False"}),
+    ("calculate_significance_compared_to_null_distribution", {
+        "data_tag_readout": "acceptor", "sample_tag_null_distribution": ["buffer", "fluorophore_donor"],
+        "data_tag_standard_score": "score", "data_tag_p_value": "p_value", "is_higher_value_better": "True"}),
+])
+def test_batched_preprocessing(method, config):
+    random = np.random.RandomState(0)
+    layout_1 = PlateLayout(layout=[["buffer", "fluorophore_donor", "fluorophore_acceptor", "s_1"],
+                                   ["buffer", "fluorophore_donor", "fluorophore_acceptor", "s_2"]])
+    layout_2 = PlateLayout(layout=[["s_1", "fluorophore_acceptor", "fluorophore_donor", "buffer"],
+                                   ["fluorophore_acceptor", "fluorophore_donor", "buffer", "buffer"]])
+    runs = []
+    for _ in range(2):
+        plates = [Plate(data={"readout": Readout(data={"donor": random.normal(size=(2, 4)),
+                                                       "acceptor": random.normal(size=(2, 4))}),
+                              "plate_layout": layout}, name="p{}".format(i), height=2, width=4)
+                  for i, layout in enumerate([layout_1, layout_2, layout_1])]
+        runs.append(Run(plates=plates))
+    # Both runs have the same readouts.
+    for plate_1, plate_2 in zip(runs[0].plates.values(), runs[1].plates.values()):
+        plate_2.readout.data = {tag: data.copy() for tag, data in plate_1.readout.data.items()}
+
+    data_normalization.BATCHED_PREPROCESSING[method](runs[0], **config)
+    for i_plate in runs[1].plates.values():
+        i_plate.preprocess(method, **config)
+
+    for plate_1, plate_2 in zip(runs[0].plates.values(), runs[1].plates.values()):
+        assert sorted(plate_1.readout.data.keys()) == sorted(plate_2.readout.data.keys())
+        for tag in plate_1.readout.data:
+            assert np.array_equal(plate_1.readout.get_data(tag), plate_2.readout.get_data(tag))
+
+
+@pytest.mark.no_external_software_required
+def test_batched_preprocessing_batches(monkeypatch):
+    monkeypatch.setattr(data_normalization, "BATCH_SIZE", 2)
+    plates = []
+    for i, (height, width) in enumerate([(2, 3), (2, 3), (2, 3), (1, 3), (2, 3)]):
+        layout = [["neg", "pos", "s_1"]] * height
+        plates.append(Plate(data={"readout": Readout(data={"1": np.full((height, width), float(i))}),
+                                  "plate_layout": PlateLayout(layout=layout)},
+                            name="p{}".format(i), height=height, width=width))
+    test_run = Run(plates=plates)
+
+    batches = data_normalization.get_batches(plates)
+    assert [[i_plate.name for i_plate in batch] for batch in batches] == [["p0", "p1"], ["p2"], ["p3"], ["p4"]]
+    with pytest.raises(ValueError):
+        data_normalization.stack_readouts(plates, "1")
+
+    data_normalization.calculate_control_normalized_signal(test_run, data_tag_readout="1", negative_control_key="neg",
+                                                           positive_control_key="pos",
+                                                           data_tag_normalized_readout="normalized", local="False")
+    for i_plate in plates:
+        normalized = i_plate.readout.get_data("normalized")
+        assert normalized.shape == (i_plate.height, i_plate.width)
+        # The results are copies, not views on the stack of the batch.
+        assert normalized.base is None
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", ["serial", "thread"])
+def test_perform_preprocessing_task_gaussian_process_normalization(executor, monkeypatch):
+    threads = {}
+
+    def calculate_control_normalized_signal(self, local, **kwargs):
+        threads[self.name] = threading.current_thread()
+    monkeypatch.setattr(Plate, "calculate_control_normalized_signal", calculate_control_normalized_signal)
+    plates = [Plate(data={"readout": Readout(data={"1": np.full((2, 3), float(i))}),
+                          "plate_layout": PlateLayout(layout=[["neg", "pos", "s_1"]] * 2)},
+                    name="p{}".format(i), height=2, width=3) for i in range(3)]
+    test_run = Run(plates=plates)
+    task = ProtocolTask(name="normalize", tags=["preprocessing"], type="preprocessing",
+                        method="calculate_control_normalized_signal",
+                        config={"data_tag_readout": "1", "negative_control_key": "neg", "positive_control_key": "pos",
+                                "local": True})
+
+    # The Gaussian process normalization is performed plate by plate, with the executor.
+    test_run.perform_preprocessing_task(task, executor=executor, max_workers=2)
+    assert sorted(threads) == ["p0", "p1", "p2"]
+    assert all((thread is threading.main_thread()) == (executor == "serial") for thread in threads.values())
+
+
+@pytest.mark.no_external_software_required
+def test_readout_store(tmpdir):
+    layout = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    plates = [Plate(data={"readout": Readout(data={"1": np.arange(6).reshape(2, 3) + i_plate}),
+                          "plate_layout": layout}, name="p{}".format(i_plate), height=2, width=3)
+              for i_plate in range(3)]
+    plates[1].readout.add_data(data={"2": np.ones((2, 3))}, tag="2")
+    test_run = Run(plates=plates)
+    path = os.path.join(str(tmpdir), "store")
+    test_run.write(format="readout_store", path=path)
+    # The written run keeps its readouts.
+    assert test_run.get_readout_stack("1").sum() == 3 * 15 + 6 * 3
+
+    stored_run = Run.create(origin="readout_store", path=path)
+    assert list(stored_run.plates.keys()) == ["p0", "p1", "p2"]
+    assert np.array_equal(stored_run.get_readout_stack("1"), test_run.get_readout_stack("1"))
+    assert sorted(stored_run.plates["p1"].readout.data.keys()) == ["1", "2"]
+    assert "2" not in stored_run.plates["p0"].readout.data
+    assert stored_run.plates["p2"].plate_layout.get_data("layout").tolist() == layout.get_data("layout").tolist()
+    # Readouts are read-only views into the memory-mapped store.
+    assert not stored_run.plates["p0"].readout.get_data("1").flags.writeable
+
+    stored_plate = Plate.create(format="readout_store", path=path, name="p2")
+    assert stored_plate.readout.get_data("1").tolist() == plates[2].readout.get_data("1").tolist()
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("compress", [False, True])
+def test_run_container(tmpdir, compress):
+    layout = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+    plates = [Plate(data={"readout": Readout(data={"1": np.arange(6).reshape(2, 3) + i_plate,
+                                                   "2": np.full((2, 3), np.nan)}),
+                          "plate_layout": layout}, name="p{}".format(i_plate), height=2, width=3)
+              for i_plate in range(3)]
+    plates[1].readout.add_data(data={"3": np.array([["a", None, "b"], ["c", 1, "d"]], dtype=object)}, tag="3")
+    test_run = Run(plates=plates, plate_names=["p0", "p1", "p2"])
+    path_protocol = os.path.join(str(tmpdir), "protocol.txt")
+    with open(path_protocol, "w") as fh:
+        fh.write("name = normalize\n[normalize]\n    tags = preprocessing,\n"
+                 "    method = calculate_linearly_normalized_signal\n    unnormalized_key = 1\n"
+                 "    normalized_0 = neg\n    normalized_1 = pos\n    normalized_key = normalized\n")
+    test_run.protocol(path=path_protocol, format="config")
+    path = os.path.join(str(tmpdir), "run.zip")
+    test_run.write(format="container", path=path, compress=compress)
+    # The protocol is stored in the container, not referenced by path.
+    os.remove(path_protocol)
+
+    stored_run = Run.create(origin="container", path=path)
+    assert list(stored_run.plates.keys()) == ["p0", "p1", "p2"]
+    assert (stored_run.height, stored_run.width) == (2, 3)
+    assert stored_run.config_data == {"plate_names": ["p0", "p1", "p2"]}
+    assert np.array_equal(stored_run.get_readout_stack("1"), test_run.get_readout_stack("1"))
+    assert np.isnan(stored_run.get_readout_stack("2")).all()
+    assert stored_run.plates["p1"].readout.get_data("3").tolist() == [["a", None, "b"], ["c", 1, "d"]]
+    stored_layout = stored_run.plates["p2"].plate_layout
+    # The plate layout is stored once, and shared on load.
+    assert stored_layout is stored_run.plates["p0"].plate_layout
+    assert stored_layout.get_data("layout").tolist() == layout.get_data("layout").tolist()
+    assert stored_layout.get_data("layout").dtype == object
+    assert stored_layout.get_well_indices("neg").tolist() == [0, 3]
+    stored_run.preprocess()
+    test_run.preprocess()
+    assert np.array_equal(stored_run.get_readout_stack("normalized"), test_run.get_readout_stack("normalized"))
+
+    partial_run = Run.create(origin="container", path=path, plate_names=["p2", "p0"], readout_tags=["1"])
+    assert list(partial_run.plates.keys()) == ["p2", "p0"]
+    assert list(partial_run.plates["p2"].readout.data.keys()) == ["1"]
+    assert partial_run.plates["p2"].readout.get_data("1").tolist() == plates[2].readout.get_data("1").tolist()
+    with pytest.raises(ValueError):
+        Run.create(origin="container", path=path, plate_names=["p3"])
+
+    # Nothing is unpickled, unless requested (e.g. for the pickled object arrays of version 1 containers).
+    with zipfile.ZipFile(path) as zip_file:
+        assert all(not member.endswith(".npy") or
+                   not np.lib.format.read_array(zip_file.open(member), allow_pickle=False).dtype.hasobject
+                   for member in zip_file.namelist())
+    path_pickled = os.path.join(str(tmpdir), "pickled.zip")
+    with zipfile.ZipFile(path_pickled, "w") as zip_file:
+        with zip_file.open("arrays/0.npy", "w") as fh:
+            np.lib.format.write_array(fh, np.array([["a", None]], dtype=object), allow_pickle=True)
+    with zipfile.ZipFile(path_pickled) as zip_file:
+        node = {"array": "arrays/0.npy", "object": "pickle"}
+        with pytest.raises(ValueError):
+            run_container._Reader(zip_file).read_array(node)
+        assert run_container._Reader(zip_file, allow_pickle=True).read_array(node).tolist() == [["a", None]]
+
+
+@pytest.mark.no_external_software_required
+def test_append_plates(tmpdir):
+    path_protocol = os.path.join(str(tmpdir), "protocol.txt")
+    with open(path_protocol, "w") as fh:
+        fh.write("name = append_test\n"
+                 "[normalize]\n    tags = preprocessing,\n    method = calculate_linearly_normalized_signal\n"
+                 "    unnormalized_key = 1\n    normalized_0 = neg\n    normalized_1 = pos\n"
+                 "    normalized_key = normalized\n")
+    layout = PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]])
+
+    def create_run(plate_indices):
+        plates = [Plate(data={"readout": Readout(data={"1": np.arange(6).reshape(2, 3) * (i_plate + 1) + i_plate}),
+                              "plate_layout": layout}, name="p{}".format(i_plate), height=2, width=3)
+                  for i_plate in plate_indices]
+        run = Run(plates=plates)
+        run.protocol(path=path_protocol, format="config")
+        run.preprocess()
+        return run
+
+    test_run = create_run(range(3))
+    assert len(test_run.data_frame) == 18
+    new_plates = list(create_run(range(3, 5)).plates.values())
+    for i_plate in new_plates:
+        del i_plate.readout.data["normalized"]
+    test_run.append_plates(new_plates)
+
+    assert list(test_run.plates.keys()) == ["p0", "p1", "p2", "p3", "p4"]
+    assert test_run.plates["p4"].readout.get_data("normalized").tolist() == [[-0.75, -0.25, 0.25], [0.75, 1.25, 1.75]]
+    pd.testing.assert_frame_equal(test_run.data_frame, create_run(range(5)).data_frame)
+    with pytest.raises(ValueError):
+        test_run.append_plates(create_run([0]).plates.values())
+
+    empty_run = Run(plates=[])
+    empty_run.append_plates([])
+    assert len(empty_run.plates) == 0
+
+
+@pytest.mark.no_external_software_required
+def test_append_plates_merged_replicates(tmpdir):
+    layouts = [PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_2", "pos"]]),
+               PlateLayout(layout=[["neg", "s_1", "pos"], ["neg", "s_3", "pos"]])]
+
+    def create_plates(plate_indices):
+        # The appended plates (3 and 4) hold the replicates of a new sample s_3, and of s_1.
+        return [Plate(data={"readout": Readout(data={"1": np.arange(6).reshape(2, 3) * (i_plate + 1.) + i_plate}),
+                            "plate_layout": layouts[i_plate >= 3]}, name="p{}".format(i_plate), height=2, width=3)
+                for i_plate in plate_indices]
+
+    def merge(run):
+        run.merger_add_data_from_data_frame("sample", columns=["sample_type"])
+        run.merger_summarize_statistical_significance("sample", data_tag_readouts_to_aggregate=["1"])
+        run.merger_rank_samples("sample", ranking_column="1_mean", rank_column_name="rank", rank_threshold=2,
+                                is_hit_by_rank_column_name="is_hit_by_rank", value_threshold=10,
+                                is_hit_by_value_column_name="is_hit_by_value")
+
+    test_run = Run(plates=create_plates(range(3)))
+    merge(test_run)
+    test_run.append_plates(create_plates(range(3, 5)))
+    expected_run = Run(plates=create_plates(range(5)))
+    merge(expected_run)
+
+    merged = test_run._merged_data_frame["sample"]
+    expected = expected_run._merged_data_frame["sample"].sort_values("sample").reset_index(drop=True)
+    assert merged["sample"].tolist() == ["s_1", "s_2", "s_3"]
+    pd.testing.assert_frame_equal(merged[sorted(merged.columns)], expected[sorted(expected.columns)])
+
+    # Runs read from a container have neither aggregates nor merger calls: they are calculated anew.
+    path = os.path.join(str(tmpdir), "run.zip")
+    run_container.write(Run(plates=create_plates(range(3))), path)
+    loaded_run = run_container.read(path)
+    merge(loaded_run)
+    loaded_run.append_plates(create_plates(range(3, 5)))
+    merged = loaded_run._merged_data_frame["sample"]
+    pd.testing.assert_frame_equal(merged[sorted(merged.columns)], expected[sorted(expected.columns)])
+
+    # Nothing is appended if the aggregates cannot be updated.
+    test_run.append_plates([])
+    del test_run._merger_calls
+    with pytest.raises(ValueError):
+        test_run.append_plates(create_plates([5]))
+    assert list(test_run.plates.keys()) == ["p0", "p1", "p2", "p3", "p4"]
+
+
+@pytest.fixture
+def path_csv_run_config(tmpdir):
+    """Return the path to a run config with a plate layout and one readout csv file for each of five plates.
+    """
+    with open(os.path.join(str(tmpdir), "layout.csv"), "w") as fh:
+        fh.write("neg,s_1,pos\nneg,s_2,pos\n")
+    for i_plate in range(5):
+        np.savetxt(os.path.join(str(tmpdir), "readout_{}.csv".format(i_plate)), np.full((2, 3), i_plate), fmt="%d",
+                   delimiter=",")
+    with open(os.path.join(str(tmpdir), "run_config.txt"), "w") as fh:
+        fh.write("base_path = {}\n"
+                 "plate_names = p0, p1, p2, p3, p4\n"
+                 "[plate_layout]\n    path = layout.csv\n    format = csv\n"
+                 "[readout]\n    path = .\n    filename = readout_{{}}.csv\n    filenumber = 0, 1, 2, 3, 4\n"
+                 "    format = csv\n".format(str(tmpdir)))
+    return os.path.join(str(tmpdir), "run_config.txt")
+
+
+@pytest.mark.no_external_software_required
+def test_read_run_from_config_lazy(path_csv_run_config):
+    test_run = Run.create(origin="config", path=path_csv_run_config, lazy=True, cache_size=2)
+    cache = test_run.plates["p0"].readout.cache
+    assert (test_run.height, test_run.width) == (2, 3)
+    assert cache.n_parsed == 0
+    assert test_run.plates["p3"].filter(value_data_type="readout", value_data_tag=None) == [3.0] * 6
+    assert cache.n_parsed == 1
+    assert test_run.get_readout_stack(None)[:, 0, 0].tolist() == [0, 1, 2, 3, 4]
+    assert len(cache.readouts) == 2
+    # Batched preprocessing stacks at most as many lazy readouts as the cache holds.
+    batches = data_normalization.get_batches(list(test_run.plates.values()))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    # Readouts with added data are still evicted, and restored when reparsed.
+    data_normalization.calculate_control_normalized_signal(test_run, data_tag_readout=None,
+                                                           negative_control_key="neg", positive_control_key="s",
+                                                           data_tag_normalized_readout="normalized", local="False")
+    assert len(cache.readouts) == 2
+    assert all("normalized" in i_plate.readout.data for i_plate in test_run.plates.values())
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", ["serial", "thread", "process"])
+def test_read_run_from_config_parallel(path_csv_run_config, executor):
+    test_run = Run.create(origin="config", path=path_csv_run_config, executor=executor, max_workers=2)
+    assert list(test_run.plates.keys()) == ["p0", "p1", "p2", "p3", "p4"]
+    assert test_run.get_readout_stack(None)[:, 0, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", ["serial", "thread", "process"])
+def test_read_run_from_config_excel_multiple_plates_per_file(tmpdir, executor, monkeypatch):
+    class Sheet:
+        def __init__(self, name, value):
+            self.name = name
+            self.nrows = 2
+            self.value = value
+
+        def row_values(self, i):
+            return [self.value] * 3
+
+    class Book:
+        def __init__(self):
+            self.excel_sheets = [Sheet("plate_{}".format(i), float(i)) for i in range(4)]
+
+        def sheets(self):
+            return self.excel_sheets
+
+        def sheet_by_name(self, name):
+            return [i for i in self.excel_sheets if i.name == name][0]
+
+    opened = []
+    pid = os.getpid()
+
+    def open_workbook(path):
+        # Worker processes are sent the sheets of their plates, and never open the workbook.
+        assert os.getpid() == pid
+        opened.append(path)
+        return Book()
+
+    monkeypatch.setattr(plate_data_io.xlrd, "open_workbook", open_workbook)
+    with open(os.path.join(str(tmpdir), "plates.xls"), "w") as fh:
+        fh.write("workbook")
+    with open(os.path.join(str(tmpdir), "run_config.txt"), "w") as fh:
+        fh.write("base_path = {}\n"
+                 "plate_names = p0, p1, p2, p3\n"
+                 "[readout]\n    path = plates.xls\n    tags = plate_0, plate_1, plate_2, plate_3\n"
+                 "    format = excel_multiple_plates_per_file\n".format(str(tmpdir)))
+
+    test_run = Run.create(origin="config", path=os.path.join(str(tmpdir), "run_config.txt"), executor=executor,
+                          max_workers=2)
+    for i, i_plate in enumerate(test_run.plates.values()):
+        assert list(i_plate.readout.data) == ["plate_{}".format(i)]
+        assert i_plate.readout.get_data("plate_{}".format(i)).tolist() == [[float(i)] * 3] * 2
+    assert len(opened) == 1
+
+
+@pytest.mark.no_external_software_required
+def test_read_run_from_config_file_errors(path_csv_run_config):
+    os.remove(os.path.join(os.path.dirname(path_csv_run_config), "readout_2.csv"))
+    # A single failure is raised as the original exception.
+    with pytest.raises(FileNotFoundError) as e:
+        Run.create(origin="config", path=path_csv_run_config, executor="thread")
+    assert "readout_2.csv" in str(e.value)
+
+
+@pytest.mark.no_external_software_required
+@pytest.mark.parametrize("executor", ["serial", "thread"])
+def test_read_run_from_config_parser_error_names_file(path_csv_run_config, executor, monkeypatch):
+    read_csv = plate_data_io.read_csv
+
+    def failing_read_csv(file, **kwargs):
+        if file.endswith("readout_2.csv"):
+            raise ValueError("Cannot parse row 2.")
+        return read_csv(file, **kwargs)
+
+    monkeypatch.setattr(plate_data_io, "read_csv", failing_read_csv)
+    # The original exception is raised, with the plate and its files attached.
+    with pytest.raises(ValueError) as e:
+        Run.create(origin="config", path=path_csv_run_config, executor=executor)
+    assert str(e.value) == "Cannot parse row 2."
+    assert any("Plate p2 (" in note and "readout_2.csv" in note for note in e.value.__notes__)
+
+
+@pytest.mark.no_external_software_required
+def test_read_run_from_config_parse_cache(path_csv_run_config, tmpdir):
+    path_cache = os.path.join(str(tmpdir), "parse_cache")
+    for _ in range(2):
+        test_run = Run.create(origin="config", path=path_csv_run_config, parse_cache=path_cache)
+        assert test_run.get_readout_stack(None)[:, 0, 0].tolist() == [0, 1, 2, 3, 4]
+    # One entry for the layout, and one for each readout.
+    assert len(os.listdir(path_cache)) == 6